@@ -0,0 +1,349 @@
+"""Compact quantized candidate index for the face gallery.
+
+GalleryMatcher asks it for the nearest templates of a query and re-ranks
+those identities exactly against their float32 templates, so the full scan
+runs over compact codes instead of float32 centroids. Build or rebuild it
+from the existing ChromaDB face_db collection:
+
+    python ann_index.py build --kind int8 --db-path ./face_data_db --out ./face_index
+    python ann_index.py eval --index ./face_index --db-path ./face_data_db
+
+and select it per deployment with FACE_INDEX_BACKEND=int8|float16|pca
+(FACE_INDEX_PATH points at the index directory, default ./face_index).
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+INDEX_KINDS = ("int8", "float16", "pca")
+
+_ARRAYS = ("keys", "reids", "codes", "scale", "pca_mean", "pca_components")
+
+# Rows of int8/float16 codes widened to float32 at a time, into one reused buffer
+_WIDEN_ROWS = 4096
+# Up to this many queries int8 codes are scored in place; einsum has no BLAS,
+# so larger batches are faster through widened blocks and one GEMM each
+_EINSUM_QUERIES = 4
+# Initial rows of the delta buffer; it doubles when full
+_DELTA_ROWS = 64
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class QuantizedIndex:
+    """Approximate cosine search over scalar-quantized or PCA-reduced face embeddings.
+
+    kind selects the stored representation:
+      "int8"    - per-dimension symmetric int8 codes (4x smaller than float32)
+      "float16" - half-precision vectors (2x smaller)
+      "pca"     - float32 projections onto the top pca_dim principal
+                  components (512/pca_dim x smaller); the residual is dropped
+
+    Similarities are approximate; callers re-rank the candidates exactly.
+    Arrays are saved as separate .npy files and opened with mmap_mode="r",
+    so opening is instant and only touched pages are read. Vectors added
+    after the build are encoded the same way into a small in-memory delta
+    until the next rebuild; re-added keys shadow their built row.
+    """
+
+    def __init__(self, kind, keys, reids, codes, scale=None, pca_mean=None,
+                 pca_components=None, meta=None):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+        self.kind = kind
+        self.keys = keys
+        self.reids = reids
+        self.codes = codes
+        self.scale = scale
+        self.pca_mean = pca_mean
+        self.pca_components = pca_components
+        self.meta = meta or {}
+        self.dim = int(self.meta.get("dim", pca_components.shape[1] if pca_components is not None
+                                     else codes.shape[1]))
+        self._row_of_key = None
+        self._shadowed = np.zeros(len(keys), dtype=bool)
+        self._delta_keys, self._delta_reids = [], []
+        self._delta_rows = {}       # key -> row in _delta
+        # Preallocated; the first len(_delta_keys) rows are in use
+        self._delta = np.empty((_DELTA_ROWS, codes.shape[1]), dtype=codes.dtype)
+
+    def __len__(self):
+        return len(self.keys) - int(self._shadowed.sum()) + len(self._delta_keys)
+
+    @classmethod
+    def build(cls, keys, reids, embeddings, kind="int8", pca_dim=64):
+        vectors = _normalize(embeddings)
+        keys = np.asarray(keys, dtype=str)
+        reids = np.asarray(reids, dtype=np.int64)
+        meta = {"kind": kind, "dim": int(vectors.shape[1]) if len(vectors) else 0,
+                "count": int(len(vectors)), "built_at": time.time()}
+        if kind == "int8":
+            scale = np.maximum(np.abs(vectors).max(axis=0), 1e-6) / 127.0 if len(vectors) else np.ones(0)
+            index = cls(kind, keys, reids, np.empty((0, vectors.shape[1]), np.int8),
+                        scale=scale.astype(np.float32), meta=meta)
+        elif kind == "float16":
+            index = cls(kind, keys, reids, np.empty((0, vectors.shape[1]), np.float16), meta=meta)
+        elif kind == "pca":
+            mean = vectors.mean(axis=0)
+            sample = vectors[np.random.default_rng(0).permutation(len(vectors))[:20000]] - mean
+            _, _, vt = np.linalg.svd(sample, full_matrices=False)
+            components = vt[:min(pca_dim, vt.shape[0])].astype(np.float32)
+            meta["pca_dim"] = int(components.shape[0])
+            index = cls(kind, keys, reids, np.empty((0, len(components)), np.float32),
+                        pca_mean=mean.astype(np.float32), pca_components=components, meta=meta)
+        else:
+            raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+        index.codes = index._encode(vectors)
+        return index
+
+    def _encode(self, vectors):
+        """Stored codes of unit vectors, in this index's representation."""
+        if self.kind == "int8":
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        if self.kind == "float16":
+            return vectors.astype(np.float16)
+        return ((vectors - self.pca_mean) @ self.pca_components.T).astype(np.float32)
+
+    @classmethod
+    def open(cls, path):
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No gallery index at {path}")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        arrays = {}
+        for name in _ARRAYS:
+            file = os.path.join(path, f"{name}.npy")
+            if os.path.exists(file):
+                arrays[name] = np.load(file, mmap_mode=None if name == "keys" else "r")
+        return cls(meta["kind"], meta=meta, **arrays)
+
+    def save(self, path):
+        """Write the built arrays (not the delta) and swap the directory in atomically."""
+        tmp, old = f"{path}.tmp", f"{path}.old"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in _ARRAYS:
+            value = getattr(self, name)
+            if value is not None:
+                np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(value))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def __contains__(self, key):
+        return key in self._key_rows() or key in self._delta_rows
+
+    def _key_rows(self):
+        if self._row_of_key is None:
+            self._row_of_key = {str(k): i for i, k in enumerate(self.keys)}
+        return self._row_of_key
+
+    def add(self, key, reid, embedding):
+        """Insert or replace one vector; it sits in the delta until the next rebuild."""
+        code = self._encode(_normalize(embedding).reshape(1, self.dim))
+        row = self._key_rows().get(key)
+        if row is not None:
+            self._shadowed[row] = True
+        if key in self._delta_rows:
+            self._delta[self._delta_rows[key]] = code[0]
+            return
+        row = len(self._delta_keys)
+        if row == len(self._delta):
+            grown = np.empty((2 * len(self._delta), self._delta.shape[1]), dtype=self._delta.dtype)
+            grown[:row] = self._delta
+            self._delta = grown
+        self._delta[row] = code[0]
+        self._delta_rows[key] = row
+        self._delta_keys.append(key)
+        self._delta_reids.append(int(reid))
+
+    def _score(self, projected, codes):
+        """(Q, len(codes)) inner products of projected queries with stored codes."""
+        if codes.dtype == np.float32:
+            return projected @ codes.T
+        if codes.dtype == np.int8 and len(projected) <= _EINSUM_QUERIES:
+            # Cast to float32 inside einsum's buffered loop, without copies
+            return np.einsum("qd,nd->qn", projected, codes, dtype=np.float32, casting="unsafe")
+        scores = np.empty((len(projected), len(codes)), dtype=np.float32)
+        widened = np.empty((min(_WIDEN_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), _WIDEN_ROWS):
+            stop = min(start + _WIDEN_ROWS, len(codes))
+            block = widened[:stop - start]
+            np.copyto(block, codes[start:stop], casting="unsafe")
+            np.matmul(projected, block.T, out=scores[:, start:stop])
+        return scores
+
+    def _project(self, queries):
+        if self.kind == "int8":
+            return queries * self.scale
+        if self.kind == "pca":
+            return queries @ self.pca_components.T
+        return queries
+
+    def search(self, queries, k=5):
+        """Top-k (keys, reids, approximate similarities), each shaped (Q, k).
+
+        Missing slots (fewer than k vectors) have key "", reid -1 and
+        similarity -inf.
+        """
+        queries = _normalize(queries).reshape(-1, self.dim)
+        nq = len(queries)
+        out_keys = np.full((nq, k), "", dtype=object)
+        out_reids = np.full((nq, k), -1, dtype=np.int64)
+        out_sims = np.full((nq, k), -np.inf, dtype=np.float32)
+        if nq == 0 or len(self) == 0:
+            return out_keys, out_reids, out_sims
+
+        projected = self._project(queries).astype(np.float32)
+        n = len(self.keys)
+        scores = self._score(projected, self.codes)
+        scores[:, self._shadowed] = -np.inf
+        if self._delta_keys:
+            # Delta rows are numbered after the built ones
+            scores = np.hstack([scores, self._score(projected, self._delta[:len(self._delta_keys)])])
+        if self.kind == "pca":
+            # x.q = (x - mean).q + mean.q; the second term is the same for every row
+            scores += (queries @ self.pca_mean)[:, None]
+
+        k_found = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k_found - 1, axis=1)[:, :k_found]
+        top_sims = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        for q in range(nq):
+            for j, c in enumerate(order[q]):
+                if not np.isfinite(top_sims[q, c]):
+                    break
+                row = int(top[q, c])
+                if row < n:
+                    out_keys[q, j], out_reids[q, j] = str(self.keys[row]), int(self.reids[row])
+                else:
+                    out_keys[q, j], out_reids[q, j] = self._delta_keys[row - n], self._delta_reids[row - n]
+                out_sims[q, j] = top_sims[q, c]
+        return out_keys, out_reids, out_sims
+
+    def nbytes(self):
+        return int(sum(np.asarray(getattr(self, name)).nbytes for name in _ARRAYS[1:]
+                       if getattr(self, name) is not None) + self._delta.nbytes)
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "vectors": len(self),
+            "pending_rebuild": len(self._delta_keys),
+            "index_bytes": self.nbytes(),
+            "built_at": self.meta.get("built_at"),
+            "recall": self.meta.get("recall"),
+        }
+
+
+def evaluate_recall(index, keys, embeddings, k=10, candidates=80, n_queries=200, noise=0.05, seed=0):
+    """Recall@k of index.search against exact float32 search.
+
+    Queries are gallery vectors with Gaussian noise added, standing in for
+    new sightings of enrolled faces. top1_in_candidates is how often the
+    exact nearest vector is among the first `candidates` results, which is
+    what GalleryMatcher re-ranks.
+    """
+    vectors = _normalize(embeddings)
+    if len(vectors) == 0:
+        return {"k": k, "queries": 0, "recall_at_k": None, "top1_agreement": None,
+                "candidates": candidates, "top1_in_candidates": None}
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = _normalize(vectors[picks] + rng.normal(scale=noise, size=(len(picks), vectors.shape[1])))
+    k = min(k, len(vectors))
+
+    exact_sims = queries @ vectors.T
+    exact = np.argpartition(-exact_sims, k - 1, axis=1)[:, :k]
+    exact_top1 = exact_sims.argmax(axis=1)
+    keys = np.asarray(keys, dtype=str)
+    found, _, _ = index.search(queries, max(k, candidates))
+    hits = [len(set(keys[exact[q]]) & set(found[q, :k])) for q in range(len(queries))]
+    return {
+        "k": k,
+        "queries": int(len(queries)),
+        "recall_at_k": float(np.sum(hits) / (len(queries) * k)),
+        "top1_agreement": float(np.mean(found[:, 0] == keys[exact_top1])),
+        "candidates": candidates,
+        "top1_in_candidates": float(np.mean([keys[exact_top1[q]] in set(found[q, :candidates])
+                                             for q in range(len(queries))])),
+    }
+
+
+def read_collection(collection, page_size=10000):
+    """All (keys, reids, embeddings) of a ChromaDB face collection, paged."""
+    keys, reids, embeddings = [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        ids = page.get("ids", [])
+        if not ids:
+            break
+        for key, embedding in zip(ids, page["embeddings"]):
+            keys.append(key)
+            reids.append(int(key.split("_")[1]))
+            embeddings.append(embedding)
+        offset += len(ids)
+    return keys, reids, np.asarray(embeddings, dtype=np.float32)
+
+
+def build_from_collection(collection, path, kind="int8", pca_dim=64):
+    """Build an index from the face_db collection, measure recall and save it."""
+    keys, reids, embeddings = read_collection(collection)
+    if len(embeddings) == 0:
+        raise ValueError("face_db collection is empty, nothing to index")
+    index = QuantizedIndex.build(keys, reids, embeddings, kind=kind, pca_dim=pca_dim)
+    index.meta["recall"] = evaluate_recall(index, keys, embeddings)
+    index.save(path)
+    return index
+
+
+def _open_collection(db_path):
+    import chromadb
+    return chromadb.PersistentClient(path=db_path).get_or_create_collection("face_db")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or evaluate the quantized face gallery index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="(Re)build the index from the face_db collection")
+    build.add_argument("--db-path", default="./face_data_db")
+    build.add_argument("--out", default="./face_index")
+    build.add_argument("--kind", choices=INDEX_KINDS, default="int8")
+    build.add_argument("--pca-dim", type=int, default=64)
+
+    evaluate = sub.add_parser("eval", help="Report recall of an index against exact search")
+    evaluate.add_argument("--db-path", default="./face_data_db")
+    evaluate.add_argument("--index", default="./face_index")
+    evaluate.add_argument("--k", type=int, default=10)
+    evaluate.add_argument("--queries", type=int, default=200)
+
+    args = parser.parse_args(argv)
+    collection = _open_collection(args.db_path)
+    if args.command == "build":
+        started = time.time()
+        index = build_from_collection(collection, args.out, kind=args.kind, pca_dim=args.pca_dim)
+        print(f"Built {index.kind} index of {len(index)} vectors at {args.out} "
+              f"in {time.time() - started:.1f}s ({index.nbytes() / 1e6:.1f} MB)")
+        print(json.dumps(index.meta["recall"], indent=2))
+    else:
+        index = QuantizedIndex.open(args.index)
+        keys, _, embeddings = read_collection(collection)
+        print(json.dumps(evaluate_recall(index, keys, embeddings, k=args.k, n_queries=args.queries), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import asyncio
+import glob
 import json
 import os
+import queue
+import struct
 import threading
 import time
 import cv2
@@ -10,78 +13,179 @@ import uuid
 from pydantic import BaseModel
 import requests
 import logging
+from contextlib import asynccontextmanager, contextmanager
 from tqdm import tqdm
-from scipy.spatial.distance import cosine
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-# YOLO11 and InsightFace imports
-from ultralytics import YOLO
-import onnxruntime as ort
-import insightface
-from insightface.app import FaceAnalysis
-
-# Database and tutor-related imports remain unchanged
+# YOLO11 / InsightFace / ONNX Runtime (and the tutor's LangGraph agents) are
+# imported where they are first used, from the subsystem loader threads, so
+# importing this module and starting the app stay fast
 from db import DatabaseManager
-from apiTutor import (
-    test_creator,
-    ai_tutor,
-)
+from gallery import GalleryMatcher, find_duplicate_pairs
+from tracking import IoUTracker
+from batching import FrameBatcher, LatestOnlySlot
+from ingest import IngestedFrame
+from quality import BestShotBuffer, score_faces
+from motion import ChangeDetector
+from subsystems import Subsystem, SubsystemNotReady
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics
+from profiling import FrameProfiler
+from attendance import PresenceLog
+from rec_quant import ARCFACE_INPUT_SIZE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# IoU Tracker class remains the same
-class IoUTracker:
-    """Ultra-simple IoU tracker. No external deps."""
-    def __init__(self, iou_threshold=0.3, max_age=5):
-        self.iou_threshold = iou_threshold
-        self.max_age = max_age
-        self.tracks = {}
-        self._next_id = 0
+# ArcFace (buffalo_l/buffalo_s) embedding size
+EMBEDDING_DIM = 512
 
-    @staticmethod
-    def _iou(a, b):
-        x1 = max(a[0], b[0]); y1 = max(a[1], b[1])
-        x2 = min(a[2], b[2]); y2 = min(a[3], b[3])
-        inter = max(0, x2 - x1) * max(0, y2 - y1)
-        union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - inter
-        return inter / (union + 1e-9)
-
-    def update(self, detections):
-        for t in self.tracks.values():
-            t["age"] += 1
-
-        matched_trk = set(); matched_det = set()
-        for did, det in enumerate(detections):
-            best_iou, best_tid = self.iou_threshold, None
-            for tid, trk in self.tracks.items():
-                if tid in matched_trk:
-                    continue
-                iou = self._iou(det["bbox"], trk["bbox"])
-                if iou > best_iou:
-                    best_iou, best_tid = iou, tid
-            if best_tid is not None:
-                matched_trk.add(best_tid); matched_det.add(did)
-                trk = self.tracks[best_tid]
-                trk["bbox"] = det["bbox"]; trk["age"] = 0
-                det["track_id"] = best_tid
-                det["reid_num"] = trk.get("reid")
-                det["name"] = trk.get("name")
-
-        for did, det in enumerate(detections):
-            if did in matched_det:
-                continue
-            tid = self._next_id; self._next_id += 1
-            self.tracks[tid] = {"bbox": det["bbox"], "age": 0,
-                               "reid": None, "name": None}
-            det["track_id"] = tid
+# Detector configurations accepted by FaceRecognitionAPI(pipeline_mode=...)
+PIPELINE_MODES = ("hybrid", "yolo", "scrfd")
 
-        self.tracks = {tid: trk for tid, trk in self.tracks.items()
-                      if trk["age"] < self.max_age}
-        return detections
+# YOLO runtimes accepted by FaceRecognitionAPI(yolo_backend=...)
+YOLO_BACKENDS = ("torch", "onnx")
+
+# Session used by clients that do not name their classroom/camera
+DEFAULT_SESSION_ID = "default"
+
+class DetectionScheduler:
+    """Chooses, per frame, between a full-frame detector sweep and ROI detection.
+
+    Between sweeps the detector only sees padded regions around live tracks.
+    A sweep runs every full_sweep_interval frames to catch new arrivals, on
+    the frame after an ROI pass found a different number of faces than there
+    were tracks, when there are no tracks, and when the ROIs would cost as
+    many pixels as the full frame. Not thread-safe: callers hold session.lock.
+    """
+    def __init__(self, full_sweep_interval=10, padding=0.6):
+        self.full_sweep_interval = full_sweep_interval
+        self.padding = padding
+        self._frames_since_sweep = None     # None: sweep on the next frame
+        self.full_sweeps = 0
+        self.roi_frames = 0
+
+    def plan(self, track_boxes, frame_size, roi_size, full_size):
+        """xyxy ROIs (original coordinates) to detect in, or None for a full sweep.
+
+        roi_size is the side the detector really runs each crop at and
+        full_size that of a full sweep.
+        """
+        n = len(track_boxes)
+        if (self.full_sweep_interval <= 1 or self._frames_since_sweep is None
+                or self._frames_since_sweep + 1 >= self.full_sweep_interval
+                or n == 0 or n * roi_size ** 2 >= full_size ** 2):
+            return None
+        boxes = np.asarray(track_boxes, dtype=np.float32)
+        pad = (boxes[:, 2:] - boxes[:, :2]) * self.padding
+        rois = np.concatenate([boxes[:, :2] - pad, boxes[:, 2:] + pad], axis=1)
+        w, h = frame_size
+        return np.clip(rois, 0, [w, h, w, h])
+
+    def record(self, rois, faces_found):
+        if rois is None:
+            self._frames_since_sweep = 0
+            self.full_sweeps += 1
+            return
+        self.roi_frames += 1
+        # A track was lost or someone stepped into a region: look at everything next frame
+        self._frames_since_sweep = None if faces_found != len(rois) else self._frames_since_sweep + 1
+
+    def reset(self):
+        self._frames_since_sweep = None
+
+    def summary(self):
+        return {"full_sweeps": self.full_sweeps, "roi_frames": self.roi_frames}
+
+
+class PipelineSession:
+    """Per-classroom pipeline state: tracker, best-shot buffer, detection schedule,
+    change detector and last result, session cache and frame counter."""
+    def __init__(self, session_id, iou_threshold=0.3, max_age=5, best_shot_quality=0.6, best_shot_budget=3.0,
+                 full_sweep_interval=10, roi_padding=0.6, motion_gating=True, max_static_seconds=10.0,
+                 motion_threshold=0.005):
+        self.session_id = session_id
+        self.tracker = IoUTracker(iou_threshold=iou_threshold, max_age=max_age)
+        self.best_shots = BestShotBuffer(min_quality=best_shot_quality, time_budget=best_shot_budget)
+        self.detection = DetectionScheduler(full_sweep_interval=full_sweep_interval, padding=roi_padding)
+        self.motion = (ChangeDetector(max_static_seconds=max_static_seconds, min_changed_fraction=motion_threshold)
+                       if motion_gating else None)
+        # info of the last analysed frame, returned again for unchanged frames
+        self.last_info = None
+        self.frame_count = 0
+        self.created_at = time.time()
+        self.last_active = self.created_at
+        # Serializes frames of one camera; other sessions run concurrently
+        self.lock = threading.Lock()
+
+    def reset(self):
+        self.frame_count = 0
+        self.tracker = IoUTracker(iou_threshold=self.tracker.iou_threshold,
+                                  max_age=self.tracker.max_age)
+        self.best_shots = BestShotBuffer(min_quality=self.best_shots.min_quality,
+                                         time_budget=self.best_shots.time_budget)
+        self.detection.reset()
+        self.last_info = None
+        if self.motion is not None:
+            self.motion.reset()
+
+    def summary(self):
+        return {
+            "session_id": self.session_id,
+            "frame_count": self.frame_count,
+            "active_tracks": len(self.tracker),
+            "tracks_awaiting_shot": len(self.best_shots),
+            "detection": self.detection.summary(),
+            "motion": self.motion.summary() if self.motion is not None else None,
+            "created_at": self.created_at,
+            "last_active": self.last_active,
+        }
+
+
+class SessionRegistry:
+    """Thread-safe map of session id -> PipelineSession, created on first use.
+
+    Sessions idle for longer than idle_timeout seconds are dropped the next
+    time a session is looked up. session_options are passed to every new
+    PipelineSession.
+    """
+    def __init__(self, idle_timeout=3600, **session_options):
+        self.idle_timeout = idle_timeout
+        self.session_options = session_options
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id=DEFAULT_SESSION_ID):
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = PipelineSession(session_id, **self.session_options)
+                self._sessions[session_id] = session
+                logger.info(f"Created pipeline session '{session_id}'")
+            session.last_active = now
+            return session
+
+    def _evict_idle(self, now):
+        for sid, session in list(self._sessions.items()):
+            if now - session.last_active > self.idle_timeout and not session.lock.locked():
+                del self._sessions[sid]
+                logger.info(f"Evicted idle pipeline session '{sid}'")
+
+    def remove(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def all(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
 
 
 class FaceRecognitionAPI:
@@ -89,36 +193,165 @@ class FaceRecognitionAPI:
                 face_img_path="saved_faces",
                 similarity_threshold=0.4,
                 yolo_model_path="yolov12l-face.pt",  # Path to YOLO11 face model
-                use_gpu=True):
-        
+                use_gpu=True,
+                recognition_batch_size=32,
+                pipeline_mode="hybrid",
+                det_thresh=0.5,
+                yolo_instances=1,
+                detector_input_size=640,
+                reverify_interval=10.0,
+                best_shot_quality=0.6,
+                best_shot_budget=3.0,
+                max_templates=5,
+                template_min_similarity=0.5,
+                template_novelty=0.9,
+                yolo_backend="torch",
+                yolo_onnx_path="yolo-face.onnx",
+                recognition_int8_path=None,
+                full_sweep_interval=10,
+                roi_padding=0.6,
+                roi_size=192,
+                motion_gating=True,
+                max_static_seconds=10.0,
+                motion_threshold=0.005,
+                db_path="./face_data_db",
+                index_path=None,
+                snapshot_path=None,
+                profile_dir="profiles",
+                attendance_dir="attendance_log",
+                presence_gap_seconds=30.0):
+        """
+        pipeline_mode selects which detector feeds alignment:
+          "hybrid" - YOLO boxes, landmarks from a shared SCRFD pass when YOLO has none
+          "yolo"   - YOLO boxes and 5-point keypoints only, SCRFD is never loaded
+          "scrfd"  - InsightFace SCRFD detects and aligns alone, YOLO is never loaded
+        "yolo" needs face-pose weights with 5 keypoints: without landmarks
+        every face would be embedded from an unaligned crop, so the API
+        refuses to start. det_thresh is the SCRFD score threshold
+        (FaceAnalysis' default of 0.5).
+
+        yolo_instances sets how many YOLO predictors are kept so that that many
+        sessions can run detection at once (ultralytics predictors are not
+        thread-safe; ONNX Runtime sessions used by InsightFace are).
+
+        yolo_backend "onnx" runs YOLO from yolo_onnx_path (exported with
+        yolo_onnx.py, optionally INT8) on the ONNX Runtime CPU provider, with
+        the cores split between the yolo_instances sessions.
+
+        recognition_int8_path selects an INT8 ArcFace model (rec_quant.py);
+        it is only used if its verification report passed against the FP32
+        recognizer that was loaded, otherwise FP32 stays in place.
+
+        Tracked sessions only run the detector on every full_sweep_interval-th
+        frame; in between it sees the live tracks' boxes padded by roi_padding
+        (fraction of box size per side), batched as crops of roi_size pixels
+        (a multiple of 32). An ONNX export with a fixed input size runs every
+        crop at that size, so it always gets full sweeps. See DetectionScheduler.
+
+        With motion_gating, a tracked frame whose scene has not changed from
+        the last analysed one (motion.ChangeDetector, motion_threshold is the
+        fraction of changed thumbnail pixels) gets that frame's result again
+        without detection or embedding; a real pass runs at least every
+        max_static_seconds and while new tracks are still collecting shots.
+
+        New tracks are not enrolled or matched from their first frame: each
+        track keeps its best-scoring shot (quality.score_faces) until one
+        reaches best_shot_quality or best_shot_budget seconds have passed.
+
+        Each identity keeps up to max_templates embeddings. A matched face
+        with similarity of at least template_min_similarity is added as a new
+        template unless it is template_novelty similar to one it already has.
+
+        Every identified face is logged as presence in its session
+        (attendance.PresenceLog under attendance_dir); a person unseen for
+        presence_gap_seconds starts a new interval when they reappear.
+
+        index_path and snapshot_path locate the ANN index and the shared
+        gallery snapshot; they default to $FACE_INDEX_PATH and
+        $FACE_GALLERY_SNAPSHOT.
+        """
+        if pipeline_mode not in PIPELINE_MODES:
+            raise ValueError(f"Unknown pipeline_mode '{pipeline_mode}', expected one of {PIPELINE_MODES}")
+        if yolo_backend not in YOLO_BACKENDS:
+            raise ValueError(f"Unknown yolo_backend '{yolo_backend}', expected one of {YOLO_BACKENDS}")
+
         os.makedirs(face_img_path, exist_ok=True)
         self.face_img_path = face_img_path
         self.similarity_threshold = similarity_threshold
         self.use_gpu = use_gpu
-        self._processing_lock = threading.Lock() # Add this lock
+        self.recognition_batch_size = recognition_batch_size
+        # Long side uploads are decoded/resized to before detection
+        self.detector_input_size = detector_input_size
+        # Seconds before a track locked to a ReID is embedded and checked again
+        self.reverify_interval = reverify_interval
+        # Confident matches that look different enough become extra templates
+        self.template_min_similarity = template_min_similarity
+        self.template_novelty = template_novelty
+        # Detector input side for ROI crops around live tracks
+        self.roi_size = roi_size
+        # Stage timings always go to /metrics; stage_observer is an extra
+        # callable(stage, seconds), e.g. set by bench_pipeline.py
+        self.stage_observer = None
+        # On-demand cProfile/sampling captures of the pipeline (see /admin/profile)
+        self.profiler = FrameProfiler(output_dir=profile_dir)
+        # Guards ReID allocation + enrollment shared by all sessions
+        self._enroll_lock = threading.Lock()
 
-        # Initialize YOLO11 for face detection
-        try:
-            self.yolo_model = YOLO('yolov12l-face.pt')
-            
-            # Set device for YOLO
-            if self.use_gpu:
-                import torch
-                if torch.cuda.is_available():
-                    self.device = 'cuda'
-                    logger.info("YOLO11 using CUDA GPU")
-                else:
-                    self.device = 'cpu'
-                    logger.warning("CUDA not available, YOLO11 falling back to CPU")
-            else:
-                self.device = 'cpu'
-                
-        except Exception as e:
-            logger.error(f"Error initializing YOLO11: {e}")
-            raise
+        self.pipeline_mode = pipeline_mode
+        self.yolo_backend = yolo_backend
+        self.det_thresh = det_thresh
+
+        # Initialize YOLO11 for face detection (not needed when SCRFD detects alone)
+        self.yolo_model = None
+        self._yolo_pool = queue.Queue()
+        self.device = 'cpu'
+        if self.pipeline_mode != "scrfd" and self.yolo_backend == "onnx":
+            from yolo_onnx import OnnxFaceDetector
+            threads = max(1, (os.cpu_count() or 1) // max(1, yolo_instances))
+            try:
+                detectors = [OnnxFaceDetector(yolo_onnx_path, conf=0.4, intra_op_threads=threads,
+                                              imgsz=detector_input_size)
+                             for _ in range(max(1, yolo_instances))]
+                for detector in detectors:
+                    self._yolo_pool.put(detector)
+                self.yolo_model = detectors[0]
+                logger.info(f"YOLO running on ONNX Runtime CPU from {yolo_onnx_path} "
+                            f"({max(1, yolo_instances)} x {threads} threads)")
+            except Exception as e:
+                logger.error(f"Error initializing ONNX YOLO from {yolo_onnx_path}: {e}")
+                raise
+        elif self.pipeline_mode != "scrfd":
+            try:
+                from ultralytics import YOLO
+                self.yolo_model = YOLO('yolov12l-face.pt')
+                self._yolo_pool.put(self.yolo_model)
+                for _ in range(max(1, yolo_instances) - 1):
+                    self._yolo_pool.put(YOLO('yolov12l-face.pt'))
+
+                # Set device for YOLO
+                if self.use_gpu:
+                    import torch
+                    if torch.cuda.is_available():
+                        self.device = 'cuda'
+                        logger.info("YOLO11 using CUDA GPU")
+                    else:
+                        logger.warning("CUDA not available, YOLO11 falling back to CPU")
+
+            except Exception as e:
+                logger.error(f"Error initializing YOLO11: {e}")
+                raise
+
+        if self.yolo_model is not None and self._yolo_keypoint_count() != 5:
+            if self.pipeline_mode == "yolo":
+                raise ValueError("pipeline_mode 'yolo' needs face-pose YOLO weights with 5 keypoints; "
+                                 "these weights only output boxes. Use 'hybrid' to align with SCRFD landmarks.")
+            logger.info("YOLO weights have no face keypoints; landmarks come from SCRFD")
 
         # Initialize InsightFace with GPU support
+        # Only "hybrid" and "scrfd" keep the SCRFD detector resident
+        insight_modules = ['recognition'] if self.pipeline_mode == "yolo" else ['detection', 'recognition']
         try:
+            import onnxruntime as ort
             # Set GPU providers for ONNX Runtime
             providers = ['CPUExecutionProvider']
             if self.use_gpu:
@@ -130,52 +363,141 @@ class FaceRecognitionAPI:
                 else:
                     logger.warning("CUDA provider not available for ONNX Runtime, falling back to CPU")
                     providers = ['CPUExecutionProvider']
-            
-            # Initialize FaceAnalysis
-            self.face_app = FaceAnalysis(
-                name='buffalo_l',  # Use buffalo_l model for better accuracy
-                providers=providers,
-                allowed_modules=['detection', 'recognition']
-            )
-            self.face_app.prepare(ctx_id=0 if self.use_gpu else -1, det_size=(640, 640))
-            
+
+            # Use buffalo_l model for better accuracy
+            self.insight_models = self._load_insightface('buffalo_l', providers, insight_modules)
             logger.info(f"InsightFace initialized with providers: {providers}")
-            
+
         except Exception as e:
             logger.error(f"Error initializing InsightFace: {e}")
             # Fallback to lighter model if buffalo_l fails
             try:
-                self.face_app = FaceAnalysis(
-                    name='buffalo_s',
-                    providers=providers,
-                    allowed_modules=['detection', 'recognition']
-                )
-                self.face_app.prepare(ctx_id=0 if self.use_gpu else -1, det_size=(640, 640))
+                self.insight_models = self._load_insightface('buffalo_s', providers, insight_modules)
                 logger.info("Fallback to buffalo_s model successful")
             except Exception as e2:
                 logger.error(f"Failed to initialize InsightFace completely: {e2}")
                 raise
 
+        self.det_model = self.insight_models.get('detection')
+        self.rec_model = self.insight_models['recognition']
+        self.recognizer_precision = "fp32"
+        if recognition_int8_path:
+            self._load_int8_recognizer(recognition_int8_path, providers)
+        logger.info(f"Face pipeline mode: {self.pipeline_mode}")
+
         # Initialize database manager and load in-memory caches
-        self.db_manager = DatabaseManager()
+        self.db_manager = DatabaseManager(
+            db_path=db_path,
+            index_backend=os.getenv("FACE_INDEX_BACKEND", "chroma"),
+            index_path=index_path or os.getenv("FACE_INDEX_PATH", "./face_index"),
+            snapshot_path=snapshot_path or os.getenv("FACE_GALLERY_SNAPSHOT", "./gallery_snapshot"),
+        )
         self.db_manager._connect()
         self.reid_counter = getattr(self, "reid_counter", 0)
 
-        # Synchronous data structures
-        self.known_faces = {}
-        self.reid_embeddings = {}
-        self.tracker = IoUTracker(iou_threshold=0.3, max_age=5)
+        # Shared gallery, memory-mapped from the snapshot that every worker
+        # process opens; per-camera tracker/session cache live in self.sessions
+        snapshot = self.db_manager.snapshot
+        reuse_snapshot = (self.db_manager.snapshot_ready and
+                          (snapshot.dim, snapshot.max_templates) == (EMBEDDING_DIM, max_templates))
+        if snapshot is not None and not reuse_snapshot:
+            try:
+                snapshot.create(EMBEDDING_DIM, max_templates)
+            except OSError as e:
+                logger.error(f"Cannot create gallery snapshot ({e}), keeping the gallery in process memory")
+                snapshot = self.db_manager.snapshot = None
+        self.gallery = GalleryMatcher(dim=EMBEDDING_DIM, max_templates=max_templates, storage=snapshot,
+                                      index=self.db_manager.index)
+        self._duplicate_scan_lock = threading.Lock()
+        self._duplicate_scan = {"status": "idle", "rows_done": 0, "total_rows": 0,
+                                "duplicates": [], "started_at": None,
+                                "finished_at": None, "error": None}
+        self.sessions = SessionRegistry(best_shot_quality=best_shot_quality,
+                                        best_shot_budget=best_shot_budget,
+                                        full_sweep_interval=full_sweep_interval,
+                                        roi_padding=roi_padding,
+                                        motion_gating=motion_gating,
+                                        max_static_seconds=max_static_seconds,
+                                        motion_threshold=motion_threshold)
+        self._register_gauges()
 
-        # Frame counter
-        self.frame_count = 0
+        # Load existing embeddings from database unless the snapshot already has them
+        if reuse_snapshot:
+            logger.info(f"Opened gallery snapshot: {len(self.gallery)} identities "
+                        f"({self.gallery.template_count()} templates)")
+        else:
+            self._load_existing_embeddings()
+            self.db_manager.write_snapshot_names()
 
-        # Load existing embeddings from database
-        self._load_existing_embeddings()
+        # Append-only presence intervals per session, compacted to Parquet.
+        # Created last: it starts a flush thread, so nothing may fail after it
+        self.attendance = PresenceLog(attendance_dir, gap_seconds=presence_gap_seconds)
 
         logger.info("Face Recognition API initialized with YOLO11 and InsightFace GPU support")
 
+    @property
+    def detector_name(self):
+        if self.pipeline_mode == "scrfd":
+            return "InsightFace SCRFD"
+        return "YOLO11 (ONNX Runtime)" if self.yolo_backend == "onnx" else "YOLO11"
+
+    @property
+    def roi_input_size(self):
+        """Side the detector actually runs an ROI crop at.
+
+        A static-shape ONNX export letterboxes every crop back up to its
+        fixed input, so an ROI costs as much as a full sweep there.
+        """
+        if (self.pipeline_mode != "scrfd" and self.yolo_backend == "onnx"
+                and not self.yolo_model.dynamic_size):
+            return self.yolo_model.imgsz
+        return self.roi_size
+
+    def _yolo_keypoint_count(self):
+        """Landmarks per face in the YOLO detector's output (0 for box-only weights)."""
+        if self.yolo_backend == "onnx":
+            return self.yolo_model.num_keypoints
+        if self.yolo_model.task != "pose":
+            return 0
+        kpt_shape = getattr(self.yolo_model.model, "yaml", {}).get("kpt_shape") or (0,)
+        return int(kpt_shape[0])
+
+    def _load_insightface(self, name, providers, modules):
+        """Load and prepare only the requested InsightFace model-pack modules."""
+        from insightface import model_zoo
+        from insightface.utils import ensure_available
+        model_dir = ensure_available('models', name, root='~/.insightface')
+        models = {}
+        for onnx_file in sorted(glob.glob(os.path.join(model_dir, '*.onnx'))):
+            model = model_zoo.get_model(onnx_file, providers=providers)
+            if model is None or model.taskname not in modules or model.taskname in models:
+                continue
+            if model.taskname == 'detection':
+                model.prepare(ctx_id=0 if self.use_gpu else -1, input_size=(640, 640),
+                              det_thresh=self.det_thresh)
+            else:
+                model.prepare(ctx_id=0 if self.use_gpu else -1)
+            models[model.taskname] = model
+        missing = set(modules) - set(models)
+        if missing:
+            raise RuntimeError(f"InsightFace pack '{name}' is missing modules: {sorted(missing)}")
+        return models
+
+    def _load_int8_recognizer(self, int8_path, providers):
+        """Swap in the INT8 recognizer if it passed rec_quant verification."""
+        from rec_quant import check_deployable, load_recognizer
+        deployable, reason, report = check_deployable(int8_path, self.rec_model.model_file)
+        if not deployable:
+            logger.error(f"Not deploying INT8 recognizer {int8_path}: {reason}; keeping FP32")
+            return
+        self.rec_model = load_recognizer(int8_path, providers, input_mean=report["input_mean"],
+                                         input_std=report["input_std"])
+        self.recognizer_precision = "int8"
+        logger.info(f"Using INT8 recognizer {int8_path} (p95 drift {report['drift_p95']}, "
+                    f"top-1 agreement {report['top1_agreement']})")
+
     def _load_existing_embeddings(self):
-        """Load existing face embeddings from ChromaDB"""
+        """Load existing face embeddings from ChromaDB (and rebuild the gallery snapshot)"""
         try:
             if not self.db_manager.face_db or self.db_manager.face_db.count() == 0:
                 logger.info("No existing embeddings in database")
@@ -186,260 +508,673 @@ class FaceRecognitionAPI:
             embeddings = result.get("embeddings", [])
             metadatas = result.get("metadatas", [])
             
+            templates, labels = {}, {}
             for i, key in enumerate(ids):
                 try:
                     reid_num = int(key.split("_")[1]) if "_" in key else int(key)
                     if embeddings is not None and i < len(embeddings) and embeddings[i] is not None:
-                        self.reid_embeddings[reid_num] = np.array(embeddings[i])
+                        # reid_N is the enrollment template, reid_N_tK the extra ones
+                        slot = int(key.split("_t")[1]) if "_t" in key else 0
+                        templates.setdefault(reid_num, []).append((slot, embeddings[i]))
+                        if slot == 0:
+                            # Merged identities keep matching, but resolve to their merge target
+                            name = (metadatas[i] or {}).get("name", "") if metadatas else ""
+                            labels[reid_num] = int(name[len("Merged_to_"):]) if name.startswith("Merged_to_") else reid_num
                 except (ValueError, IndexError) as e:
                     logger.error(f"Error loading embedding for {key}: {e}")
                     continue
+            self.gallery.load(
+                (reid_num, [emb for _, emb in sorted(slots, key=lambda t: t[0])], labels.get(reid_num))
+                for reid_num, slots in templates.items()
+            )
             
-            logger.info(f"Loaded {len(self.reid_embeddings)} existing face embeddings from ChromaDB")
+            logger.info(f"Loaded {len(self.gallery)} existing identities "
+                        f"({self.gallery.template_count()} templates) from ChromaDB")
         except Exception as e:
             logger.error(f"Error loading existing embeddings: {e}")
 
+    def _as_ingested(self, frame):
+        """Wrap a decoded ndarray so the pipeline can treat every input alike."""
+        return frame if isinstance(frame, IngestedFrame) else IngestedFrame.from_array(frame)
+
+    @staticmethod
+    def _attach_crops(frame, detections):
+        """Cut face crops for detections from the full-resolution frame."""
+        if not detections:
+            return detections
+        full = frame.full
+        for det in detections:
+            if "face_crop" not in det:
+                x1, y1, x2, y2 = det["bbox"]
+                det["face_crop"] = full[y1:y2, x1:x2].copy()
+        return detections
+
+    @staticmethod
+    def _clamp_box(frame, bbox):
+        """Map a detector-space box to original pixels, clamped to the frame."""
+        h, w = frame.shape[:2]
+        x1, y1, x2, y2 = frame.to_original(bbox)
+        return max(0, int(x1)), max(0, int(y1)), min(w, int(x2)), min(h, int(y2))
+
     def detect_faces_yolo(self, frame):
         """Detect faces using YOLO11"""
+        frame = self._as_ingested(frame)
+        return self._attach_crops(frame, self.detect_faces_yolo_batch([frame])[0])
+
+    def detect_faces_yolo_batch(self, frames, imgsz=None):
+        """Detect faces in several IngestedFrames with one batched YOLO11 call.
+
+        Boxes and keypoints are returned in original-image coordinates. imgsz
+        overrides the detector input size (e.g. for small ROI crops).
+        """
         try:
-            # Run YOLO detection
-            results = self.yolo_model(frame, device=self.device, conf=0.4)
-            
+            # Run YOLO detection on whichever predictor instance is free
+            yolo_model = self._yolo_pool.get()
+            try:
+                if self.yolo_backend == "onnx":
+                    results = yolo_model.detect([frame.detector_frame for frame in frames], imgsz=imgsz)
+                else:
+                    results = yolo_model([frame.detector_frame for frame in frames], device=self.device,
+                                         conf=0.4, imgsz=imgsz or self.detector_input_size)
+            finally:
+                self._yolo_pool.put(yolo_model)
+            parse = self._parse_onnx_result if self.yolo_backend == "onnx" else self._parse_yolo_result
+            return [parse(r, frame) for r, frame in zip(results, frames)]
+
+        except Exception as e:
+            logger.error(f"YOLO face detection error: {e}")
+            return [[] for _ in frames]
+
+    def _parse_yolo_result(self, r, frame):
+        detections = []
+        boxes = r.boxes
+        if boxes is None:
+            return detections
+
+        # Face-pose YOLO weights also emit 5-point landmarks usable for alignment
+        keypoints = None
+        if r.keypoints is not None and r.keypoints.xy.shape[1] == 5:
+            keypoints = frame.points_to_original(r.keypoints.xy.cpu().numpy())
+
+        for i, box in enumerate(boxes):
+            # Bounding box in original coordinates, within frame boundaries
+            x1, y1, x2, y2 = self._clamp_box(frame, box.xyxy[0].cpu().numpy())
+
+            if x2 > x1 and y2 > y1:
+                detection = {
+                    "bbox": (x1, y1, x2, y2),
+                    "confidence": float(box.conf[0]) if box.conf is not None else 0.99
+                }
+                if keypoints is not None:
+                    detection["kps"] = keypoints[i]
+                detections.append(detection)
+        return detections
+
+    def _parse_onnx_result(self, result, frame):
+        boxes, scores, keypoints = result
+        if keypoints is not None:
+            keypoints = frame.points_to_original(keypoints)
+        detections = []
+        for i in range(len(boxes)):
+            x1, y1, x2, y2 = self._clamp_box(frame, boxes[i])
+            if x2 > x1 and y2 > y1:
+                detection = {"bbox": (x1, y1, x2, y2), "confidence": float(scores[i])}
+                if keypoints is not None:
+                    detection["kps"] = keypoints[i]
+                detections.append(detection)
+        return detections
+
+    def detect_faces_scrfd(self, frame, input_size=None):
+        """Detect faces and 5-point landmarks using InsightFace SCRFD alone"""
+        try:
+            bboxes, kpss = self.det_model.detect(frame.detector_frame, max_num=0,
+                                                 input_size=(input_size, input_size) if input_size else None)
             detections = []
-            for r in results:
-                boxes = r.boxes
-                if boxes is None:
-                    continue
-                    
-                for box in boxes:
-                    # Get bounding box coordinates
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                    
-                    # Ensure coordinates are within frame boundaries
-                    x1 = max(0, x1)
-                    y1 = max(0, y1)
-                    x2 = min(frame.shape[1], x2)
-                    y2 = min(frame.shape[0], y2)
-                    
-                    # Extract face crop
-                    face_crop = frame[y1:y2, x1:x2].copy()
-                    
-                    if face_crop.size > 0:
-                        detection = {
-                            "bbox": (x1, y1, x2, y2),
-                            "face_crop": face_crop,
-                            "confidence": float(box.conf[0]) if box.conf is not None else 0.99
-                        }
-                        detections.append(detection)
-            
+            for i in range(len(bboxes)):
+                x1, y1, x2, y2 = self._clamp_box(frame, bboxes[i, :4])
+                if x2 > x1 and y2 > y1:
+                    detections.append({
+                        "bbox": (x1, y1, x2, y2),
+                        "confidence": float(bboxes[i, 4]),
+                        "kps": frame.points_to_original(kpss[i]) if kpss is not None else None,
+                    })
             return detections
-            
+
         except Exception as e:
-            logger.error(f"YOLO face detection error: {e}")
+            logger.error(f"SCRFD face detection error: {e}")
+            return []
+
+    def _align_faces(self, frame, detections):
+        """Build 112x112 aligned crops for every detection.
+
+        Detections that carry 5-point landmarks are norm-cropped directly. When
+        SCRFD is loaded the rest borrow landmarks from a single full-frame
+        detector pass shared by all of them; any box still unmatched falls
+        back to a square resize of its crop.
+        """
+        from insightface.utils import face_align
+        aligned = []
+        frame_faces = None
+        for det in detections:
+            kps = det.get("kps")
+            if kps is None and self.det_model is not None:
+                if frame_faces is None:
+                    frame_faces = self._detect_landmarks(frame)
+                kps = self._match_landmarks(det["bbox"], frame_faces)
+            if kps is not None:
+                aligned.append(face_align.norm_crop(frame, landmark=np.asarray(kps, dtype=np.float32),
+                                                    image_size=ARCFACE_INPUT_SIZE))
+            else:
+                logger.debug(f"No landmarks for face at {det['bbox']}, using box crop")
+                metrics.inc("unaligned_faces_total", component="api")
+                aligned.append(cv2.resize(self._square_crop(frame, det["bbox"]),
+                                          (ARCFACE_INPUT_SIZE, ARCFACE_INPUT_SIZE)))
+        return aligned
+
+    def _detect_landmarks(self, frame):
+        """Run the InsightFace detector once over the whole frame."""
+        try:
+            bboxes, kpss = self.det_model.detect(frame, max_num=0)
+            if kpss is None:
+                return []
+            return [(bboxes[i, :4], kpss[i]) for i in range(len(bboxes))]
+        except Exception as e:
+            logger.error(f"InsightFace full-frame detection error: {e}")
             return []
 
+    @staticmethod
+    def _match_landmarks(bbox, frame_faces):
+        """Return landmarks of the full-frame face overlapping bbox the most."""
+        x1, y1, x2, y2 = bbox
+        best_kps, best_overlap = None, 0
+        for fbox, kps in frame_faces:
+            overlap_w = min(x2, fbox[2]) - max(x1, fbox[0])
+            overlap_h = min(y2, fbox[3]) - max(y1, fbox[1])
+            if overlap_w > 0 and overlap_h > 0 and overlap_w * overlap_h > best_overlap:
+                best_overlap = overlap_w * overlap_h
+                best_kps = kps
+        return best_kps
+
+    @staticmethod
+    def _square_crop(frame, bbox):
+        """Cut a square region centred on bbox, clamped to the frame."""
+        x1, y1, x2, y2 = bbox
+        side = max(x2 - x1, y2 - y1)
+        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+        h, w = frame.shape[:2]
+        sx1, sy1 = max(0, cx - side // 2), max(0, cy - side // 2)
+        sx2, sy2 = min(w, sx1 + side), min(h, sy1 + side)
+        return frame[sy1:sy2, sx1:sx2]
+
+    def embed_aligned(self, aligned_faces):
+        """Embed aligned 112x112 BGR faces in NCHW batches.
+
+        Returns an (N, 512) float32 array of L2-normalized embeddings.
+        """
+        if not aligned_faces:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        feats = []
+        for start in range(0, len(aligned_faces), self.recognition_batch_size):
+            batch = aligned_faces[start:start + self.recognition_batch_size]
+            feats.append(self.rec_model.get_feat(batch))
+        feats = np.concatenate(feats, axis=0).astype(np.float32)
+        norms = np.linalg.norm(feats, axis=1, keepdims=True)
+        return feats / np.maximum(norms, 1e-12)
+
     def extract_embeddings_insightface(self, frame, detections):
         """Extract face embeddings using InsightFace"""
+        return self.extract_embeddings_batch([frame], [detections])[0]
+
+    def extract_embeddings_batch(self, frames, detections_per_frame):
+        """Embed the faces of several frames with one recognition batch"""
         try:
-            # Use InsightFace to get embeddings for each detection
-            for det in detections:
-                x1, y1, x2, y2 = det["bbox"]
-                face_crop = det["face_crop"]
-                
-                # Try to get embedding from InsightFace
-                try:
-                    # InsightFace expects BGR format
-                    faces = self.face_app.get(face_crop)
-                    
-                    if faces and len(faces) > 0:
-                        # Use the first face's embedding
-                        face = faces[0]
-                        det["encoding"] = face.embedding
-                    else:
-                        # Fallback: try with the full frame at the bbox location
-                        faces = self.face_app.get(frame)
-                        
-                        # Find the face closest to our bbox
-                        best_face = None
-                        best_overlap = 0
-                        
-                        for face in faces:
-                            face_bbox = face.bbox.astype(int)
-                            fx1, fy1, fx2, fy2 = face_bbox
-                            
-                            # Calculate overlap
-                            overlap_x1 = max(x1, fx1)
-                            overlap_y1 = max(y1, fy1)
-                            overlap_x2 = min(x2, fx2)
-                            overlap_y2 = min(y2, fy2)
-                            
-                            if overlap_x2 > overlap_x1 and overlap_y2 > overlap_y1:
-                                overlap_area = (overlap_x2 - overlap_x1) * (overlap_y2 - overlap_y1)
-                                if overlap_area > best_overlap:
-                                    best_overlap = overlap_area
-                                    best_face = face
-                        
-                        if best_face is not None:
-                            det["encoding"] = best_face.embedding
-                        else:
-                            # Generate a random embedding as fallback
-                            det["encoding"] = np.random.randn(512).astype(np.float32)
-                            logger.warning(f"Could not extract embedding for face at {det['bbox']}")
-                            
-                except Exception as e:
-                    logger.error(f"Error extracting embedding for single face: {e}")
-                    det["encoding"] = np.random.randn(512).astype(np.float32)
-                
-                # Ensure encoding is normalized
-                if "encoding" in det and det["encoding"] is not None:
-                    norm = np.linalg.norm(det["encoding"])
-                    if norm > 0:
-                        det["encoding"] = det["encoding"] / norm
-                        
-            return detections
-            
+            aligned = []
+            for frame, detections in zip(frames, detections_per_frame):
+                aligned.extend(self._align_faces(frame, detections))
+            embeddings = iter(self.embed_aligned(aligned))
+            for detections in detections_per_frame:
+                for det in detections:
+                    det["encoding"] = next(embeddings)
+            return detections_per_frame
+
         except Exception as e:
             logger.error(f"InsightFace embedding extraction error: {e}")
             # Add random embeddings as fallback
-            for det in detections:
-                if "encoding" not in det:
-                    det["encoding"] = np.random.randn(512).astype(np.float32)
-            return detections
+            for detections in detections_per_frame:
+                for det in detections:
+                    if "encoding" not in det:
+                        det["encoding"] = np.random.randn(512).astype(np.float32)
+            return detections_per_frame
 
     def detect_faces(self, frame):
         """Main face detection and embedding extraction pipeline"""
-        # Step 1: Detect faces with YOLO11
-        detections = self.detect_faces_yolo(frame)
-        
+        return self.detect_faces_batch([frame])[0]
+
+    def detect_faces_batch(self, frames):
+        """Detection and embedding extraction for several frames at once.
+
+        frames may be decoded ndarrays or IngestedFrames; detection runs at
+        detector resolution and crops/embeddings use the full-resolution image.
+        """
+        frames = [self._as_ingested(frame) for frame in frames]
+
+        # Step 1: Detect faces with YOLO11 (or SCRFD in single-detector mode)
+        if self.pipeline_mode == "scrfd":
+            detections_per_frame = [self.detect_faces_scrfd(frame) for frame in frames]
+        else:
+            detections_per_frame = self.detect_faces_yolo_batch(frames)
+
         # Step 2: Extract embeddings with InsightFace
-        if detections:
-            detections = self.extract_embeddings_insightface(frame, detections)
-        
-        # Add track_id placeholder (will be updated by tracker)
-        reid_num = self.db_manager.next_reid_num()
-        for det in detections:
-            det["track_id"] = reid_num
-            
-        return detections
+        if any(detections_per_frame):
+            for frame, detections in zip(frames, detections_per_frame):
+                self._attach_crops(frame, detections)
+            detections_per_frame = self.extract_embeddings_batch(
+                [frame.full for frame in frames], detections_per_frame
+            )
 
-    def process_frame_with_info(self, frame, use_tracking=True):
-        with self._processing_lock:
-            if frame is None:
-                return None, {"head_count": 0, "names": [], "face_info": []}
-    
-            detections = self.detect_faces(frame)
+        self._assign_placeholder_ids(detections_per_frame)
+        return detections_per_frame
+
+    def detect_faces_only(self, frames, rois_per_frame=None):
+        """Detection stage alone: boxes/landmarks in original coordinates, no crops or embeddings.
+
+        rois_per_frame optionally holds, per frame, xyxy regions to detect in
+        instead of the whole frame (None for a full sweep); all ROI crops go
+        through the detector as one batch at roi_size.
+        """
+        if rois_per_frame is None:
+            rois_per_frame = [None] * len(frames)
+        full = [i for i, rois in enumerate(rois_per_frame) if rois is None]
+        regions, owners = [], []
+        for i, rois in enumerate(rois_per_frame):
+            if rois is not None:
+                regions.extend(frames[i].region(roi, self.roi_size) for roi in rois)
+                owners.extend([i] * len(rois))
+
+        detections_per_frame = [[] for _ in frames]
+        if self.pipeline_mode == "scrfd":
+            for i in full:
+                detections_per_frame[i] = self.detect_faces_scrfd(frames[i])
+            region_detections = [self.detect_faces_scrfd(region, self.roi_size) for region in regions]
+        else:
+            for i, detections in zip(full, self.detect_faces_yolo_batch([frames[i] for i in full])
+                                     if full else []):
+                detections_per_frame[i] = detections
+            region_detections = self.detect_faces_yolo_batch(regions, imgsz=self.roi_size) if regions else []
+        for i, detections in zip(owners, region_detections):
+            detections_per_frame[i].extend(detections)
+        for i in set(owners):
+            detections_per_frame[i] = self._suppress_duplicates(detections_per_frame[i])
+        self._assign_placeholder_ids(detections_per_frame)
+        return detections_per_frame
+
+    @staticmethod
+    def _suppress_duplicates(detections, iou_threshold=0.5):
+        """Greedy NMS for faces found in more than one overlapping ROI."""
+        if len(detections) < 2:
+            return detections
+        detections = sorted(detections, key=lambda det: det["confidence"], reverse=True)
+        iou = IoUTracker.iou_matrix([det["bbox"] for det in detections], [det["bbox"] for det in detections])
+        keep = np.ones(len(detections), dtype=bool)
+        for i in range(len(detections)):
+            if keep[i]:
+                keep[i + 1:] &= iou[i, i + 1:] <= iou_threshold
+        return [det for det, kept in zip(detections, keep) if kept]
+
+    @staticmethod
+    def _assign_placeholder_ids(detections_per_frame):
+        # track_id placeholder (replaced by the tracker); per-frame index so
+        # untracked requests do not consume ReID numbers
+        for detections in detections_per_frame:
+            for i, det in enumerate(detections):
+                det["track_id"] = i
+
+    def _embed_pending(self, frames, detections_per_frame):
+        """Crop and embed only detections flagged needs_embedding, in one batch across frames"""
+        todo = [(frame, [det for det in detections if det.get("needs_embedding", True)])
+                for frame, detections in zip(frames, detections_per_frame)]
+        todo = [(frame, detections) for frame, detections in todo if detections]
+        if not todo:
+            return
+        for frame, detections in todo:
+            self._attach_crops(frame, detections)
+        self.extract_embeddings_batch([frame.full for frame, _ in todo],
+                                      [detections for _, detections in todo])
+
+    def process_frames_batch(self, requests):
+        """Process (frame, use_tracking, session_id, render) requests as one inference batch.
+
+        Tracked frames of an unchanged scene are answered from the session's
+        last result first (see _reuse_static_frames). Stages for the rest:
+        one detection batch across all frames (full sweeps plus ROI
+        crops around live tracks, see DetectionScheduler); tracking and shot
+        scoring per session; one embedding batch covering only re-verification
+        due tracks and unidentified tracks whose shot beats their buffered best;
+        then matching and rendering per session. Returns one
+        (display_frame, info) pair per request, in order; display_frame is None
+        for requests with render=False.
+        """
+        with self.profiler.capture(frames=len(requests)):
+            results = self._process_frames_batch(requests)
+        now = time.time()
+        for (frame, _, session_id, _), (_, info) in zip(requests, results):
+            if frame is not None:
+                self.attendance.observe(session_id, info["face_info"], now)
+        return results
+
+    def _process_frames_batch(self, requests):
+        results = [(None, {"head_count": 0, "names": [], "face_info": []})] * len(requests)
+        valid = [i for i, request in enumerate(requests) if request[0] is not None]
+        if not valid:
+            return results
+
+        frames = [self._as_ingested(requests[i][0]) for i in valid]
+        with self._stage("motion_gate"):
+            received = len(valid)
+            valid, frames = self._reuse_static_frames(requests, valid, frames, results)
+        metrics.inc("frames_total", len(valid), component="api", outcome="analysed")
+        metrics.inc("frames_total", received - len(valid), component="api", outcome="reused")
+        if not valid:
+            return results
+        self.db_manager.sync_snapshot()
+        with self._stage("detect"):
+            rois_per_frame = self._plan_detection(requests, valid, frames)
+            detections_per_frame = self.detect_faces_only(frames, rois_per_frame)
+
+        # Track first so faces already locked to a ReID can skip embedding
+        for i, frame, detections, rois in zip(valid, frames, detections_per_frame, rois_per_frame):
+            _, use_tracking, session_id, _ = requests[i]
+            if not use_tracking:
+                continue
+            session = self.sessions.get(session_id)
+            with session.lock, self._stage("track"):
+                session.detection.record(rois, len(detections))
+                session.tracker.update(detections)
+                session.best_shots.retain(session.tracker.track_ids())
+                for det in detections:
+                    det["needs_embedding"] = session.tracker.needs_embedding(
+                        det["track_id"], self.reverify_interval
+                    )
+                self._score_unidentified(session, frame, detections)
+
+        with self._stage("embed"):
+            self._embed_pending(frames, detections_per_frame)
+
+        for i, frame, detections in zip(valid, frames, detections_per_frame):
+            _, use_tracking, session_id, render = requests[i]
+            if not use_tracking:
+                results[i] = self._identify_and_render(None, frame, detections, render=render)
+                continue
+            session = self.sessions.get(session_id)
+            with session.lock:
+                results[i] = self._identify_and_render(session, frame, detections, render=render)
+                session.last_info = results[i][1]
+        return results
+
+    def _reuse_static_frames(self, requests, valid, frames, results):
+        """Answer tracked frames whose scene has not changed with the session's last result.
+
+        Fills results for those requests; returns (valid, frames) of the ones
+        that still need a real pass.
+        """
+        remaining = []
+        for i, frame in zip(valid, frames):
+            _, use_tracking, session_id, render = requests[i]
+            session = self.sessions.get(session_id) if use_tracking else None
+            if session is None or session.motion is None:
+                remaining.append((i, frame))
+                continue
+            with session.lock:
+                # New tracks collecting best shots need real frames until they resolve
+                force = session.last_info is None or len(session.best_shots) > 0
+                if session.motion.should_analyse(frame.detector_frame, force=force):
+                    remaining.append((i, frame))
+                    continue
+                info = session.last_info
+                # Keep the tracks alive as if their faces were detected again
+                session.tracker.update([{"bbox": tuple(entry["bbox"]), "confidence": entry["confidence"]}
+                                        for entry in info["face_info"]])
+                session.frame_count += 1
+                display_frame = self._render(frame, info["face_info"]) if render else None
+                results[i] = (display_frame, {**info, "reused_previous_result": True})
+        return [i for i, _ in remaining], [frame for _, frame in remaining]
+
+    def _plan_detection(self, requests, valid, frames):
+        """Per frame: ROIs around the session's live tracks, or None for a full-frame sweep"""
+        rois_per_frame = []
+        for i, frame in zip(valid, frames):
+            _, use_tracking, session_id, _ = requests[i]
+            rois = None
             if use_tracking:
-                detections = self.tracker.update(detections)
-    
-            display_frame = frame.copy()
-            face_info, names = [], []
-    
+                session = self.sessions.get(session_id)
+                with session.lock:
+                    rois = session.detection.plan(session.tracker.boxes(), frame.original_size,
+                                                  self.roi_input_size, max(frame.detector_frame.shape[:2]))
+            rois_per_frame.append(rois)
+        return rois_per_frame
+
+    def _score_unidentified(self, session, frame, detections):
+        """Score shots of tracks without a ReID; only improvements get embedded.
+
+        The caller holds session.lock.
+        """
+        candidates = [det for det in detections if det["needs_embedding"]
+                      and session.tracker.get_identity(det["track_id"])[0] is None]
+        if not candidates:
+            return
+        self._attach_crops(frame, candidates)
+        scores = score_faces([det["face_crop"] for det in candidates],
+                             [det.get("kps") for det in candidates])
+        for det, score in zip(candidates, scores):
+            det["quality"] = float(score)
+            det["needs_embedding"] = session.best_shots.improves(det["track_id"], det["quality"])
+
+    def process_frame_with_info(self, frame, use_tracking=True, session_id=DEFAULT_SESSION_ID, render=True):
+        return self.process_frames_batch([(frame, use_tracking, session_id, render)])[0]
+
+    def _identify_and_render(self, session, frame, detections, render=True):
+        """Match/enroll and draw already-tracked detections of one IngestedFrame.
+
+        session is None for untracked requests; otherwise the caller holds
+        session.lock. Detections carrying an encoding are new,
+        unlocked or being re-verified; the rest reuse their track's ReID.
+        Tracks without a ReID are held as "pending" until their best shot is
+        ready, then matched/enrolled with that shot's embedding and crop. With
+        render=False the frame copy and OpenCV drawing are skipped and None is
+        returned in place of the annotated frame.
+        """
+        use_tracking = session is not None
+        tracker = session.tracker if use_tracking else None
+
+        if use_tracking:
             for det in detections:
                 track_id = det["track_id"]
-                encoding = det.get("encoding")
-                face_crop = det["face_crop"]
-                confidence = det.get("confidence", 0.99)
-    
-                if encoding is None:
+                if tracker.get_identity(track_id)[0] is not None:
                     continue
-                
-                # Check if track already locked to a ReID
-                if use_tracking and self.tracker.tracks[track_id].get("reid") is not None:
-                    name = self.tracker.tracks[track_id]["name"]
-                    reid_num = self.tracker.tracks[track_id]["reid"]
+                if det.get("encoding") is not None:
+                    session.best_shots.offer(track_id, det.get("quality", 0.0),
+                                             (det["encoding"], det["face_crop"]))
+                if session.best_shots.ready(track_id):
+                    _, (det["encoding"], det["face_crop"]) = session.best_shots.take(track_id)
                 else:
-                    # One-time lookup/creation
-                    matching_reid, sim = self._find_matching_reid(encoding)
-                    if matching_reid is not None:
-                        reid_num = matching_reid
-                        name = self.db_manager.reid_name_map.get(f"reid_{reid_num}",
-                                                                f"Unknown_{reid_num}")
-                    else:
-                        reid_num = self.db_manager.next_reid_num()
-                        name = f"Unknown_{reid_num}"
-                        cv2.imwrite(f"{self.face_img_path}/reid_{reid_num}.jpg", face_crop)
-                        self.db_manager.add(embedding=encoding.tolist(),
-                                          reid_num=reid_num,
-                                          name=name)
-                        self.reid_embeddings[reid_num] = encoding
-                    
-                    # Lock to track
-                    if use_tracking:
-                        self.tracker.tracks[track_id]["reid"] = reid_num
-                        self.tracker.tracks[track_id]["name"] = name
-    
-                label = f"{name} (ID:{reid_num})"
-                color = (0, 255, 0) if not name.startswith("Unknown") else (0, 0, 255)
-                status = "recognized" if color == (0, 255, 0) else "unknown"
-                names.append(name)
-    
+                    det["encoding"] = None
+                    det["awaiting_shot"] = True
+
+        # Match every embedded face in one gallery pass
+        pending = [det for det in detections if det.get("encoding") is not None]
+        if pending:
+            with self._stage("match"):
+                matches = self._find_matching_reids([det["encoding"] for det in pending])
+            for det, match in zip(pending, matches):
+                det["match"] = match
+
+        face_info, names = [], []
+
+        for det in detections:
+            track_id = det["track_id"]
+            encoding = det.get("encoding")
+            confidence = det.get("confidence", 0.99)
+
+            # Check if track already locked to a ReID
+            locked_reid, locked_name = tracker.get_identity(track_id) if use_tracking else (None, None)
+            if det.get("awaiting_shot"):
                 x1, y1, x2, y2 = det["bbox"]
                 face_info.append({
                     "detection_id": track_id,
-                    "name": name,
-                    "reid_num": reid_num,
+                    "name": "Processing...",
+                    "reid_num": None,
                     "bbox": [x1, y1, x2, y2],
                     "confidence": float(confidence),
-                    "status": status
+                    "status": "pending"
                 })
+                continue
+            elif locked_reid is not None and encoding is None:
+                name = locked_name
+                reid_num = locked_reid
+            elif encoding is None:
+                continue
+            else:
+                # Lookup/creation, or periodic re-verification of a locked track
+                matching_reid, sim = det.get("match", (None, -1))
+                if matching_reid is not None:
+                    reid_num = matching_reid
+                    name = self.db_manager.reid_name_map.get(f"reid_{reid_num}",
+                                                            f"Unknown_{reid_num}")
+                    if sim >= self.template_min_similarity:
+                        self._add_template(reid_num, encoding)
+                elif locked_reid is not None:
+                    # Weak re-verification shot: keep the existing lock
+                    reid_num, name = locked_reid, locked_name
+                else:
+                    with self._stage("enroll"):
+                        reid_num, name = self._enroll_face(encoding, det["face_crop"])
                 
-                # Draw bounding box and label
-                cv2.rectangle(display_frame, (x1, y1), (x2, y2), color, 2)
-                label_with_conf = f"{label} ({confidence:.2f})"
-                cv2.putText(display_frame, label_with_conf, (x1, y1 - 10),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-    
-            self.frame_count += 1
-            info = {
-                "head_count": len(detections),
-                "names": list(set(names)),
-                "face_info": face_info,
-                "tracking_enabled": use_tracking,
-                "detector": "YOLO11",
-                "recognizer": "InsightFace",
-                "gpu_enabled": self.use_gpu
-            }
-            return display_frame, info
+                # Lock to track
+                if use_tracking:
+                    tracker.assign_identity(track_id, reid_num, name)
+
+            status = "unknown" if name.startswith("Unknown") else "recognized"
+            names.append(name)
+
+            x1, y1, x2, y2 = det["bbox"]
+            face_info.append({
+                "detection_id": track_id,
+                "name": name,
+                "reid_num": reid_num,
+                "bbox": [x1, y1, x2, y2],
+                "confidence": float(confidence),
+                "status": status
+            })
+
+        display_frame = self._render(frame, face_info) if render else None
+        if use_tracking:
+            session.frame_count += 1
+        info = {
+            "head_count": len(detections),
+            "names": list(set(names)),
+            "face_info": face_info,
+            "tracking_enabled": use_tracking,
+            "detector": self.detector_name,
+            "recognizer": "InsightFace",
+            "gpu_enabled": self.use_gpu
+        }
+        return display_frame, info
+
+    @contextmanager
+    def _stage(self, name):
+        """Time a pipeline stage into /metrics and stage_observer, if one is set."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("stage_seconds", elapsed, component="api", stage=name)
+            if self.stage_observer is not None:
+                self.stage_observer(name, elapsed)
+
+    def _register_gauges(self):
+        """Expose session and gallery sizes on /metrics, read at scrape time."""
+        metrics.describe("stage_seconds", "Pipeline stage latency in seconds")
+        metrics.describe("frames_total", "Frames handled, by whether they were analysed or reused")
+        metrics.describe("unaligned_faces_total", "Faces embedded from a box crop because no landmarks were found")
+        metrics.gauge("sessions_active", lambda: len(self.sessions), "Active pipeline sessions",
+                      component="api")
+        metrics.gauge("tracks_active", lambda: sum(len(s.tracker) for s in self.sessions.all()),
+                      "Live tracks across all sessions", component="api")
+        metrics.gauge("tracks_awaiting_shot", lambda: sum(len(s.best_shots) for s in self.sessions.all()),
+                      "Tracks still waiting for a good enough shot to identify", component="api")
+        metrics.gauge("gallery_identities", lambda: len(self.gallery), "Identities in the gallery",
+                      component="api")
+        metrics.gauge("gallery_templates", self.gallery.template_count, "Templates in the gallery",
+                      component="api")
+
+    def _render(self, frame, face_info):
+        """Full-resolution copy of frame with every face_info entry drawn on it."""
+        with self._stage("render"):
+            display_frame = frame.full.copy()
+            for entry in face_info:
+                self._draw_face_info(display_frame, entry)
+        return display_frame
+
+    @staticmethod
+    def _draw_face_info(display_frame, entry):
+        """Draw one face_info entry's box and label on display_frame."""
+        x1, y1, x2, y2 = entry["bbox"]
+        if entry["status"] == "pending":
+            color, label = (0, 165, 255), "Processing..."
+        else:
+            color = (0, 255, 0) if entry["status"] == "recognized" else (0, 0, 255)
+            label = f"{entry['name']} (ID:{entry['reid_num']})"
+        cv2.rectangle(display_frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(display_frame, f"{label} ({entry['confidence']:.2f})", (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+    def _enroll_face(self, encoding, face_crop):
+        """Enroll a new Unknown_N identity, or reuse one another session just enrolled."""
+        with self._enroll_lock:
+            # Re-check under the lock: a concurrent session may have enrolled this face
+            matching_reid, _ = self._find_matching_reid(encoding)
+            if matching_reid is not None:
+                return matching_reid, self.db_manager.reid_name_map.get(f"reid_{matching_reid}",
+                                                                        f"Unknown_{matching_reid}")
+            reid_num = self.db_manager.next_reid_num()
+            name = f"Unknown_{reid_num}"
+            cv2.imwrite(f"{self.face_img_path}/reid_{reid_num}.jpg", face_crop)
+            self.db_manager.add(embedding=encoding.tolist(),
+                                reid_num=reid_num,
+                                name=name)
+            self.gallery.add(reid_num, encoding)
+            return reid_num, name
+
+    def _add_template(self, reid_num, encoding):
+        """Keep a new sighting of reid_num as a template if it adds diversity."""
+        slot = self.gallery.add_template(reid_num, encoding, novelty=self.template_novelty)
+        if slot is not None:
+            self.db_manager.put_template(encoding.tolist(), reid_num, slot)
+            logger.debug(f"Stored template {slot} for ReID {reid_num}")
 
     def _calculate_similarity(self, encoding1, encoding2):
         """Calculate cosine similarity between two encodings"""
-        return 1 - cosine(encoding1, encoding2)
+        encoding1, encoding2 = np.asarray(encoding1), np.asarray(encoding2)
+        return float(np.dot(encoding1, encoding2) /
+                     (np.linalg.norm(encoding1) * np.linalg.norm(encoding2)))
 
-    # In api.py FaceRecognitionAPI class
-    def _find_matching_reid(self, encoding):
-        """Find matching ReID using only ChromaDB."""
+    def _find_matching_reids(self, encodings):
+        """Match a batch of encodings against the in-memory gallery.
+
+        Returns one (reid_num, similarity) pair per encoding, with
+        (None, -1) where no gallery entry clears similarity_threshold.
+        """
         try:
-            if not self.db_manager.face_db or self.db_manager.face_db.count() == 0:
-                return None, -1
-    
-            # Query ChromaDB for the closest match
-            qr = self.db_manager.face_db.query(
-                query_embeddings=[encoding.tolist()],
-                n_results=1
-            )
-    
-            ids = qr.get("ids", [[]])[0]
-            distances = qr.get("distances")
-            if distances is None or not distances or not distances[0]:
-                return None, -1
-            distances = distances[0]
-    
-            if ids and distances:
-                distance = distances[0]
-                # Convert L2 distance to cosine similarity
-                similarity = 1 - (distance ** 2) / 2
-    
-                if similarity > self.similarity_threshold:
-                    key = ids[0]
-                    reid_num = int(key.split("_")[1])
-                    return reid_num, similarity
-    
-            return None, -1 # Return -1 for similarity if no good match found
-    
+            reids, sims = self.gallery.match(np.stack(encodings), self.similarity_threshold)
+            return [(int(r), float(s)) if r >= 0 else (None, -1) for r, s in zip(reids, sims)]
         except Exception as e:
-            logger.error(f"Error in _find_matching_reid: {e}")
-            return None, -1
+            logger.error(f"Error in _find_matching_reids: {e}")
+            return [(None, -1)] * len(encodings)
+
+    def _find_matching_reid(self, encoding):
+        """Find matching ReID for a single encoding."""
+        return self._find_matching_reids([encoding])[0]
 
     def rename_person(self, reid_num, new_name):
         """Rename a person in the database"""
@@ -454,9 +1189,7 @@ class FaceRecognitionAPI:
         success = self.db_manager.update_name(reid_num, new_name)
 
         if success:
-            for track_id, (_, rid, emb) in self.known_faces.items():
-                if rid == reid_num:
-                    self.known_faces[track_id] = (new_name, reid_num, emb)
+            self._relabel_tracks(reid_num, reid_num, new_name)
             return True, f"Renamed ReID {reid_num} to {new_name}"
         return False, f"Failed to rename ReID {reid_num}"
 
@@ -483,17 +1216,20 @@ class FaceRecognitionAPI:
         success = self.db_manager.update_name(source_reid_num, f"Merged_to_{target_reid_num}")
     
         if success:
-            for track_id, (name, rid, emb) in list(self.known_faces.items()):
-                if rid == source_reid_num:
-                    self.known_faces[track_id] = (target_name, target_reid_num, emb)
-            
-            if source_reid_num in self.reid_embeddings:
-                del self.reid_embeddings[source_reid_num]
+            self._relabel_tracks(source_reid_num, target_reid_num, target_name)
+            self.gallery.relabel(source_reid_num, target_reid_num)
             
             return True, f"Merged ReID {source_reid_num} into {target_reid_num}"
         
         return False, f"Failed to merge ReID {source_reid_num}"
 
+    def _relabel_tracks(self, reid_num, new_reid_num, name):
+        """Update live tracks locked to reid_num; cached results still show the old name."""
+        for session in self.sessions.all():
+            with session.lock:
+                session.tracker.relabel(reid_num, new_reid_num, name)
+                session.last_info = None
+
     def get_status(self):
         """Get system status"""
         gpu_status = "Enabled" if self.use_gpu else "Disabled"
@@ -507,21 +1243,36 @@ class FaceRecognitionAPI:
         except:
             pass
             
+        import onnxruntime as ort
         if 'CUDAExecutionProvider' in ort.get_available_providers():
             gpu_details.append("ONNX Runtime: CUDA available")
         
         return {
-            "known_faces_in_session": len(self.known_faces),
-            "total_reid_database": len(self.reid_embeddings),
-            "face_detector": "YOLO11",
+            "known_faces_in_session": sum(s.tracker.locked_count() for s in self.sessions.all()),
+            "active_sessions": len(self.sessions),
+            "total_reid_database": len(self.gallery),
+            "gallery_templates": self.gallery.template_count(),
+            "gallery_index": self.db_manager.index_stats(),
+            "face_detector": self.detector_name,
+            "pipeline_mode": self.pipeline_mode,
             "face_recognizer": "InsightFace (buffalo_l/buffalo_s)",
+            "recognizer_precision": self.recognizer_precision,
             "similarity_threshold": self.similarity_threshold,
             "face_storage_path": self.face_img_path,
             "gpu_status": gpu_status,
             "gpu_details": gpu_details if gpu_details else ["No GPU detected"],
-            "architecture": "Synchronous with GPU acceleration"
+            "attendance_log": self.attendance.summary(),
+            "architecture": "Per-session pipelines sharing models and gallery"
         }
 
+    def get_attendance(self, session_id, start=0.0, end=None):
+        """Identities present in a session between start and end (epoch seconds), with current names"""
+        present = self.attendance.query(session_id, start, end)
+        for row in present:
+            row["name"] = self.db_manager.reid_name_map.get(f"reid_{row['reid_num']}",
+                                                            f"Unknown_{row['reid_num']}")
+        return present
+
     def get_all_faces(self):
         """Get all faces from database"""
         faces = []
@@ -538,41 +1289,87 @@ class FaceRecognitionAPI:
                 continue
         return faces
 
-    def find_potential_duplicates(self, similarity_threshold=None):
+    def find_potential_duplicates(self, similarity_threshold=None, top_k=5, on_progress=None):
         """Find potential duplicate ReIDs"""
         if similarity_threshold is None:
             similarity_threshold = self.similarity_threshold + 0.1
-            
-        duplicates = []
-        reid_list = list(self.reid_embeddings.items())
-        
-        for i in range(len(reid_list)):
-            for j in range(i + 1, len(reid_list)):
-                reid1, enc1 = reid_list[i]
-                reid2, enc2 = reid_list[j]
-                
-                similarity = self._calculate_similarity(enc1, enc2)
-                
-                if similarity > similarity_threshold:
-                    name1 = self.db_manager.reid_name_map.get(f"reid_{reid1}", "Unknown")
-                    name2 = self.db_manager.reid_name_map.get(f"reid_{reid2}", "Unknown")
-                
-                    duplicates.append({
-                        "reid1": reid1, "name1": name1,
-                        "reid2": reid2, "name2": name2,
-                        "similarity": float(similarity)
-                    })
-        
-        duplicates.sort(key=lambda x: x["similarity"], reverse=True)
-        return duplicates
 
-    def reset_tracker(self):
-        """Reset the session cache for detected faces"""
-        self.frame_count = 0
-        self.known_faces.clear()
-        self.tracker = IoUTracker(iou_threshold=0.3, max_age=5)
+        reids, centroids = self.gallery.centroids(active_only=True)
+        if len(reids) < 2:
+            return []
+
+        def to_dicts(pairs):
+            name_map = self.db_manager.reid_name_map
+            return [{
+                "reid1": reid1, "name1": name_map.get(f"reid_{reid1}", "Unknown"),
+                "reid2": reid2, "name2": name_map.get(f"reid_{reid2}", "Unknown"),
+                "similarity": similarity,
+            } for reid1, reid2, similarity in pairs]
+
+        on_block = None
+        if on_progress is not None:
+            on_block = lambda done, total, pairs: on_progress(done, total, to_dicts(pairs))
+
+        pairs = find_duplicate_pairs(
+            reids,
+            centroids,
+            similarity_threshold,
+            top_k=top_k,
+            on_block=on_block,
+        )
+        return to_dicts(pairs)
+
+    def start_duplicate_scan(self, similarity_threshold=None, top_k=5):
+        """Run find_potential_duplicates in a background thread.
+
+        Progress and partial results are readable via get_duplicate_scan().
+        Returns False if a scan is already running.
+        """
+        with self._duplicate_scan_lock:
+            if self._duplicate_scan["status"] == "running":
+                return False
+            self._duplicate_scan = {"status": "running", "rows_done": 0,
+                                    "total_rows": len(self.gallery),
+                                    "duplicates": [], "started_at": time.time(),
+                                    "finished_at": None, "error": None}
+
+        def on_progress(done, total, duplicates):
+            with self._duplicate_scan_lock:
+                self._duplicate_scan.update(rows_done=done, total_rows=total, duplicates=duplicates)
+
+        def run():
+            try:
+                duplicates = self.find_potential_duplicates(similarity_threshold, top_k, on_progress)
+                with self._duplicate_scan_lock:
+                    self._duplicate_scan.update(status="done", duplicates=duplicates,
+                                                rows_done=self._duplicate_scan["total_rows"])
+            except Exception as e:
+                logger.error(f"Duplicate scan failed: {e}")
+                with self._duplicate_scan_lock:
+                    self._duplicate_scan.update(status="failed", error=str(e))
+            finally:
+                with self._duplicate_scan_lock:
+                    self._duplicate_scan["finished_at"] = time.time()
+
+        threading.Thread(target=run, daemon=True, name="duplicate_scan").start()
+        return True
+
+    def get_duplicate_scan(self):
+        """Snapshot of the current or last background duplicate scan"""
+        with self._duplicate_scan_lock:
+            return dict(self._duplicate_scan)
+
+    def reset_tracker(self, session_id=None):
+        """Reset the session cache for detected faces (one session, or all when None)"""
+        sessions = self.sessions.all() if session_id is None else [self.sessions.get(session_id)]
+        for session in sessions:
+            with session.lock:
+                session.reset()
         logger.info("Tracker (session cache) reset successfully")
 
+    def get_sessions(self):
+        return [session.summary() for session in self.sessions.all()]
+
 
 # Pydantic models
 class TutorRequest(BaseModel):
@@ -583,6 +1380,14 @@ class TestRequest(BaseModel):
     thread_id: str
     prompt: str = "Yes, please create a test."
 
+class ProfileRequest(BaseModel):
+    mode: str = "sample"            # "sample" (stack sampling) or "cprofile"
+    frames: int | None = None       # stop after this many frames...
+    seconds: float | None = None    # ...or after this long (10 s if neither is set)
+    interval_ms: float = 5.0        # sampling period in "sample" mode
+    top: int = 30                   # functions in the summary
+    wait: bool = False              # respond only once the capture has finished
+
 def get_agent_response(agent, message, thread_id):
     """Helper function to invoke an agent and parse its JSON response."""
     config = {"configurable": {"thread_id": thread_id}}
@@ -593,8 +1398,42 @@ def get_agent_response(agent, message, thread_id):
     except json.JSONDecodeError:
         return {"error": "Failed to parse agent's JSON response.", "raw_response": ai_message_content}
 
+def load_vision():
+    """Build the face recognition pipeline (YOLO11, InsightFace, ChromaDB gallery)."""
+    return FaceRecognitionAPI(
+        face_img_path="saved_faces",
+        similarity_threshold=0.4,
+        yolo_model_path="yolo12l-face.pt",  # You'll need to download or train this model
+        use_gpu=True,
+        pipeline_mode=os.getenv("FACE_PIPELINE_MODE", "hybrid"),
+        det_thresh=float(os.getenv("FACE_DET_THRESH", "0.5")),
+        full_sweep_interval=int(os.getenv("FACE_FULL_SWEEP_INTERVAL", "10")),
+        yolo_backend=os.getenv("FACE_YOLO_BACKEND", "torch"),
+        yolo_onnx_path=os.getenv("FACE_YOLO_ONNX", "yolo-face.onnx"),
+        recognition_int8_path=os.getenv("FACE_REC_INT8") or None,
+    )
+
+def load_tutor():
+    """Build the LangGraph tutor agents; fails if GROQ_API_KEY is not set."""
+    from apiTutor import ai_tutor, test_creator
+    return {"ai_tutor": ai_tutor, "test_creator": test_creator}
+
+# Vision and tutor load independently in background threads once the app
+# starts; routes needing one answer 503 until it is ready (see /ready)
+vision = Subsystem("vision", load_vision)
+tutor = Subsystem("tutor", load_tutor)
+
+@asynccontextmanager
+async def lifespan(app):
+    vision.start()
+    tutor.start()
+    yield
+    if vision.ready:
+        # Write out open presence intervals so the last minutes are not lost
+        vision.get().attendance.close()
+
 # FastAPI Setup
-app = FastAPI(title="YOLO11 + InsightFace GPU Face Recognition API", version="5.0-gpu")
+app = FastAPI(title="YOLO11 + InsightFace GPU Face Recognition API", version="5.0-gpu", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -603,25 +1442,80 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def image_to_base64(image):
+def image_to_jpeg_bytes(image):
     _, buffer = cv2.imencode(".jpg", image)
-    return base64.b64encode(buffer.tobytes()).decode("utf-8")
-
-# Initialize the face recognition API with YOLO11 and InsightFace
-face_api = FaceRecognitionAPI(
-    face_img_path="saved_faces",
-    similarity_threshold=0.4,
-    yolo_model_path="yolo12l-face.pt",  # You'll need to download or train this model
-    use_gpu=True
+    return buffer.tobytes()
+
+def image_to_base64(image):
+    return base64.b64encode(image_to_jpeg_bytes(image)).decode("utf-8")
+
+# Binary /ws/analyze framing, negotiated per connection with the
+# "facerec.binary.v1" WebSocket subprotocol (or ?protocol=binary):
+#   [4-byte big-endian header length][UTF-8 JSON header][raw JPEG bytes, optional]
+# Requests carry use_tracking/session_id in the header and the camera JPEG as
+# payload; responses carry the analysis in the header and the annotated JPEG.
+BINARY_WS_SUBPROTOCOL = "facerec.binary.v1"
+_BINARY_HEADER_LEN = struct.Struct(">I")
+
+def pack_binary_message(header, payload=b""):
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return _BINARY_HEADER_LEN.pack(len(header_bytes)) + header_bytes + payload
+
+def unpack_binary_message(message):
+    if len(message) < _BINARY_HEADER_LEN.size:
+        raise ValueError("Binary message shorter than its length prefix")
+    (header_len,) = _BINARY_HEADER_LEN.unpack_from(message)
+    header_end = _BINARY_HEADER_LEN.size + header_len
+    if header_end > len(message):
+        raise ValueError("Binary message header length exceeds message size")
+    header = json.loads(message[_BINARY_HEADER_LEN.size:header_end]) if header_len else {}
+    return header, memoryview(message)[header_end:]
+
+@app.exception_handler(SubsystemNotReady)
+async def subsystem_not_ready_handler(request: Request, exc: SubsystemNotReady):
+    status = exc.status
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "5"} if status["state"] != "failed" else None,
+        content={"detail": f"The {exc.name} subsystem is not ready ({status['state']})",
+                 "subsystem": exc.name, **status},
+    )
+
+def process_frames_batch(items):
+    with metrics.timer("batch_seconds", component="api"):
+        return vision.get().process_frames_batch(items)
+
+def session_lane(item):
+    """Tracked frames of one session share a batch lane, so they run one at a time, in order."""
+    _, use_tracking, session_id, _ = item
+    return session_id if use_tracking else None
+
+# Frames from all /analyze_frame and /ws/analyze clients are micro-batched
+# through detection + embedding, then split back per request
+frame_batcher = FrameBatcher(
+    process_frames_batch,
+    lane_key=session_lane,
+    max_batch_size=int(os.getenv("FRAME_BATCH_MAX_SIZE", "8")),
+    max_wait_ms=float(os.getenv("FRAME_BATCH_MAX_WAIT_MS", "10")),
+    max_concurrent_batches=int(os.getenv("FRAME_BATCH_CONCURRENCY", "2")),
 )
+metrics.describe("batch_seconds", "Latency of one micro-batch through the whole pipeline")
+metrics.describe("frames_dropped_total", "Stale WebSocket frames replaced by a newer one before processing")
+metrics.gauge("batch_queue_depth", frame_batcher.queue_depth, "Frames waiting for a micro-batch",
+              component="api")
+metrics.gauge("subsystem_ready", lambda: float(vision.ready), "1 once the subsystem has loaded",
+              subsystem="vision")
+metrics.gauge("subsystem_ready", lambda: float(tutor.ready), subsystem="tutor")
+
 @app.post("/explain")
 def explain_topic(request: TutorRequest):
     """
     Endpoint to get an explanation for a given topic.
     Creates a new conversation thread if no thread_id is provided.
     """
+    agents = tutor.get()
     thread_id = request.thread_id or str(uuid.uuid4())
-    response_data = get_agent_response(ai_tutor, request.topic, thread_id)
+    response_data = get_agent_response(agents["ai_tutor"], request.topic, thread_id)
     return {"thread_id": thread_id, "response": response_data}
 
 @app.post("/create_test")
@@ -629,29 +1523,43 @@ def create_test(request: TestRequest):
     """
     Endpoint to create a test based on the conversation in the given thread.
     """
-    response_data = get_agent_response(test_creator, request.prompt, request.thread_id)
+    agents = tutor.get()
+    response_data = get_agent_response(agents["test_creator"], request.prompt, request.thread_id)
     return {"thread_id": request.thread_id, "response": response_data}
 
 @app.post("/analyze_frame")
-async def analyze_frame(file: UploadFile = File(...), use_tracking: bool = Form(True)):
-    """Analyze a frame using face_recognition"""
+async def analyze_frame(file: UploadFile = File(...), use_tracking: bool = Form(True),
+                        session_id: str = Form(DEFAULT_SESSION_ID),
+                        annotations_only: bool = Form(False)):
+    """Analyze a frame using face_recognition.
+
+    With annotations_only the server skips drawing and JPEG re-encoding and
+    returns just the detections for the client to draw itself.
+    """
+    face_api = vision.get()
     try:
         # Read image file
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if frame is None:
+        try:
+            frame = IngestedFrame.from_bytes(contents, face_api.detector_input_size,
+                                             need_full=not annotations_only)
+        except ValueError:
             raise HTTPException(status_code=400, detail="Invalid image file")
 
-        import asyncio
-        loop = asyncio.get_event_loop()
-        processed_frame, face_info = await loop.run_in_executor(
-            None, face_api.process_frame_with_info, frame, use_tracking
+        processed_frame, face_info = await frame_batcher.submit(
+            (frame, use_tracking, session_id, not annotations_only)
         )
+        if annotations_only:
+            return JSONResponse(content={
+                "session_id": session_id,
+                "head_count": face_info["head_count"],
+                "names": face_info["names"],
+                "face_info": face_info["face_info"],
+            })
         img_base64 = image_to_base64(processed_frame) if processed_frame is not None else None
 
         return JSONResponse(content={
+            "session_id": session_id,
             "image": img_base64,
             "head_count": face_info["head_count"],
             "names": face_info["names"],
@@ -665,6 +1573,7 @@ async def analyze_frame(file: UploadFile = File(...), use_tracking: bool = Form(
 
 @app.post("/rename")
 async def rename_person(reid_num: str = Form(...), new_name: str = Form(...)):
+    face_api = vision.get()
     success, message = face_api.rename_person(reid_num, new_name)
     if not success and "Invalid" in message:
         raise HTTPException(status_code=400, detail=message)
@@ -672,15 +1581,31 @@ async def rename_person(reid_num: str = Form(...), new_name: str = Form(...)):
 
 @app.get("/status")
 async def get_status():
-    return JSONResponse(content=face_api.get_status())
+    status = vision.get().get_status() if vision.ready else {"vision": vision.status()}
+    return JSONResponse(content={**status, "batching": frame_batcher.stats()})
+
+@app.get("/ready")
+async def get_ready():
+    """Per-subsystem readiness; 200 once every subsystem is ready, else 503"""
+    subsystems = {subsystem.name: subsystem.status() for subsystem in (vision, tutor)}
+    ready = all(status["state"] == "ready" for status in subsystems.values())
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"ready": ready, "subsystems": subsystems})
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text: stage latency summaries (p50/p95/p99), counters and gauges"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/faces")
 async def get_all_faces():
+    face_api = vision.get()
     return JSONResponse(content={"faces": face_api.get_all_faces()})
 
 @app.get("/unknown_faces")
 async def get_unknown_faces():
     """Get all unknown/unidentified faces"""
+    face_api = vision.get()
     try:
         all_faces = face_api.get_all_faces()
         unknown_faces_list = []
@@ -705,6 +1630,7 @@ async def get_unknown_faces():
 @app.get("/face_image/{reid_num}")
 async def get_face_image(reid_num: int):
     """Get saved face image for a ReID number"""
+    face_api = vision.get()
     face_image_path = f"{face_api.face_img_path}/reid_{reid_num}.jpg"
     if not os.path.exists(face_image_path):
         raise HTTPException(status_code=404, detail="Face image not found")
@@ -716,6 +1642,7 @@ async def get_face_image(reid_num: int):
 @app.post("/add_student")
 async def add_student(reid_num: str = Form(...), student_name: str = Form(...)):
     """Rename an 'Unknown' face to a student's name"""
+    face_api = vision.get()
     success, message = face_api.rename_person(reid_num, student_name)
     if not success:
         if "Invalid" in message or "empty" in message:
@@ -729,6 +1656,7 @@ async def add_student(reid_num: str = Form(...), student_name: str = Form(...)):
 @app.delete("/remove_face/{reid_num}")
 async def remove_face(reid_num: int):
     """Remove a face by renaming it to 'Dismissed'"""
+    face_api = vision.get()
     success, message = face_api.rename_person(reid_num, f"Dismissed_{reid_num}")
     if not success:
         raise HTTPException(status_code=404, detail=f"ReID {reid_num} not found")
@@ -739,58 +1667,117 @@ async def remove_face(reid_num: int):
 
 @app.websocket("/ws/analyze")
 async def websocket_analyze_frame(websocket: WebSocket):
-    await websocket.accept()
-    logger.info("WebSocket client connected.")
-    loop = asyncio.get_event_loop()
+    # Binary mode skips base64 in both directions; JSON mode stays for older clients
+    offered = websocket.scope.get("subprotocols", [])
+    binary_mode = BINARY_WS_SUBPROTOCOL in offered or websocket.query_params.get("protocol") == "binary"
+    await websocket.accept(subprotocol=BINARY_WS_SUBPROTOCOL if BINARY_WS_SUBPROTOCOL in offered else None)
+    if not vision.ready:
+        # 1013 "Try Again Later": clients reconnect once the models are loaded
+        await websocket.close(code=1013, reason=f"Vision subsystem is {vision.status()['state']}")
+        return
+    face_api = vision.get()
+    # Each classroom camera names its session, e.g. /ws/analyze?session_id=room-101
+    connection_session_id = websocket.query_params.get("session_id", DEFAULT_SESSION_ID)
+    # ?annotations_only=true skips server-side drawing/JPEG for the whole connection
+    connection_annotations_only = websocket.query_params.get("annotations_only", "").lower() in ("1", "true", "yes")
+    logger.info(f"WebSocket client connected (session '{connection_session_id}', "
+                f"{'binary' if binary_mode else 'json'} protocol).")
+
+    async def send(response, processed_frame=None, annotations_only=False):
+        if binary_mode:
+            with face_api.profiler.capture():
+                jpeg = image_to_jpeg_bytes(processed_frame) if processed_frame is not None else b""
+                message = pack_binary_message({**response, "has_image": bool(jpeg)}, jpeg)
+            await websocket.send_bytes(message)
+        else:
+            if "error" not in response and not annotations_only:
+                with face_api.profiler.capture():
+                    response["image"] = image_to_base64(processed_frame) if processed_frame is not None else None
+            await websocket.send_json(response)
+
+    # Latest frame wins: a receive task keeps only the newest unprocessed
+    # message, so annotations never fall behind real time under overload
+    pending = LatestOnlySlot()
+    reported_dropped = 0
+
+    async def receive_loop():
+        try:
+            while True:
+                pending.put(await websocket.receive_bytes() if binary_mode else await websocket.receive_text())
+        except Exception as e:
+            pending.close(e)
+
+    receiver = asyncio.create_task(receive_loop())
     try:
         while True:
-            data = await websocket.receive_json()
-            image_b64 = data.get("image")
+            message, queue_delay = await pending.get()
+            processing_started = time.monotonic()
+            if pending.dropped > reported_dropped:
+                metrics.inc("frames_dropped_total", pending.dropped - reported_dropped, component="api")
+                reported_dropped = pending.dropped
+            try:
+                with face_api.profiler.capture():
+                    if binary_mode:
+                        data, img_bytes = unpack_binary_message(message)
+                    else:
+                        data = json.loads(message)
+                        image_b64 = data.get("image")
+                        img_bytes = base64.b64decode(image_b64) if image_b64 else b""
+            except (ValueError, TypeError) as e:
+                logger.error(f"Error decoding WebSocket message: {e}")
+                await send({"error": "Binary message decoding failed." if binary_mode else "Base64 decoding failed."})
+                continue
+
             use_tracking = data.get("use_tracking", True)
+            session_id = data.get("session_id", connection_session_id)
+            annotations_only = bool(data.get("annotations_only", connection_annotations_only))
 
-            if not image_b64:
-                await websocket.send_json({"error": "No image data provided."})
+            if not img_bytes:
+                await send({"error": "No image data provided."})
                 continue
             
             try:
-                img_bytes = base64.b64decode(image_b64)
-                nparr = np.frombuffer(img_bytes, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-                if frame is None:
-                    await websocket.send_json({"error": "Invalid image data."})
+                try:
+                    with face_api.profiler.capture():
+                        frame = IngestedFrame.from_bytes(img_bytes, face_api.detector_input_size,
+                                                         need_full=not annotations_only)
+                except ValueError:
+                    await send({"error": "Invalid image data."})
                     continue
                 
-                processed_frame, face_info = await loop.run_in_executor(
-                    None, face_api.process_frame_with_info, frame, use_tracking
+                processed_frame, face_info = await frame_batcher.submit(
+                    (frame, use_tracking, session_id, not annotations_only)
                 )
 
-                processed_image_b64 = image_to_base64(processed_frame) if processed_frame is not None else None
-                
-                await websocket.send_json({
-                    "image": processed_image_b64,
+                response = {
+                    "session_id": session_id,
                     "head_count": face_info["head_count"],
                     "names": face_info["names"],
                     "face_info": face_info["face_info"],
-                    "tracking_enabled": face_info["tracking_enabled"],
-                })
+                    "dropped_frames": pending.dropped,
+                    "queue_delay_ms": round(queue_delay * 1000, 1),
+                    "processing_ms": round((time.monotonic() - processing_started) * 1000, 1),
+                }
+                if not annotations_only:
+                    response["tracking_enabled"] = face_info["tracking_enabled"]
+                await send(response, processed_frame, annotations_only)
             
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error decoding base64 image: {e}")
-                await websocket.send_json({"error": "Base64 decoding failed."})
             except Exception as e:
                 logger.error(f"Error during frame processing: {e}")
-                await websocket.send_json({"error": f"An unexpected error occurred: {str(e)}"})
+                await send({"error": f"An unexpected error occurred: {str(e)}"})
 
     except WebSocketDisconnect:
-        logger.info("WebSocket client disconnected.")
+        logger.info(f"WebSocket client disconnected ({pending.dropped} stale frames dropped).")
     except Exception as e:
         logger.error(f"An unexpected error occurred in the WebSocket handler: {e}")
         await websocket.close(code=1011, reason="Server error")
+    finally:
+        receiver.cancel()
 
 @app.post("/merge_reid")
 async def merge_reid(source_reid: int = Form(...), target_reid: int = Form(...)):
     """Merge two ReID numbers (source becomes target)"""
+    face_api = vision.get()
     success, message = face_api.merge_reid(source_reid, target_reid)
     if not success:
         raise HTTPException(status_code=400, detail=message)
@@ -799,9 +1786,25 @@ async def merge_reid(source_reid: int = Form(...), target_reid: int = Form(...))
         "message": message
     })
 
+@app.post("/duplicates/scan")
+async def start_duplicate_scan(similarity_threshold: float | None = Form(None), top_k: int = Form(5)):
+    """Start a background scan for potential duplicate ReIDs"""
+    face_api = vision.get()
+    started = face_api.start_duplicate_scan(similarity_threshold, top_k)
+    if not started:
+        raise HTTPException(status_code=409, detail="A duplicate scan is already running")
+    return JSONResponse(content={"success": True, "message": "Duplicate scan started"})
+
+@app.get("/duplicates")
+async def get_duplicates():
+    """Get progress and (partial) results of the latest duplicate scan"""
+    face_api = vision.get()
+    return JSONResponse(content=face_api.get_duplicate_scan())
+
 @app.get("/roster")
 async def get_roster():
     """Get the list of all known/enrolled students."""
+    face_api = vision.get()
     try:
         all_faces = face_api.get_all_faces()
         student_roster = [
@@ -813,11 +1816,22 @@ async def get_roster():
         logger.error(f"Error getting roster: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting roster: {str(e)}")
 
+@app.get("/attendance")
+async def get_attendance(session_id: str = DEFAULT_SESSION_ID, start: float = 0.0, end: float | None = None):
+    """Who was present in a session between start and end (epoch seconds; end defaults to now)"""
+    face_api = vision.get()
+    if end is not None and end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    present = await asyncio.to_thread(face_api.get_attendance, session_id, start, end)
+    return JSONResponse(content={"session_id": session_id, "start": start, "end": end,
+                                 "present": present})
+
 @app.post("/reset_tracker")
-async def reset_tracker():
-    """Reset the session cache for face recognition"""
+async def reset_tracker(session_id: str | None = Form(None)):
+    """Reset the session cache for face recognition (all sessions unless session_id is given)"""
+    face_api = vision.get()
     try:
-        face_api.reset_tracker()
+        face_api.reset_tracker(session_id)
         return JSONResponse(content={
             "success": True,
             "message": "Tracker reset successfully"
@@ -826,6 +1840,72 @@ async def reset_tracker():
         logger.error(f"Error resetting tracker: {e}")
         raise HTTPException(status_code=500, detail=f"Error resetting tracker: {str(e)}")
 
+@app.get("/sessions")
+async def get_sessions():
+    """List active per-classroom pipeline sessions"""
+    face_api = vision.get()
+    return JSONResponse(content={"sessions": face_api.get_sessions()})
+
+@app.delete("/sessions/{session_id}")
+async def remove_session(session_id: str):
+    """Drop a session's tracker and cache"""
+    face_api = vision.get()
+    if not face_api.sessions.remove(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return JSONResponse(content={"success": True, "message": f"Session {session_id} removed"})
+
+def check_admin_token(request: Request):
+    """Admin routes require X-Admin-Token when FACE_ADMIN_TOKEN is set"""
+    token = os.getenv("FACE_ADMIN_TOKEN")
+    if token and request.headers.get("X-Admin-Token") != token:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/profile")
+async def start_profile(request: Request, body: ProfileRequest):
+    """Profile the next frames/seconds of the pipeline and WebSocket loop; poll GET /admin/profile"""
+    check_admin_token(request)
+    face_api = vision.get()
+    try:
+        capture = face_api.profiler.start(mode=body.mode, frames=body.frames, seconds=body.seconds,
+                                          interval_ms=body.interval_ms, top=body.top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if body.wait:
+        await asyncio.to_thread(capture.wait)
+        return JSONResponse(content=capture.status())
+    return JSONResponse(status_code=202, content=capture.status())
+
+@app.get("/admin/profile")
+async def get_profile(request: Request):
+    """State of the current or last capture, with its per-function summary once finished"""
+    check_admin_token(request)
+    capture = vision.get().profiler.current
+    if capture is None:
+        raise HTTPException(status_code=404, detail="No profile has been captured")
+    return JSONResponse(content=capture.status())
+
+@app.delete("/admin/profile")
+async def stop_profile(request: Request):
+    """End the running capture early; its results are still written"""
+    check_admin_token(request)
+    capture = vision.get().profiler.stop()
+    if capture is None:
+        raise HTTPException(status_code=404, detail="No profile has been captured")
+    await asyncio.to_thread(capture.wait)
+    return JSONResponse(content=capture.status())
+
+@app.get("/admin/profile/artifact")
+async def get_profile_artifact(request: Request):
+    """Download the last capture's .pstats (cprofile) or .collapsed (sample) file"""
+    check_admin_token(request)
+    capture = vision.get().profiler.current
+    if capture is None or capture.artifact is None:
+        raise HTTPException(status_code=404, detail="No profile artifact available")
+    return FileResponse(capture.artifact, media_type="application/octet-stream",
+                        filename=os.path.basename(capture.artifact))
+
 @app.get("/")
 async def root():
     return {
@@ -0,0 +1,306 @@
+"""Append-only presence log: who was seen in which session, and when.
+
+The pipeline reports every analysed frame's identities with observe(). A
+person's sightings in one session are merged into an interval until they go
+unseen for gap_seconds; closed intervals are appended as JSON lines to the
+active segment under <root>/segments/<writer>, a directory per PresenceLog
+(one per uvicorn worker) that its writer holds an flock on while it lives.
+Segments are sealed every segment_seconds and compacted by their own writer
+into Parquet files under <root>/parquet, sorted by (session_id, first_seen)
+and named after the time span they cover and the segment they came from, so
+query() skips whole files by name and lets polars push the session/time
+predicate down to row-group statistics for the rest. A writer directory
+whose lock is free was left by a dead worker; the next flush of any writer
+compacts and removes it.
+
+    log = PresenceLog("attendance_log")
+    log.observe("room-101", face_info)
+    log.query("room-101", start=t1, end=t2)   # one row per reid_num present
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:     # Windows: segments of dead writers are not adopted
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+WRITER_LOCK = "writer.lock"
+EVENT_COLUMNS = ("session_id", "reid_num", "first_seen", "last_seen", "confidence", "frames")
+
+
+def _event_schema():
+    import polars as pl
+    return {"session_id": pl.Utf8, "reid_num": pl.Int64, "first_seen": pl.Float64,
+            "last_seen": pl.Float64, "confidence": pl.Float32, "frames": pl.Int64}
+
+
+def _segment_source(path):
+    """<writer>_<stamp> of segments/<writer>/segment_<stamp>.jsonl, as used in Parquet names"""
+    stamp = os.path.basename(path)[len("segment_"):-len(".jsonl")]
+    return f"{os.path.basename(os.path.dirname(path))}_{stamp}"
+
+
+def _lock_writer(directory, create=False):
+    """flock a writer directory's lock file without waiting; the open file, or None if held or gone."""
+    if fcntl is None:
+        return None
+    try:
+        lock = open(os.path.join(directory, WRITER_LOCK), "a" if create else "r")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def _overlaps(event, session_id, start, end):
+    return event["session_id"] == session_id and event["first_seen"] <= end and event["last_seen"] >= start
+
+
+class PresenceLog:
+    """Presence intervals per (session, reid_num), logged append-only and compacted to Parquet.
+
+    observe() only updates in-memory intervals; a background thread closes
+    idle intervals, writes them out and compacts sealed segments every
+    flush_interval seconds. Several processes may share root.
+    """
+
+    def __init__(self, root="attendance_log", gap_seconds=30.0, segment_seconds=600.0,
+                 flush_interval=5.0, row_group_size=16384):
+        self.root = root
+        self.segments_dir = os.path.join(root, "segments")
+        self.parquet_dir = os.path.join(root, "parquet")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        os.makedirs(self.parquet_dir, exist_ok=True)
+        self.gap_seconds = gap_seconds
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self.row_group_size = row_group_size
+        self._open = {}          # (session_id, reid_num) -> open interval event
+        self._closed = []        # closed intervals not yet written
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.writer_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.writer_dir = os.path.join(self.segments_dir, self.writer_id)
+        os.makedirs(self.writer_dir)
+        self._writer_lock = _lock_writer(self.writer_dir, create=True)
+        self._segment_path = None
+        self._segment_started = 0.0
+        self.events_written = 0
+        self.segments_compacted = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True, name="presence_log")
+        self._thread.start()
+
+    def observe(self, session_id, face_info, timestamp=None):
+        """Record the identified faces (face_info entries with a reid_num) of one frame."""
+        now = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for entry in face_info:
+                reid_num = entry.get("reid_num")
+                if reid_num is None:
+                    continue
+                key = (session_id, int(reid_num))
+                event = self._open.get(key)
+                if event is not None and now - event["last_seen"] > self.gap_seconds:
+                    self._closed.append(self._open.pop(key))
+                    event = None
+                if event is None:
+                    self._open[key] = {"session_id": session_id, "reid_num": int(reid_num),
+                                       "first_seen": now, "last_seen": now,
+                                       "confidence": float(entry["confidence"]), "frames": 1}
+                    continue
+                # Running mean of the detection confidence over the interval
+                event["frames"] += 1
+                event["confidence"] += (float(entry["confidence"]) - event["confidence"]) / event["frames"]
+                event["last_seen"] = max(event["last_seen"], now)
+
+    def flush(self, close_all=False):
+        """Close idle (or all) intervals, append them to the active segment and compact sealed ones."""
+        now = time.time()
+        # _write_lock first: query() must see each event either in memory or on disk
+        with self._write_lock:
+            with self._lock:
+                for key, event in list(self._open.items()):
+                    if close_all or now - event["last_seen"] > self.gap_seconds:
+                        self._closed.append(self._open.pop(key))
+                closed, self._closed = self._closed, []
+            if closed:
+                self._append(closed, now)
+            if close_all or (self._segment_path and now - self._segment_started >= self.segment_seconds):
+                self._segment_path = None
+            self.compact()
+
+    def _append(self, events, now):
+        if self._segment_path is None:
+            self._segment_path = os.path.join(self.writer_dir, f"segment_{int(now * 1000)}.jsonl")
+            self._segment_started = now
+        with open(self._segment_path, "a") as f:
+            for event in events:
+                f.write(json.dumps({column: event[column] for column in EVENT_COLUMNS},
+                                   separators=(",", ":")) + "\n")
+        self.events_written += len(events)
+
+    def _sealed_segments(self):
+        return [path for path in sorted(glob.glob(os.path.join(self.writer_dir, "segment_*.jsonl")))
+                if path != self._segment_path]
+
+    def compact(self):
+        """Compact this writer's sealed segments and those dead writers left; callers hold _write_lock."""
+        for path in self._sealed_segments():
+            self._compact_segment(path)
+        self._adopt_dead_writers()
+
+    def _compact_segment(self, path):
+        """Rewrite one JSON-lines segment as a sorted Parquet file named after it, then drop it."""
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+            return
+        import polars as pl
+        events = pl.read_ndjson(path, schema=_event_schema()).sort(["session_id", "first_seen"])
+        first, last = events["first_seen"].min(), events["last_seen"].max()
+        # Named after its segment, so compacting a segment again replaces the file
+        target = os.path.join(self.parquet_dir,
+                              f"events_{int(first)}_{int(last) + 1}_{_segment_source(path)}.parquet")
+        events.write_parquet(f"{target}.tmp", statistics=True, row_group_size=self.row_group_size)
+        os.replace(f"{target}.tmp", target)
+        os.remove(path)
+        self.segments_compacted += 1
+
+    def _adopt_dead_writers(self):
+        for directory in glob.glob(os.path.join(self.segments_dir, "*", "")):
+            directory = os.path.dirname(directory)
+            if directory == self.writer_dir or not os.path.exists(os.path.join(directory, WRITER_LOCK)):
+                continue
+            lock = _lock_writer(directory)
+            if lock is None:
+                continue            # its writer is alive
+            try:
+                for path in sorted(glob.glob(os.path.join(directory, "segment_*.jsonl"))):
+                    self._compact_segment(path)
+                os.remove(os.path.join(directory, WRITER_LOCK))
+                os.rmdir(directory)
+                logger.info(f"Compacted presence segments left by writer {os.path.basename(directory)}")
+            except FileNotFoundError:
+                pass                # another writer adopted it first
+            finally:
+                lock.close()
+
+    def _parquet_files(self, start, end, skip_sources=()):
+        """Parquet files whose [first_seen, last_seen] span, encoded in the name, overlaps [start, end]"""
+        files = []
+        for path in glob.glob(os.path.join(self.parquet_dir, "events_*.parquet")):
+            _, first, last, source = os.path.basename(path)[:-len(".parquet")].split("_", 3)
+            if int(first) <= end and int(last) >= start and source not in skip_sources:
+                files.append(path)
+        return sorted(files)
+
+    def _segment_events(self, session_id, start, end):
+        """Matching events of every writer's segments, and the sources of the segments read."""
+        events, sources = [], set()
+        for path in sorted(glob.glob(os.path.join(self.segments_dir, "*", "segment_*.jsonl"))):
+            try:
+                with open(path) as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                continue            # compacted meanwhile; its Parquet file is listed below
+            sources.add(_segment_source(path))
+            for line in lines:
+                if not line.endswith("\n"):
+                    break           # line still being appended by another writer
+                event = json.loads(line)
+                if _overlaps(event, session_id, start, end):
+                    events.append(event)
+        return events, sources
+
+    def query(self, session_id, start=0.0, end=None):
+        """Who was present in session_id between start and end (epoch seconds).
+
+        One dict per reid_num with its earliest first_seen and latest
+        last_seen within the matching intervals, the frame-weighted mean
+        confidence, total frames and number of intervals.
+        """
+        end = time.time() if end is None else end
+        # Segments, memory and the file list are read together so no event is
+        # missed or counted twice while a flush or compaction moves it along;
+        # Parquet files of segments already read (another writer compacted
+        # them since) are skipped
+        with self._write_lock:
+            events, sources = self._segment_events(session_id, start, end)
+            with self._lock:
+                events += [dict(event) for event in list(self._open.values()) + self._closed
+                           if _overlaps(event, session_id, start, end)]
+            files = self._parquet_files(start, end, skip_sources=sources)
+        if files:
+            import polars as pl
+            stored = (pl.scan_parquet(files)
+                      .filter((pl.col("session_id") == session_id)
+                              & (pl.col("first_seen") <= end) & (pl.col("last_seen") >= start))
+                      .collect())
+            events += stored.to_dicts()
+
+        present = {}
+        for event in events:
+            row = present.get(event["reid_num"])
+            if row is None:
+                present[event["reid_num"]] = {**event, "intervals": 1,
+                                              "confidence": event["confidence"] * event["frames"]}
+                continue
+            row["first_seen"] = min(row["first_seen"], event["first_seen"])
+            row["last_seen"] = max(row["last_seen"], event["last_seen"])
+            row["confidence"] += event["confidence"] * event["frames"]
+            row["frames"] += event["frames"]
+            row["intervals"] += 1
+        for row in present.values():
+            row["confidence"] = round(row["confidence"] / max(row["frames"], 1), 4)
+        return sorted(present.values(), key=lambda row: row["first_seen"])
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Presence log flush failed: {e}")
+
+    def close(self):
+        """Stop the flush thread, write out every open interval and compact all segments.
+
+        The writer directory is removed once empty; if compaction failed, its
+        lock is released so another writer adopts the segments.
+        """
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        try:
+            self.flush(close_all=True)
+        finally:
+            with self._write_lock:
+                leftover = glob.glob(os.path.join(self.writer_dir, "segment_*.jsonl"))
+                if os.path.isdir(self.writer_dir) and not leftover:
+                    if self._writer_lock is not None:
+                        os.remove(os.path.join(self.writer_dir, WRITER_LOCK))
+                    os.rmdir(self.writer_dir)
+                if self._writer_lock is not None:
+                    self._writer_lock.close()
+                    self._writer_lock = None
+
+    def summary(self):
+        with self._lock:
+            open_intervals = len(self._open)
+        return {
+            "open_intervals": open_intervals,
+            "events_written": self.events_written,
+            "segments_compacted": self.segments_compacted,
+            "parquet_files": len(glob.glob(os.path.join(self.parquet_dir, "events_*.parquet"))),
+        }
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Queued by a finished batch so the collector re-checks items held for its lanes
+_LANE_FREED = object()
+
+
+class FrameBatcher:
+    """Dynamic micro-batcher for frame inference requests.
+
+    Items submitted from any coroutine are gathered until max_batch_size are
+    waiting or max_wait_ms has passed since the first one arrived, then handed
+    to batch_fn as a single list in a worker thread. batch_fn must return one
+    result per item, in order. Up to max_concurrent_batches run at once so a
+    slow batch does not stall collection of the next one.
+
+    lane_key(item), if given, names the lane an item belongs to (None for
+    none). A batch holds at most one item per lane and a lane is never in two
+    running batches, so items of one lane are processed one at a time in
+    submission order; items whose lane is busy wait for the next batch.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10.0,
+                 max_concurrent_batches=2, executor=None, lane_key=None):
+        self.batch_fn = batch_fn
+        self.lane_key = lane_key
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.executor = executor
+        self._queue = None
+        self._slots = None
+        self._worker = None
+        self._busy_lanes = set()
+        self._held = []
+        self.batches_run = 0
+        self.items_run = 0
+
+    async def submit(self, item):
+        """Queue one item and wait for its result from the batch it lands in."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def queue_depth(self):
+        return (self._queue.qsize() if self._queue is not None else 0) + len(self._held)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches_run": self.batches_run,
+            "items_run": self.items_run,
+            "avg_batch_size": self.items_run / self.batches_run if self.batches_run else 0.0,
+            "queue_depth": self.queue_depth(),
+        }
+
+    def _ensure_started(self):
+        if self._worker is not None and not self._worker.done():
+            return
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._worker = loop.create_task(self._collect())
+
+    def _take(self, entry, batch, lanes):
+        """Add entry to batch unless its lane is busy or already in the batch; else hold it."""
+        if entry is _LANE_FREED:
+            return
+        lane = self.lane_key(entry[0]) if self.lane_key is not None else None
+        if lane is not None and (lane in self._busy_lanes or lane in lanes
+                                 or any(self.lane_key(item) == lane for item, _ in self._held)):
+            self._held.append(entry)
+            return
+        if lane is not None:
+            lanes.add(lane)
+        batch.append(entry)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch, lanes = [], set()
+            # Items held back earlier go first, keeping each lane in order
+            held, self._held = self._held, []
+            for entry in held:
+                if len(batch) < self.max_batch_size:
+                    self._take(entry, batch, lanes)
+                else:
+                    self._held.append(entry)
+            if not batch:
+                self._take(await self._queue.get(), batch, lanes)
+                if not batch:
+                    continue
+            deadline = loop.time() + self.max_wait_ms / 1000.0
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._take(await asyncio.wait_for(self._queue.get(), timeout), batch, lanes)
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            self._busy_lanes |= lanes
+            loop.create_task(self._run(batch, lanes))
+
+    async def _run(self, batch, lanes=()):
+        try:
+            items = [item for item, _ in batch]
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.batch_fn, items
+                )
+            except Exception as e:
+                logger.error(f"Batch of {len(items)} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            self.batches_run += 1
+            self.items_run += len(items)
+            for (_, future), result in zip(batch, results):
+                # The requester may have gone away (e.g. WebSocket closed)
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+            if lanes:
+                self._busy_lanes -= lanes
+                if self._held:
+                    self._queue.put_nowait(_LANE_FREED)
+
+
+class LatestOnlySlot:
+    """Single-slot mailbox where a newer item replaces one not yet taken.
+
+    Used to keep only the newest pending frame per connection: when the
+    consumer is slower than the producer, stale items are counted in dropped
+    instead of queueing up. get() also reports how long the item waited.
+    """
+
+    def __init__(self):
+        self._item = None
+        self._received_at = 0.0
+        self._closed = None
+        self._event = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item):
+        if self._item is not None:
+            self.dropped += 1
+        self._item = item
+        self._received_at = time.monotonic()
+        self._event.set()
+
+    def close(self, exc):
+        """Wake the consumer with exc; any pending item is abandoned."""
+        self._closed = exc
+        self._event.set()
+
+    async def get(self):
+        """Return (item, seconds_waited) for the newest item."""
+        while True:
+            if self._closed is not None:
+                raise self._closed
+            if self._item is not None:
+                break
+            self._event.clear()
+            await self._event.wait()
+        item, self._item = self._item, None
+        return item, time.monotonic() - self._received_at
@@ -0,0 +1,318 @@
+"""Offline throughput benchmark for FaceRecognitionAPI.
+
+Replays frames through process_frame_with_info and records per-stage latency
+(decode, detect, track, embed, match, enroll, render, JPEG encode), frames/s,
+faces/s and peak RSS into a JSON file that can be diffed between commits:
+
+    python bench_pipeline.py run --frames ./recordings/room-101 --out bench.json
+    python bench_pipeline.py run --video lecture.mp4 --every 60 --out bench.json
+    python bench_pipeline.py run --synthetic 200 --out bench.json
+    python bench_pipeline.py compare old.json bench.json
+
+Everything runs against a throwaway database, gallery snapshot and
+saved_faces directory, so production data is never touched. Without
+recordings, synthetic classroom frames are generated from the face crops in
+saved_faces (or drawn faces when there are none).
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import cv2
+import numpy as np
+
+from ingest import IngestedFrame
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+STAGE_ORDER = ("decode", "motion_gate", "detect", "track", "embed", "match", "enroll", "render",
+               "jpeg_encode", "total")
+
+
+def frames_from_directory(directory, limit=None):
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(directory, pattern)))
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            yield f.read()
+
+
+def frames_from_video(path, every=1, limit=None):
+    """JPEG-encoded frames of a video file, keeping one in every `every`."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video {path}")
+    index = produced = 0
+    try:
+        while limit is None or produced < limit:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if index % every == 0:
+                produced += 1
+                yield cv2.imencode(".jpg", frame)[1].tobytes()
+            index += 1
+    finally:
+        capture.release()
+
+
+def _drawn_face(size, rng):
+    """A simple frontal face (skin ellipse, eyes, nose, mouth) for when no crops exist."""
+    face = np.full((size, size, 3), 200, dtype=np.uint8)
+    skin = tuple(int(c) for c in rng.integers((60, 110, 150), (120, 170, 230)))
+    c = size // 2
+    cv2.ellipse(face, (c, c), (int(size * 0.38), int(size * 0.48)), 0, 0, 360, skin, -1)
+    for dx in (-1, 1):
+        cv2.circle(face, (c + dx * size // 6, int(size * 0.4)), max(2, size // 18), (40, 30, 30), -1)
+    cv2.line(face, (c, int(size * 0.45)), (c, int(size * 0.6)), (80, 90, 140), max(1, size // 40))
+    cv2.ellipse(face, (c, int(size * 0.72)), (size // 7, size // 16), 0, 0, 180, (60, 60, 150), -1)
+    return face
+
+
+def synthetic_frames(count, faces_dir="saved_faces", size=(1280, 720), faces=24, seed=0):
+    """JPEG frames of a seated 'classroom': a grid of faces that jitter slightly per frame.
+
+    Uses the real crops in faces_dir when available, so the detector and
+    recognizer see actual faces; every fifth frame a face is swapped out to
+    exercise enrollment.
+    """
+    rng = np.random.default_rng(seed)
+    crops = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(faces_dir, "reid_*.jpg")))]
+    crops = [crop for crop in crops if crop is not None and crop.size]
+    width, height = size
+    cols = int(np.ceil(np.sqrt(faces * width / height)))
+    rows = int(np.ceil(faces / cols))
+    cell_w, cell_h = width // cols, height // rows
+    face_size = int(min(cell_w, cell_h) * 0.6)
+
+    def pick():
+        if crops:
+            return cv2.resize(crops[int(rng.integers(len(crops)))], (face_size, face_size))
+        return _drawn_face(face_size, rng)
+
+    seats = [pick() for _ in range(faces)]
+    background = np.full((height, width, 3), (90, 110, 125), dtype=np.float32)
+    background = np.clip(background + rng.normal(0, 6, background.shape), 0, 255).astype(np.uint8)
+    for frame_index in range(count):
+        if frame_index and frame_index % 5 == 0:
+            seats[int(rng.integers(faces))] = pick()
+        frame = background.copy()
+        for seat, face in enumerate(seats):
+            row, col = divmod(seat, cols)
+            jx, jy = rng.integers(-3, 4, size=2)
+            x = col * cell_w + (cell_w - face_size) // 2 + int(jx)
+            y = row * cell_h + (cell_h - face_size) // 2 + int(jy)
+            x, y = min(max(0, x), width - face_size), min(max(0, y), height - face_size)
+            frame[y:y + face_size, x:x + face_size] = face
+        yield cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+class StageRecorder:
+    """stage_observer that keeps every timing of the measured frames."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.enabled = False
+
+    def __call__(self, stage, seconds):
+        if self.enabled:
+            self.samples[stage].append(seconds)
+
+    def summary(self):
+        stages = {}
+        for stage in sorted(self.samples, key=lambda s: (STAGE_ORDER.index(s) if s in STAGE_ORDER else 99, s)):
+            ms = np.asarray(self.samples[stage]) * 1000
+            stages[stage] = {
+                "count": len(ms),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "max_ms": round(float(ms.max()), 3),
+                "total_s": round(float(ms.sum()) / 1000, 3),
+            }
+        return stages
+
+
+def current_rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (0 if unknown)."""
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    except ImportError:
+        return current_rss()
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(frames, api_options, warmup=5, render=True, use_tracking=True):
+    """Replay JPEG frames through a fresh FaceRecognitionAPI in a scratch directory."""
+    with tempfile.TemporaryDirectory(prefix="facerec-bench-", ignore_cleanup_errors=True) as workdir:
+        from api import FaceRecognitionAPI
+
+        started = time.perf_counter()
+        face_api = FaceRecognitionAPI(face_img_path=os.path.join(workdir, "saved_faces"),
+                                      db_path=os.path.join(workdir, "face_data_db"),
+                                      index_path=os.path.join(workdir, "face_index"),
+                                      snapshot_path=os.path.join(workdir, "gallery_snapshot"),
+                                      attendance_dir=os.path.join(workdir, "attendance_log"), **api_options)
+        try:
+            return _replay(face_api, frames, warmup, render, use_tracking,
+                           startup_seconds=time.perf_counter() - started)
+        finally:
+            face_api.attendance.close()
+
+
+def _replay(face_api, frames, warmup, render, use_tracking, startup_seconds):
+    recorder = StageRecorder()
+    face_api.stage_observer = recorder
+
+    measured = faces = reused = 0
+    wall = 0.0
+    for index, data in enumerate(frames):
+        recorder.enabled = index >= warmup
+        frame_started = time.perf_counter()
+        frame = IngestedFrame.from_bytes(data, face_api.detector_input_size, need_full=render)
+        recorder("decode", time.perf_counter() - frame_started)
+        display_frame, info = face_api.process_frame_with_info(frame, use_tracking=use_tracking,
+                                                               session_id="bench", render=render)
+        if display_frame is not None:
+            encode_started = time.perf_counter()
+            cv2.imencode(".jpg", display_frame)
+            recorder("jpeg_encode", time.perf_counter() - encode_started)
+        elapsed = time.perf_counter() - frame_started
+        recorder("total", elapsed)
+        if recorder.enabled:
+            measured += 1
+            wall += elapsed
+            faces += info["head_count"]
+            reused += bool(info.get("reused_previous_result"))
+
+    return {
+        "frames": measured,
+        "warmup_frames": warmup,
+        "faces": faces,
+        "reused_frames": reused,
+        "wall_seconds": round(wall, 3),
+        "fps": round(measured / wall, 2) if wall else None,
+        "faces_per_sec": round(faces / wall, 2) if wall else None,
+        "startup_seconds": round(startup_seconds, 2),
+        "peak_rss_mb": round(peak_rss() / 2 ** 20, 1),
+        "stages": recorder.summary(),
+        "gallery_identities": len(face_api.gallery),
+    }
+
+
+def compare(old, new):
+    """Per-stage p50/p95 and throughput change from old to new (JSON reports)."""
+    lines = []
+    for key in ("fps", "faces_per_sec", "peak_rss_mb"):
+        a, b = old.get(key), new.get(key)
+        if a and b:
+            lines.append(f"{key:>16}: {a:>10} -> {b:>10} ({(b - a) / a * 100:+.1f}%)")
+    for stage in new.get("stages", {}):
+        if stage not in old.get("stages", {}):
+            continue
+        for stat in ("p50_ms", "p95_ms"):
+            a, b = old["stages"][stage][stat], new["stages"][stage][stat]
+            change = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+            lines.append(f"{stage + ' ' + stat:>16}: {a:>10} -> {b:>10} ({change})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline FaceRecognitionAPI benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_cmd = sub.add_parser("run", help="Replay frames and write a JSON report")
+    source = run_cmd.add_mutually_exclusive_group()
+    source.add_argument("--frames", help="Directory of .jpg/.png frames")
+    source.add_argument("--video", help="Video file")
+    source.add_argument("--synthetic", type=int, metavar="N", help="Generate N synthetic frames (default 100)")
+    run_cmd.add_argument("--every", type=int, default=1, help="Keep one video frame in every N")
+    run_cmd.add_argument("--limit", type=int)
+    run_cmd.add_argument("--warmup", type=int, default=5)
+    run_cmd.add_argument("--faces-dir", default="saved_faces", help="Face crops for synthetic frames")
+    run_cmd.add_argument("--faces-per-frame", type=int, default=24)
+    run_cmd.add_argument("--no-render", action="store_true")
+    run_cmd.add_argument("--no-tracking", action="store_true")
+    run_cmd.add_argument("--pipeline-mode", default="hybrid")
+    run_cmd.add_argument("--yolo-backend", default="torch")
+    run_cmd.add_argument("--yolo-onnx", default="yolo-face.onnx")
+    run_cmd.add_argument("--rec-int8")
+    run_cmd.add_argument("--cpu", action="store_true", help="Disable GPU providers")
+    run_cmd.add_argument("--no-motion-gating", action="store_true")
+    run_cmd.add_argument("--full-sweep-interval", type=int, default=10)
+    run_cmd.add_argument("--out", default="bench.json")
+
+    compare_cmd = sub.add_parser("compare", help="Diff two JSON reports")
+    compare_cmd.add_argument("old")
+    compare_cmd.add_argument("new")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        with open(args.old) as f_old, open(args.new) as f_new:
+            print(compare(json.load(f_old), json.load(f_new)))
+        return
+
+    if args.frames:
+        frames, source_name = frames_from_directory(args.frames, args.limit), args.frames
+    elif args.video:
+        frames, source_name = frames_from_video(args.video, args.every, args.limit), args.video
+    else:
+        count = args.synthetic or args.limit or 100
+        frames = synthetic_frames(count, faces_dir=args.faces_dir, faces=args.faces_per_frame)
+        source_name = f"synthetic:{count}x{args.faces_per_frame}"
+
+    api_options = {
+        "pipeline_mode": args.pipeline_mode,
+        "use_gpu": not args.cpu,
+        "yolo_backend": args.yolo_backend,
+        "yolo_onnx_path": args.yolo_onnx,
+        "recognition_int8_path": args.rec_int8,
+        "motion_gating": not args.no_motion_gating,
+        "full_sweep_interval": args.full_sweep_interval,
+    }
+    report = {
+        "run": {
+            "timestamp": time.time(),
+            "git_revision": git_revision(),
+            "source": source_name,
+            "render": not args.no_render,
+            "tracking": not args.no_tracking,
+            "api_options": api_options,
+            "host": {"platform": platform.platform(), "python": platform.python_version(),
+                     "cpu_count": os.cpu_count()},
+        },
+        **run(frames, api_options, warmup=args.warmup, render=not args.no_render,
+              use_tracking=not args.no_tracking),
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{report['frames']} frames, {report['fps']} fps, {report['faces_per_sec']} faces/s, "
+          f"peak RSS {report['peak_rss_mb']} MB -> {args.out}")
+    for stage, stats in report["stages"].items():
+        print(f"  {stage:>12}: p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  (n={stats['count']})")
+
+
+if __name__ == "__main__":
+    main()
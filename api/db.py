@@ -1,15 +1,37 @@
 import os
 import threading
 import chromadb
+import numpy as np
+
+from ann_index import INDEX_KINDS, QuantizedIndex, build_from_collection
+from gallery import template_key
+from snapshot import GallerySnapshot
 
 
 class DatabaseManager:
-    def __init__(self, db_path: str = "./face_data_db") -> None:
+    def __init__(self, db_path: str = "./face_data_db", index_backend="chroma",
+                 index_path="./face_index", snapshot_path=None) -> None:
+        """index_backend "chroma" matches with the gallery's float32 centroid
+        scan; "int8", "float16" or "pca" open (or, on first use, build from
+        face_db) a compact QuantizedIndex at index_path for the gallery to
+        shortlist candidates from.
+
+        With snapshot_path, names and template keys are read from the
+        memory-mapped GallerySnapshot there when it is in step with face_db,
+        and every name write is appended to it."""
+        if index_backend != "chroma" and index_backend not in INDEX_KINDS:
+            raise ValueError(f"Unknown index backend '{index_backend}'")
         self.db_path = db_path
+        self.index_backend = index_backend
+        self.index_path = index_path
+        self.index = None
+        self.snapshot = GallerySnapshot(snapshot_path) if snapshot_path else None
+        self.snapshot_ready = False
         self.client = None
         self.face_db = None
         self._reid_counter = 0 # Initialize counter
-        self.reid_name_map = {}
+        self.reid_name_map = {}      # reid_N -> name, one entry per identity
+        self.reid_templates = {}     # reid number -> extra template ids (reid_N_tK)
         self._lock = threading.Lock()
 
     def _connect(self) -> None:
@@ -20,7 +42,10 @@ class DatabaseManager:
             os.makedirs(self.db_path, exist_ok=True)
             self.client = chromadb.PersistentClient(path=self.db_path)
             self.face_db = self.client.get_or_create_collection("face_db")
-            self._load_existing()
+            if not self._load_from_snapshot():
+                self._load_existing()
+            if self.index_backend != "chroma":
+                self._open_index()
             print(f"ChromaDB ready")
         except Exception as e:
             print(f"DB failed ({e}) - using memory")
@@ -34,6 +59,11 @@ class DatabaseManager:
                 metadatas = result["metadatas"]
 
                 for i, key in enumerate(ids):
+                    parts = key.split("_")
+                    if len(parts) == 3:
+                        # Extra template of an identity; the name lives on reid_N
+                        self.reid_templates.setdefault(int(parts[1]), []).append(key)
+                        continue
                     name = "Unknown"
                     if metadatas and i < len(metadatas):
                         name = metadatas[i].get("name", f"unknown_{i}") or "Unknown"
@@ -46,6 +76,79 @@ class DatabaseManager:
         except Exception as e:
             print(f"Loading existing failed: {e}")
 
+    def _load_from_snapshot(self):
+        """Fast path: names and template keys from the gallery snapshot, if it matches face_db."""
+        try:
+            if self.snapshot is None or not self.face_db or not self.snapshot.open():
+                return False
+            if self.snapshot.template_total() != self.face_db.count():
+                print("Gallery snapshot is out of step with face_db - loading from ChromaDB")
+                return False
+
+            rows = np.asarray(self.snapshot.rows[:self.snapshot.count])
+            for reid_num, _, count in rows.tolist():
+                self.reid_name_map[f"reid_{reid_num}"] = self.snapshot.names.get(reid_num) or "Unknown"
+                if count > 1:
+                    self.reid_templates[reid_num] = [template_key(reid_num, slot) for slot in range(1, count)]
+            self._reid_counter = max([int(r) for r in rows[:, 0]] + list(self.snapshot.names), default=0)
+            self.snapshot_ready = True
+            print(f"Loaded {len(self.reid_name_map)} faces from gallery snapshot. "
+                  f"Next ReID will start from {self._reid_counter + 1}")
+            return True
+        except Exception as e:
+            print(f"Gallery snapshot unusable ({e}) - loading from ChromaDB")
+            return False
+
+    def write_snapshot_names(self):
+        """Rewrite the snapshot name table from reid_name_map (after a full reload)."""
+        if self.snapshot is not None:
+            with self._lock:
+                self.snapshot.rewrite_names({int(k.split("_")[1]): name
+                                             for k, name in self.reid_name_map.items()})
+                self.snapshot_ready = True
+
+    def sync_snapshot(self):
+        """Pick up names and ReIDs written by other worker processes."""
+        if self.snapshot is None or not self.snapshot_ready:
+            return
+        with self._lock:
+            self._apply_snapshot_names(self.snapshot.sync_names())
+
+    def _apply_snapshot_names(self, updates):
+        # None marks a ReID reserved by a worker that has not enrolled it yet
+        for reid_num, name in updates.items():
+            self._reid_counter = max(self._reid_counter, reid_num)
+            if name is not None:
+                self.reid_name_map[f"reid_{reid_num}"] = name
+
+    def _snapshot_name(self, reid_num, name):
+        if self.snapshot_ready:
+            self.snapshot.append_names({reid_num: name})
+
+    def _open_index(self):
+        """Open (or build) the quantized index; the gallery adds rows missing from it."""
+        try:
+            try:
+                self.index = QuantizedIndex.open(self.index_path)
+            except FileNotFoundError:
+                if self.face_db.count() == 0:
+                    print("Gallery index: face_db is empty, using the centroid scan until the first rebuild")
+                    return
+                print(f"Building {self.index_backend} gallery index at {self.index_path}")
+                self.index = build_from_collection(self.face_db, self.index_path, kind=self.index_backend)
+            if self.index.kind != self.index_backend:
+                print(f"Gallery index at {self.index_path} is {self.index.kind}, "
+                      f"not {self.index_backend}; run `python ann_index.py build --kind {self.index_backend}`")
+            print(f"Gallery index ready: {self.index.stats()}")
+        except Exception as e:
+            print(f"Gallery index unavailable ({e}) - using the centroid scan")
+            self.index = None
+
+    def index_stats(self):
+        if self.index is None:
+            return {"backend": "chroma"}
+        return {"backend": self.index_backend, **self.index.stats()}
+
     def query(self, embedding, threshold: float = 0.25):
         try:
             with self._lock:
@@ -87,14 +190,38 @@ class DatabaseManager:
                     return False
 
                 self.face_db.add(
-                    ids=[key], embeddings=[embedding], metadatas=[{"name": name}]
+                    ids=[key], embeddings=[embedding],
+                    metadatas=[{"name": name, "reid": reid_num, "template": 0}]
                 )
                 self.reid_name_map[key] = name
+                self._snapshot_name(reid_num, name)
                 return True
         except Exception as e:
             print(f"DB add error: {e}")
             return False
 
+    def put_template(self, embedding, reid_num, slot):
+        """Write (or overwrite, after eviction) template slot of an enrolled identity."""
+        key = template_key(reid_num, slot)
+        try:
+            with self._lock:
+                if not self.face_db or f"reid_{reid_num}" not in self.reid_name_map:
+                    return False
+
+                name = self.reid_name_map[f"reid_{reid_num}"]
+                self.face_db.upsert(
+                    ids=[key], embeddings=[embedding],
+                    metadatas=[{"name": name, "reid": reid_num, "template": slot}]
+                )
+                if slot:
+                    keys = self.reid_templates.setdefault(reid_num, [])
+                    if key not in keys:
+                        keys.append(key)
+                return True
+        except Exception as e:
+            print(f"DB template write error: {e}")
+            return False
+
     def update_name(self, reid_num: int, new_name: str) -> bool:
         """Update all entries matching a ReID number."""
         try:
@@ -103,14 +230,17 @@ class DatabaseManager:
                     print("ERROR: face_db not initialized")
                     return False
 
-                keys_to_update = [k for k in self.reid_name_map if k.startswith(f"reid_{reid_num}")]
-                if not keys_to_update:
+                key = f"reid_{reid_num}"
+                if key not in self.reid_name_map:
                     print(f"No keys found for ReID {reid_num}")
                     return False
 
-                for key in keys_to_update:
-                    self.face_db.update(ids=[key], metadatas=[{"name": new_name}])
-                    self.reid_name_map[key] = new_name
+                # The enrollment record plus every extra template of the identity
+                keys_to_update = [key] + self.reid_templates.get(reid_num, [])
+                self.face_db.update(ids=keys_to_update,
+                                    metadatas=[{"name": new_name} for _ in keys_to_update])
+                self.reid_name_map[key] = new_name
+                self._snapshot_name(reid_num, new_name)
 
                 print(f"Updated ReID {reid_num} name to: {new_name}")
                 return True
@@ -121,5 +251,12 @@ class DatabaseManager:
     def next_reid_num(self) -> int:
         """Get next available ReID number efficiently."""
         with self._lock:
-            self._reid_counter += 1
-            return self._reid_counter
\ No newline at end of file
+            if not self.snapshot_ready:
+                self._reid_counter += 1
+                return self._reid_counter
+            # Reserve the number in the shared name log so other workers skip it
+            with self.snapshot.locked():
+                self._apply_snapshot_names(self.snapshot.sync_names())
+                self._reid_counter += 1
+                self.snapshot.append_names({self._reid_counter: None})
+                return self._reid_counter
\ No newline at end of file
@@ -0,0 +1,368 @@
+import contextlib
+import threading
+import numpy as np
+
+
+def template_key(reid_num, slot):
+    """Chroma id of an identity template; slot 0 is the enrollment record reid_N."""
+    return f"reid_{reid_num}" if slot == 0 else f"reid_{reid_num}_t{slot}"
+
+
+class MemoryStorage:
+    """Process-private arrays backing a GalleryMatcher (the default storage).
+
+    A storage holds, per identity row, up to max_templates templates, a
+    centroid and an int64 (reid, label, template count) record, with the
+    first `count` rows committed. snapshot.GallerySnapshot implements the same
+    interface over memory-mapped files shared between worker processes.
+    """
+
+    def __init__(self, dim, max_templates, capacity=1024):
+        self.dim = dim
+        self.max_templates = max_templates
+        self.count = 0
+        self._allocate(max(1, capacity))
+
+    def _allocate(self, capacity):
+        self.templates = np.zeros((capacity, self.max_templates, self.dim), dtype=np.float32)
+        self.centroids = np.zeros((capacity, self.dim), dtype=np.float32)
+        self.rows = np.zeros((capacity, 3), dtype=np.int64)
+
+    @property
+    def capacity(self):
+        return len(self.rows)
+
+    def locked(self):
+        return contextlib.nullcontext()
+
+    def refresh(self):
+        """Pick up rows committed by other writers; True if rows were re-laid out."""
+        return False
+
+    def grow(self, capacity):
+        templates, centroids, rows = self.templates, self.centroids, self.rows
+        self._allocate(capacity)
+        self.templates[:self.count] = templates[:self.count]
+        self.centroids[:self.count] = centroids[:self.count]
+        self.rows[:self.count] = rows[:self.count]
+
+    def reset(self, capacity):
+        self._allocate(max(1, capacity))
+        self.count = 0
+
+    def commit(self, count, relayout=False):
+        self.count = count
+
+
+class GalleryMatcher:
+    """In-memory cosine matcher over enrolled identities with bounded templates.
+
+    Every enrolled ReID holds up to max_templates L2-normalized float32
+    embeddings in one contiguous (identities, max_templates, dim) array, plus
+    a normalized centroid per identity. A query is scored against all
+    centroids with a single matrix multiply, and the best `shortlist`
+    identities are re-ranked by their closest template. Search cost therefore
+    grows with the number of identities, not with sightings. When an identity
+    is full, the most redundant template is evicted so the set stays diverse
+    across lighting and pose.
+
+    Each identity carries a ReID label; merging relabels identities instead of
+    dropping them so that faces matching the merged-away templates resolve to
+    the surviving identity. The arrays live in `storage` (MemoryStorage by
+    default); with a GallerySnapshot they are memory-mapped and shared by all
+    worker processes. ChromaDB remains the persistence layer, this is only
+    the search structure.
+
+    With an ann_index.QuantizedIndex over the templates, the shortlist comes
+    from the index's compact codes instead of a float32 centroid scan; every
+    template written here is mirrored into it. Templates another worker
+    rewrites in shared storage reach this index only at its next rebuild.
+    """
+
+    def __init__(self, dim=512, max_templates=5,
+                 initial_capacity=1024, shortlist=16, storage=None, index=None):
+        self.dim = dim
+        self.max_templates = max(1, max_templates)
+        self.shortlist = max(1, shortlist)
+        if storage is None:
+            storage = MemoryStorage(dim, self.max_templates, initial_capacity)
+        elif (storage.dim, storage.max_templates) != (dim, self.max_templates):
+            raise ValueError(f"Gallery storage is {storage.dim}-d x {storage.max_templates} templates, "
+                             f"expected {dim}-d x {self.max_templates}")
+        if index is not None and index.dim != dim:
+            raise ValueError(f"Gallery index is {index.dim}-d, expected {dim}-d")
+        self._storage = storage
+        self._index = index
+        self._keys = []            # row -> ReID the identity was enrolled under
+        self._rows = {}            # enrolled ReID -> row
+        self._lock = threading.Lock()
+        self._reindex()
+
+    # Row-wise views into the storage arrays
+    @property
+    def _templates(self):
+        return self._storage.templates
+
+    @property
+    def _centroids(self):
+        return self._storage.centroids
+
+    @property
+    def _labels(self):
+        return self._storage.rows[:, 1]
+
+    @property
+    def _counts(self):
+        return self._storage.rows[:, 2]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def template_count(self):
+        with self._lock:
+            self._sync()
+            return int(self._counts[:len(self._keys)].sum())
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _reindex(self):
+        self._keys = [int(reid) for reid in self._storage.rows[:self._storage.count, 0]]
+        self._rows = {reid: row for row, reid in enumerate(self._keys)}
+        self._index_missing(range(len(self._keys)))
+
+    def _index_template(self, row, slot):
+        if self._index is not None:
+            reid = self._keys[row]
+            self._index.add(template_key(reid, slot), reid, self._templates[row, slot])
+
+    def _index_missing(self, rows):
+        """Mirror templates of rows the index has not seen (built before they existed)."""
+        if self._index is None:
+            return
+        for row in rows:
+            for slot in range(int(self._counts[row])):
+                if template_key(self._keys[row], slot) not in self._index:
+                    self._index_template(row, slot)
+
+    def _sync(self):
+        """Catch up with rows other processes committed to shared storage."""
+        relayout = self._storage.refresh()
+        count = self._storage.count
+        if relayout or count < len(self._keys):
+            self._reindex()
+        elif count > len(self._keys):
+            first = len(self._keys)
+            for row in range(first, count):
+                reid = int(self._storage.rows[row, 0])
+                self._keys.append(reid)
+                self._rows[reid] = row
+            self._index_missing(range(first, count))
+
+    @contextlib.contextmanager
+    def _writing(self):
+        with self._lock, self._storage.locked():
+            self._sync()
+            yield
+            self._storage.commit(len(self._keys))
+
+    def _row_for(self, reid_num, label):
+        row = self._rows.get(reid_num)
+        if row is None:
+            row = len(self._keys)
+            if row >= self._storage.capacity:
+                self._storage.grow(self._storage.capacity * 2)
+            self._storage.rows[row] = (reid_num, label, 0)
+            self._keys.append(reid_num)
+            self._rows[reid_num] = row
+        self._labels[row] = label
+        return row
+
+    def _refresh_centroid(self, row):
+        count = self._counts[row]
+        self._centroids[row] = self._normalize(self._templates[row, :count].mean(axis=0))
+
+    def add(self, reid_num, embedding, label=None):
+        """Enroll reid_num with embedding as its only template (overwrites)."""
+        vector = self._normalize(embedding).reshape(self.dim)
+        label = reid_num if label is None else label
+        with self._writing():
+            row = self._row_for(reid_num, label)
+            self._templates[row, 0] = vector
+            self._counts[row] = 1
+            self._refresh_centroid(row)
+            self._index_template(row, 0)
+
+    def add_template(self, reid_num, embedding, novelty=1.0):
+        """Offer another sighting of an enrolled identity as a template.
+
+        The embedding is skipped if it is at least `novelty` similar to an
+        existing template. Once the identity holds max_templates, the most
+        redundant of the old templates plus the new one (highest similarity
+        to its nearest neighbour) is evicted. Returns the slot the embedding
+        was written to, or None if it was not kept.
+        """
+        vector = self._normalize(embedding).reshape(self.dim)
+        with self._writing():
+            row = self._rows.get(reid_num)
+            if row is None:
+                return None
+            count = int(self._counts[row])
+            existing = self._templates[row, :count]
+            if count and float((existing @ vector).max()) >= novelty:
+                return None
+            if count < self.max_templates:
+                slot = count
+                self._counts[row] = count + 1
+            else:
+                candidates = np.vstack([existing, vector[None, :]])
+                sims = candidates @ candidates.T
+                np.fill_diagonal(sims, -np.inf)
+                slot = int(sims.max(axis=1).argmax())
+                if slot == count:
+                    return None
+            self._templates[row, slot] = vector
+            self._refresh_centroid(row)
+            self._index_template(row, slot)
+            return slot
+
+    def templates(self, reid_num):
+        """Copy of the templates held for reid_num, shape (count, dim)."""
+        with self._lock:
+            self._sync()
+            row = self._rows.get(reid_num)
+            if row is None:
+                return np.empty((0, self.dim), dtype=np.float32)
+            return np.array(self._templates[row, :self._counts[row]])
+
+    def centroids(self, active_only=False):
+        """(reids, centroids) for enrolled identities; active_only skips merged-away ones."""
+        with self._lock:
+            self._sync()
+            n = len(self._keys)
+            keys = np.asarray(self._keys, dtype=np.int64)
+            mask = self._labels[:n] == keys if active_only else np.ones(n, dtype=bool)
+            return [int(k) for k in keys[mask]], np.array(self._centroids[:n][mask])
+
+    def relabel(self, source_reid, target_reid):
+        """Point every identity labelled source_reid at target_reid (used by merge)."""
+        with self._writing():
+            n = len(self._keys)
+            mask = self._labels[:n] == source_reid
+            self._labels[:n][mask] = target_reid
+            return int(mask.sum())
+
+    def load(self, items):
+        """Bulk-replace the gallery from (reid_num, embeddings, label) tuples.
+
+        embeddings is one vector or a sequence of templates; anything beyond
+        max_templates is dropped.
+        """
+        items = list(items)
+        with self._lock, self._storage.locked():
+            self._storage.reset(max(self._storage.capacity, len(items)))
+            self._keys, self._rows = [], {}
+            for reid_num, embeddings, label in items:
+                vectors = self._normalize(embeddings).reshape(-1, self.dim)[:self.max_templates]
+                row = self._row_for(reid_num, reid_num if label is None else label)
+                self._templates[row, :len(vectors)] = vectors
+                self._counts[row] = len(vectors)
+                self._refresh_centroid(row)
+            self._index_missing(range(len(self._keys)))
+            self._storage.commit(len(self._keys), relayout=True)
+
+    def match(self, embeddings, threshold):
+        """Match a batch of embeddings against the gallery.
+
+        Centroids (or the index, if any) shortlist candidate identities,
+        which are then re-ranked by their best template. Returns (reids,
+        similarities) arrays of length len(embeddings); reids is -1 where the
+        best template similarity does not exceed threshold.
+        """
+        queries = self._normalize(embeddings).reshape(-1, self.dim)
+        with self._lock:
+            self._sync()
+            n = len(self._keys)
+            if n == 0 or len(queries) == 0:
+                return (np.full(len(queries), -1, dtype=np.int64),
+                        np.full(len(queries), -1.0, dtype=np.float32))
+            cand = self._shortlist(queries, n)
+
+            template_sims = np.einsum("qd,qmkd->qmk", queries, self._templates[cand])
+            valid = np.arange(self.max_templates) < self._counts[cand][..., None]
+            best_per_cand = np.where(valid, template_sims, -np.inf).max(axis=2)
+
+            best = best_per_cand.argmax(axis=1)
+            rows = np.arange(len(queries))
+            best_sims = best_per_cand[rows, best].astype(np.float32)
+            reids = np.array(self._labels[cand[rows, best]])
+        reids[best_sims <= threshold] = -1
+        return reids, best_sims
+
+    def _shortlist(self, queries, n):
+        """(Q, m) candidate rows per query; callers hold _lock."""
+        m = min(self.shortlist, n)
+        if self._index is None or len(self._index) == 0:
+            centroid_sims = queries @ self._centroids[:n].T
+            return np.argpartition(-centroid_sims, m - 1, axis=1)[:, :m]
+        # Enough template hits to still find m distinct identities
+        _, hits, _ = self._index.search(queries, k=m * self.max_templates)
+        cand = np.empty((len(queries), m), dtype=np.int64)
+        for q, reids in enumerate(hits.tolist()):
+            rows = list(dict.fromkeys(self._rows[r] for r in reids if r in self._rows))[:m]
+            if not rows:
+                rows = [int((self._centroids[:n] @ queries[q]).argmax())]
+            # Pad with the best candidate; repeats do not change the argmax
+            cand[q] = rows + rows[:1] * (m - len(rows))
+        return cand
+
+
+def find_duplicate_pairs(reids, embeddings, threshold, top_k=5,
+                         block_size=1024, on_block=None):
+    """Find near-duplicate identities with blocked matrix multiplies.
+
+    The (n, n) similarity matrix is never materialized: rows are processed
+    block_size at a time against the full gallery, and only each identity's
+    top_k neighbours above threshold are kept. on_block, if given, is called
+    after every block with (rows_done, total_rows, pairs_so_far) so callers can
+    publish partial results.
+
+    Returns [(reid1, reid2, similarity), ...] sorted by similarity descending,
+    each unordered pair reported once.
+    """
+    reids = np.asarray(reids, dtype=np.int64)
+    n = len(reids)
+    if n < 2:
+        return []
+    matrix = GalleryMatcher._normalize(embeddings).reshape(n, -1)
+    k = min(top_k, n - 1)
+    pairs = {}
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        sims = matrix[start:stop] @ matrix.T
+        rows = np.arange(stop - start)
+        sims[rows, rows + start] = -np.inf
+
+        # Per-row top-k candidates, then keep those above threshold
+        cand = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        cand_sims = np.take_along_axis(sims, cand, axis=1)
+        hit_rows, hit_cols = np.nonzero(cand_sims > threshold)
+        for r, c in zip(hit_rows, hit_cols):
+            i, j = start + r, int(cand[r, c])
+            key = (min(reids[i], reids[j]), max(reids[i], reids[j]))
+            if key[0] != key[1]:
+                pairs[key] = float(cand_sims[r, c])
+
+        if on_block is not None:
+            on_block(stop, n, _sorted_pairs(pairs))
+
+    return _sorted_pairs(pairs)
+
+
+def _sorted_pairs(pairs):
+    return sorted(((int(a), int(b), s) for (a, b), s in pairs.items()),
+                  key=lambda p: p[2], reverse=True)
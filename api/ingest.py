@@ -0,0 +1,147 @@
+import cv2
+import numpy as np
+
+# libjpeg can scale by 1/2, 1/4 or 1/8 while decoding (DCT-domain downscale)
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Start-of-frame markers that carry the image dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_dimensions(data):
+    """Read (width, height) from a JPEG header without decoding, or None."""
+    data = memoryview(data).cast("B")
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:          # fill byte
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = (data[i + 2] << 8) | data[i + 3]
+        if marker in _SOF_MARKERS and i + 9 <= len(data):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + length
+    return None
+
+
+class IngestedFrame:
+    """An uploaded frame decoded at detector resolution.
+
+    When the caller will not render, the JPEG is decoded directly at a
+    reduced scale and resized at most once so its long side is detector_size;
+    the full-resolution frame is then only decoded if something (face crops)
+    asks for it. With need_full the frame is decoded once at full size and the
+    detector frame is resized from it. scale maps detector coordinates back
+    to the original image.
+    """
+
+    def __init__(self, detector_frame, scale=(1.0, 1.0), encoded=None, full=None, offset=(0.0, 0.0)):
+        self.detector_frame = detector_frame
+        self.scale = scale
+        # Original-image position of detector_frame's corner (non-zero for region())
+        self.offset = offset
+        h, w = detector_frame.shape[:2]
+        self.original_size = (round(w * scale[0]), round(h * scale[1]))
+        self._encoded = encoded
+        self._full = full
+
+    @classmethod
+    def from_bytes(cls, data, detector_size=640, need_full=False):
+        """Decode an uploaded image; need_full when the full frame will be drawn on."""
+        encoded = np.frombuffer(data, np.uint8)
+        dims = None if need_full else jpeg_dimensions(data)
+        frame = None
+        if dims is not None:
+            long_side = max(dims)
+            for factor, flag in _REDUCED_DECODE_FLAGS:
+                if long_side / factor >= detector_size:
+                    frame = cv2.imdecode(encoded, flag)
+                    break
+        full = None
+        if frame is None:
+            frame = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            full = frame
+        if frame is None:
+            raise ValueError("Invalid image data")
+        if dims is None:
+            dims = (frame.shape[1], frame.shape[0])
+        elif (frame.shape[1] > frame.shape[0]) != (dims[0] > dims[1]):
+            # EXIF orientation rotated the decoded image relative to the header
+            dims = (dims[1], dims[0])
+        original_w, original_h = dims
+        return cls._fit(frame, detector_size, (original_w, original_h), encoded=encoded, full=full)
+
+    @classmethod
+    def from_array(cls, frame, detector_size=None):
+        """Wrap an already-decoded frame; optionally resize it once for detection."""
+        if detector_size is None:
+            return cls(frame, full=frame)
+        return cls._fit(frame, detector_size, (frame.shape[1], frame.shape[0]), full=frame)
+
+    @classmethod
+    def _fit(cls, frame, detector_size, original_size, encoded=None, full=None):
+        h, w = frame.shape[:2]
+        if max(h, w) > detector_size:
+            ratio = detector_size / max(h, w)
+            frame = cv2.resize(frame, (max(1, round(w * ratio)), max(1, round(h * ratio))),
+                               interpolation=cv2.INTER_AREA)
+        scale = (original_size[0] / frame.shape[1], original_size[1] / frame.shape[0])
+        if full is None and scale == (1.0, 1.0):
+            full = frame
+        return cls(frame, scale, encoded=encoded, full=full)
+
+    def region(self, box, size):
+        """Crop an original-coordinate xyxy box out of detector_frame for ROI detection.
+
+        The crop is resized so its long side is size. Boxes and points found
+        on the returned frame map back, through to_original/points_to_original,
+        to this frame's original coordinates; its shape is this frame's too.
+        """
+        sx, sy = self.scale
+        h, w = self.detector_frame.shape[:2]
+        x1, y1 = max(0, int(box[0] / sx)), max(0, int(box[1] / sy))
+        x2, y2 = min(w, max(x1 + 1, int(np.ceil(box[2] / sx)))), min(h, max(y1 + 1, int(np.ceil(box[3] / sy))))
+        crop = self.detector_frame[y1:y2, x1:x2]
+        ratio = size / max(crop.shape[:2])
+        crop = cv2.resize(crop, (max(1, round(crop.shape[1] * ratio)), max(1, round(crop.shape[0] * ratio))),
+                          interpolation=cv2.INTER_AREA if ratio < 1 else cv2.INTER_LINEAR)
+        region = IngestedFrame(crop, scale=(sx * (x2 - x1) / crop.shape[1], sy * (y2 - y1) / crop.shape[0]),
+                               offset=(self.offset[0] + x1 * sx, self.offset[1] + y1 * sy))
+        region.original_size = self.original_size
+        return region
+
+    @property
+    def full(self):
+        """Full-resolution frame, decoded on first access."""
+        if self._full is None:
+            self._full = cv2.imdecode(self._encoded, cv2.IMREAD_COLOR)
+        return self._full
+
+    @property
+    def shape(self):
+        """(height, width, channels) of the original image, without decoding it."""
+        return (self.original_size[1], self.original_size[0], self.detector_frame.shape[2])
+
+    def to_original(self, bbox):
+        """Map an xyxy box from detector coordinates to the original image."""
+        sx, sy = self.scale
+        ox, oy = self.offset
+        x1, y1, x2, y2 = bbox
+        return x1 * sx + ox, y1 * sy + oy, x2 * sx + ox, y2 * sy + oy
+
+    def points_to_original(self, points):
+        return (np.asarray(points, dtype=np.float32) * np.asarray(self.scale, dtype=np.float32)
+                + np.asarray(self.offset, dtype=np.float32))
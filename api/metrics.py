@@ -0,0 +1,200 @@
+"""Process-wide pipeline metrics in Prometheus text format.
+
+Stage latencies go into fixed-size ring buffers (the last `window`
+observations per stage), so recording is one array store under a short lock
+and p50/p95/p99 are computed only when /metrics is scraped. Gauges are
+callbacks read at scrape time, so queue depths or gallery sizes cost nothing
+on the hot path.
+
+    from metrics import registry
+    with registry.timer("stage_seconds", component="api", stage="detect"):
+        ...
+    registry.gauge("sessions_active", lambda: len(sessions), "Active pipeline sessions")
+    registry.render()   # text exposition format 0.0.4
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RingHistogram:
+    """The last `window` observations plus all-time count and sum."""
+
+    def __init__(self, window=2048):
+        self._values = np.zeros(window, dtype=np.float64)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._values[self._count % len(self._values)] = value
+            self._count += 1
+            self._sum += value
+
+    def snapshot(self):
+        """(window values, total count, total sum)"""
+        with self._lock:
+            count, total = self._count, self._sum
+            values = self._values[:min(count, len(self._values))].copy()
+        return values, count, total
+
+    def quantiles(self, quantiles=QUANTILES):
+        values, _, _ = self.snapshot()
+        if not len(values):
+            return {q: None for q in quantiles}
+        return dict(zip(quantiles, np.quantile(values, quantiles).tolist()))
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """Named summaries, counters and callback gauges, each with optional labels."""
+
+    def __init__(self, namespace="facerec", window=2048):
+        self.namespace = namespace
+        self.window = window
+        self._histograms = {}   # name -> {label key: RingHistogram}
+        self._counters = {}     # name -> {label key: value}
+        self._gauges = {}       # name -> {label key: callable}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def _histogram(self, name, labels):
+        key = _label_key(labels)
+        series = self._histograms.get(name)
+        if series is None or key not in series:
+            with self._lock:
+                series = self._histograms.setdefault(name, {})
+                series.setdefault(key, RingHistogram(self.window))
+        return series[key]
+
+    def observe(self, name, value, **labels):
+        self._histogram(name, labels).observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        histogram = self._histogram(name, labels)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name, read, help_text=None, **labels):
+        """Register (or replace) a gauge whose value is read() at scrape time."""
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = read
+        if help_text:
+            self._help[name] = help_text
+
+    def quantiles(self, name, **labels):
+        series = self._histograms.get(name, {})
+        histogram = series.get(_label_key(labels))
+        return histogram.quantiles() if histogram is not None else {q: None for q in QUANTILES}
+
+    def stats(self, name, **labels):
+        """{count, mean, p50, p95, p99} over the window, in the observed unit."""
+        histogram = self._histograms.get(name, {}).get(_label_key(labels))
+        if histogram is None:
+            return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None}
+        values, count, _ = histogram.snapshot()
+        quantiles = histogram.quantiles()
+        return {"count": count, "mean": float(values.mean()) if len(values) else None,
+                **{f"p{int(q * 100)}": v for q, v in quantiles.items()}}
+
+    def render(self):
+        """Prometheus text exposition of every metric."""
+        lines = []
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+
+        for name, series in sorted(histograms.items()):
+            full = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full} {self._help.get(name, name)} (last {self.window} observations)")
+            lines.append(f"# TYPE {full} summary")
+            for key, histogram in sorted(series.items()):
+                values, count, total = histogram.snapshot()
+                quantiles = np.quantile(values, QUANTILES).tolist() if len(values) else [None] * len(QUANTILES)
+                for q, value in zip(QUANTILES, quantiles):
+                    lines.append(f"{full}{_format_labels(key + (('quantile', q),))} {_format_value(value)}")
+                lines.append(f"{full}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{full}_count{_format_labels(key)} {count}")
+
+        for name, series in sorted(counters.items()):
+            full = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {full} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{full}{_format_labels(key)} {_format_value(value)}")
+
+        for name, series in sorted(gauges.items()):
+            full = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {full} gauge")
+            for key, read in sorted(series.items()):
+                try:
+                    value = read()
+                except Exception:
+                    value = None
+                lines.append(f"{full}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def start_http_server(port, metrics=None, host="0.0.0.0"):
+    """Serve /metrics from a daemon thread, for processes without a web API (simple.py)."""
+    metrics = metrics or registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics_http").start()
+    return server
@@ -0,0 +1,66 @@
+import hashlib
+import time
+import cv2
+import numpy as np
+
+
+class ChangeDetector:
+    """Decides whether a camera frame differs enough from the last analysed one.
+
+    Frames are compared as small blurred grayscale thumbnails: a frame counts
+    as changed when more than min_changed_fraction of thumbnail pixels moved
+    by more than pixel_threshold grey levels, after removing any global
+    brightness shift (auto-exposure). A thumbnail byte-identical to the
+    reference (a re-sent frame) skips the comparison. The reference is the last frame that was actually
+    analysed, so slow drift still adds up to a change, and a real pass is
+    forced once max_static_seconds have passed since the last one.
+    Not thread-safe: callers hold session.lock.
+    """
+
+    def __init__(self, max_static_seconds=10.0, min_changed_fraction=0.005, pixel_threshold=20,
+                 thumb_width=160):
+        self.max_static_seconds = max_static_seconds
+        self.min_changed_fraction = min_changed_fraction
+        self.pixel_threshold = pixel_threshold
+        self.thumb_width = thumb_width
+        self._reference = None
+        self._reference_digest = None
+        self._analysed_at = 0.0
+        self.analysed = 0
+        self.skipped = 0
+
+    def _thumb(self, image):
+        h, w = image.shape[:2]
+        width = min(self.thumb_width, w)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        thumb = cv2.resize(gray, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(thumb, (3, 3), 0)
+
+    def changed_fraction(self, thumb):
+        if self._reference is None or self._reference.shape != thumb.shape:
+            return 1.0
+        diff = thumb.astype(np.int16) - self._reference.astype(np.int16)
+        diff -= np.int16(round(float(diff.mean())))
+        return float((np.abs(diff) > self.pixel_threshold).mean())
+
+    def should_analyse(self, image, force=False):
+        """True if image needs a real detection pass; it then becomes the new reference."""
+        thumb = self._thumb(image)
+        digest = hashlib.blake2b(thumb.tobytes(), digest_size=16).digest()
+        due = time.monotonic() - self._analysed_at >= self.max_static_seconds
+        static = (digest == self._reference_digest
+                  or self.changed_fraction(thumb) < self.min_changed_fraction)
+        if static and not due and not force:
+            self.skipped += 1
+            return False
+        self._reference, self._reference_digest = thumb, digest
+        self._analysed_at = time.monotonic()
+        self.analysed += 1
+        return True
+
+    def reset(self):
+        self._reference = self._reference_digest = None
+        self._analysed_at = 0.0
+
+    def summary(self):
+        return {"analysed_frames": self.analysed, "static_frames_skipped": self.skipped}
@@ -0,0 +1,287 @@
+"""On-demand profiling of the frame pipeline, without a restart.
+
+A capture runs for the next N frames and/or T seconds, in one of two modes:
+
+* "sample": a background thread snapshots the stacks of threads currently
+  inside profiled code every interval_ms; low overhead, writes collapsed
+  stacks (flamegraph.pl / speedscope format).
+* "cprofile": deterministic cProfile of profiled calls; exact call counts,
+  higher overhead, writes a .pstats file. Python allows one active profiler
+  per process (enforced from 3.12), so one thread is profiled at a time;
+  calls arriving meanwhile from other threads run unprofiled and uncounted.
+
+Code opts in with `with profiler.capture(frames=n):`. While no capture is
+running that is a single attribute check, so once a window closes the
+pipeline runs exactly as before.
+"""
+import collections
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+PROFILE_MODES = ("sample", "cprofile")
+MAX_SECONDS = 300
+MAX_FRAMES = 10000
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileCapture:
+    """One profiling window; finished by its watcher thread."""
+
+    def __init__(self, mode, frames, seconds, interval_ms, top, output_dir):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.frame_limit = frames
+        self.seconds = seconds
+        self.interval = interval_ms / 1000.0
+        self.top = top
+        self.output_dir = output_dir
+        self.state = "running"
+        self.reason = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.frames_seen = 0
+        self.samples = 0
+        self.artifact = None
+        self.functions = []
+        self.error = None
+        self._deadline = time.monotonic() + seconds if seconds else None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+        self._profile = cProfile.Profile() if mode == "cprofile" else None
+        self._profile_lock = threading.RLock()  # cprofile: held by the profiled thread
+        self._profile_depth = 0
+        self._profiled = False
+        self._threads = {}                      # sample: thread id -> nesting depth
+        self._stacks = collections.Counter()    # sample: root;...;leaf -> samples
+        self._watcher = threading.Thread(target=self._watch, daemon=True, name=f"profile-{self.id}")
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def start(self):
+        self._watcher.start()
+
+    def stop(self, reason="cancelled"):
+        with self._lock:
+            self.reason = self.reason or reason
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    @contextmanager
+    def profiling(self, frames):
+        if self.mode == "cprofile":
+            with self._profiled_call() as profiled:
+                try:
+                    yield
+                finally:
+                    if profiled:
+                        with self._lock:
+                            if self.running:
+                                self.frames_seen += frames
+            if profiled:
+                self._check_frames()
+            return
+
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] = self._threads.get(thread_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                depth = self._threads.pop(thread_id, 1) - 1
+                if depth > 0:
+                    self._threads[thread_id] = depth
+                if self.running:
+                    self.frames_seen += frames
+            self._check_frames()
+
+    @contextmanager
+    def _profiled_call(self):
+        """Enable the capture's profiler around the block if no other thread holds it.
+
+        Yields whether the block was profiled; the event loop calls in here
+        too, so a busy profiler is skipped rather than waited for.
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            if not self.running:
+                yield False
+                return
+            if self._profile_depth == 0:
+                try:
+                    self._profile.enable()
+                except ValueError:      # another tool (coverage, a debugger) owns profiling
+                    yield False
+                    return
+            self._profile_depth += 1
+            try:
+                yield True
+            finally:
+                self._profile_depth -= 1
+                if self._profile_depth == 0:
+                    self._profile.disable()
+                    self._profiled = True
+        finally:
+            self._profile_lock.release()
+
+    def _check_frames(self):
+        if self.frame_limit and self.frames_seen >= self.frame_limit:
+            self.stop("frames")
+
+    def _sample(self):
+        with self._lock:
+            thread_ids = list(self._threads)
+        if not thread_ids:
+            return
+        current = sys._current_frames()
+        for thread_id in thread_ids:
+            frame = current.get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self._stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def _watch(self):
+        tick = self.interval if self.mode == "sample" else 0.1
+        try:
+            while not self._stop.wait(tick):
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    self.stop("seconds")
+                    break
+                if self.mode == "sample":
+                    self._sample()
+            with self._lock:
+                self.state = "finishing"
+            self._write_results()
+            self.state = "completed"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.finished_at = time.time()
+            self._finished.set()
+
+    def _write_results(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile_{self.id}")
+        if self.mode == "cprofile":
+            with self._profile_lock:
+                if not self._profiled:
+                    return
+                stats = pstats.Stats(self._profile)
+            self.artifact = f"{base}.pstats"
+            stats.dump_stats(self.artifact)
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            self.functions = [
+                {"function": f"{name} ({os.path.basename(filename)}:{line})",
+                 "calls": calls,
+                 "self_seconds": round(self_time, 6),
+                 "cumulative_seconds": round(cumulative, 6)}
+                for (filename, line, name), (_, calls, self_time, cumulative, _) in rows[:self.top]
+            ]
+            return
+
+        if not self._stacks:
+            return
+        self.artifact = f"{base}.collapsed"
+        with open(self.artifact, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self_samples, total_samples = collections.Counter(), collections.Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            self_samples[frames[-1]] += count
+            for label in set(frames):
+                total_samples[label] += count
+        self.functions = [
+            {"function": label,
+             "self_samples": self_samples[label],
+             "total_samples": total,
+             "self_pct": round(100.0 * self_samples[label] / self.samples, 2),
+             "total_pct": round(100.0 * total / self.samples, 2)}
+            for label, total in total_samples.most_common(self.top)
+        ]
+
+    def status(self):
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "state": self.state,
+            "reason": self.reason,
+            "frames": self.frame_limit,
+            "seconds": self.seconds,
+            "interval_ms": self.interval * 1000 if self.mode == "sample" else None,
+            "frames_seen": self.frames_seen,
+            "samples": self.samples if self.mode == "sample" else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "artifact": self.artifact,
+            "functions": self.functions,
+            "error": self.error,
+        }
+
+
+class FrameProfiler:
+    """Starts at most one ProfileCapture at a time and keeps the last one."""
+
+    def __init__(self, output_dir="profiles"):
+        self.output_dir = output_dir
+        self.current = None
+        self._lock = threading.Lock()
+
+    def start(self, mode="sample", frames=None, seconds=None, interval_ms=5.0, top=30):
+        """Begin a capture; raises ValueError on bad options, RuntimeError if one is running."""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
+        if frames is None and seconds is None:
+            seconds = 10.0
+        if frames is not None and not 0 < frames <= MAX_FRAMES:
+            raise ValueError(f"frames must be between 1 and {MAX_FRAMES}")
+        # A frame-limited capture still ends after MAX_SECONDS if no frames arrive
+        seconds = MAX_SECONDS if seconds is None else seconds
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {MAX_SECONDS}")
+        if not 0.5 <= interval_ms <= 1000:
+            raise ValueError("interval_ms must be between 0.5 and 1000")
+        with self._lock:
+            if self.current is not None and self.current.state in ("running", "finishing"):
+                raise RuntimeError(f"Profile {self.current.id} is still {self.current.state}")
+            capture = ProfileCapture(mode, frames, seconds, interval_ms, max(1, top), self.output_dir)
+            capture.start()
+            self.current = capture
+        return capture
+
+    def stop(self):
+        capture = self.current
+        if capture is not None and capture.running:
+            capture.stop("cancelled")
+        return capture
+
+    @contextmanager
+    def capture(self, frames=0):
+        """Profile the enclosed block (counting `frames` frames) if a capture is running."""
+        capture = self.current
+        if capture is None or not capture.running:
+            yield
+            return
+        with capture.profiling(frames):
+            yield
@@ -0,0 +1,134 @@
+import time
+import cv2
+import numpy as np
+
+# Crops are scored on a fixed-size grayscale thumbnail so a whole batch is one array
+_THUMB_SIZE = 64
+# Laplacian variance (on the thumbnail) at which a face counts as fully sharp
+SHARPNESS_REF = 100.0
+
+
+def _gray_thumb(crop):
+    if crop is None or crop.size == 0:
+        return np.zeros((_THUMB_SIZE, _THUMB_SIZE), dtype=np.float32)
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    return cv2.resize(gray, (_THUMB_SIZE, _THUMB_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def pose_scores(landmarks, n):
+    """Frontalness in [0, 1] from 5-point landmarks (eyes, nose, mouth corners).
+
+    Yaw is the nose's sideways offset from the eye/mouth midline, pitch its
+    height between eye line and mouth; both relative to the face's own size.
+    Roll is ignored since alignment removes it. Faces without landmarks
+    score 1 so they are judged on image quality alone.
+    """
+    scores = np.ones(n, dtype=np.float32)
+    if landmarks is None:
+        return scores
+    have = np.array([lm is not None for lm in landmarks], dtype=bool)
+    if not have.any():
+        return scores
+    pts = np.stack([np.asarray(lm, dtype=np.float32).reshape(5, 2) for lm in landmarks if lm is not None])
+    left_eye, right_eye, nose = pts[:, 0], pts[:, 1], pts[:, 2]
+    eye_mid = (left_eye + right_eye) / 2
+    mouth_mid = (pts[:, 3] + pts[:, 4]) / 2
+
+    eye_vec = right_eye - left_eye
+    eye_dist = np.maximum(np.linalg.norm(eye_vec, axis=1), 1e-6)
+    face_vec = mouth_mid - eye_mid
+    face_len2 = np.maximum((face_vec ** 2).sum(axis=1), 1e-6)
+
+    midline = (eye_mid + mouth_mid) / 2
+    yaw = np.abs(((nose - midline) * eye_vec).sum(axis=1)) / eye_dist ** 2
+    # A frontal nose tip sits a bit over halfway from the eye line to the mouth
+    pitch = np.abs(((nose - eye_mid) * face_vec).sum(axis=1) / face_len2 - 0.55)
+
+    frontal = np.clip(1.0 - yaw / 0.35, 0.0, 1.0) * np.clip(1.0 - pitch / 0.35, 0.0, 1.0)
+    scores[have] = frontal
+    return scores
+
+
+def score_faces(crops, landmarks=None, size_ref=112):
+    """Score a batch of BGR face crops in [0, 1]; higher is a better enrollment shot.
+
+    Combines brightness (mean intensity near mid-grey), sharpness (Laplacian
+    variance), size relative to size_ref and pose from landmarks, as the
+    geometric mean of the four terms. landmarks, if given, holds one (5, 2)
+    array or None per crop.
+    """
+    n = len(crops)
+    if n == 0:
+        return np.empty(0, dtype=np.float32)
+    grays = np.stack([_gray_thumb(crop) for crop in crops])
+
+    brightness = grays.mean(axis=(1, 2))
+    brightness_score = np.clip(1.0 - np.abs(brightness - 128.0) / 88.0, 0.0, 1.0)
+
+    laplacian = (grays[:, :-2, 1:-1] + grays[:, 2:, 1:-1] + grays[:, 1:-1, :-2]
+                 + grays[:, 1:-1, 2:] - 4.0 * grays[:, 1:-1, 1:-1])
+    sharpness_score = np.clip(laplacian.var(axis=(1, 2)) / SHARPNESS_REF, 0.0, 1.0)
+
+    sizes = np.array([min(crop.shape[:2]) if crop is not None and crop.size else 0 for crop in crops],
+                     dtype=np.float32)
+    size_score = np.clip(sizes / size_ref, 0.0, 1.0)
+
+    combined = brightness_score * sharpness_score * size_score * pose_scores(landmarks, n)
+    return (combined ** 0.25).astype(np.float32)
+
+
+class BestShotBuffer:
+    """Keeps the highest-scoring shot of every not-yet-identified track.
+
+    A track is ready once its best shot reaches min_quality, or time_budget
+    seconds after its first shot, whichever comes first; the caller then
+    take()s the shot and enrolls/matches with it. Shots are opaque to the
+    buffer. Not thread-safe: callers serialize access (e.g. the session lock).
+    """
+
+    def __init__(self, min_quality=0.6, time_budget=3.0):
+        self.min_quality = min_quality
+        self.time_budget = time_budget
+        self._shots = {}   # track_id -> [score, shot, first_seen]
+
+    def __len__(self):
+        return len(self._shots)
+
+    def __contains__(self, track_id):
+        return track_id in self._shots
+
+    def improves(self, track_id, score):
+        """True if a shot with this score would replace the buffered one."""
+        entry = self._shots.get(track_id)
+        return entry is None or score > entry[0]
+
+    def offer(self, track_id, score, shot):
+        """Keep shot if it beats the buffered one for track_id."""
+        entry = self._shots.get(track_id)
+        if entry is None:
+            self._shots[track_id] = [score, shot, time.monotonic()]
+        elif score > entry[0]:
+            entry[0], entry[1] = score, shot
+
+    def ready(self, track_id):
+        entry = self._shots.get(track_id)
+        if entry is None:
+            return False
+        return entry[0] >= self.min_quality or time.monotonic() - entry[2] >= self.time_budget
+
+    def take(self, track_id):
+        """Remove and return (score, shot) for track_id, or None."""
+        entry = self._shots.pop(track_id, None)
+        return None if entry is None else (entry[0], entry[1])
+
+    def retain(self, track_ids):
+        """Drop shots of tracks that are no longer alive."""
+        alive = set(int(t) for t in track_ids)
+        for track_id in [t for t in self._shots if t not in alive]:
+            del self._shots[track_id]
+
+    def expire(self, max_age):
+        """Drop shots first buffered more than max_age seconds ago."""
+        cutoff = time.monotonic() - max_age
+        for track_id in [t for t, entry in self._shots.items() if entry[2] < cutoff]:
+            del self._shots[track_id]
@@ -0,0 +1,290 @@
+"""INT8 ArcFace recognizer with an accuracy gate against the FP32 model.
+
+Quantize the InsightFace pack's recognition model (calibrated on saved_faces),
+then verify it by re-embedding every saved_faces/reid_*.jpg with both models:
+
+    python rec_quant.py quantize --pack buffalo_l --out ./models/rec_int8.onnx
+    python rec_quant.py verify --int8 ./models/rec_int8.onnx --max-drift 0.05
+
+verify writes <model>.verify.json next to the INT8 model and exits non-zero
+when the gate fails. FaceRecognitionAPI only loads the INT8 model
+(FACE_REC_INT8=path) if that report passed against the FP32 model it would
+replace; otherwise it keeps FP32.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import cv2
+import numpy as np
+
+# ArcFace (buffalo_l/buffalo_s) input resolution
+ARCFACE_INPUT_SIZE = 112
+# Gate defaults: 95th-percentile 1 - cos(fp32, int8) and cross-model top-1
+MAX_DRIFT = 0.05
+MIN_TOP1_AGREEMENT = 0.98
+
+
+def report_path(int8_path):
+    return f"{os.path.splitext(int8_path)[0]}.verify.json"
+
+
+def file_stat(path):
+    """[size, mtime_ns]; a model whose stat matches its report is taken as unchanged"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_recognition_model(pack="buffalo_l", root="~/.insightface"):
+    """Path of the recognition .onnx inside an InsightFace model pack."""
+    from insightface import model_zoo
+    from insightface.utils import ensure_available
+    model_dir = ensure_available("models", pack, root=root)
+    for onnx_file in sorted(glob.glob(os.path.join(model_dir, "*.onnx"))):
+        model = model_zoo.get_model(onnx_file, providers=["CPUExecutionProvider"])
+        if model is not None and model.taskname == "recognition":
+            return onnx_file
+    raise FileNotFoundError(f"No recognition model in InsightFace pack '{pack}'")
+
+
+def load_recognizer(model_path, providers=("CPUExecutionProvider",), input_mean=None, input_std=None):
+    """Load an ArcFace ONNX model through InsightFace.
+
+    InsightFace guesses input normalization from the graph's first node
+    names, which quantization renames; pass the FP32 model's values for INT8.
+    """
+    from insightface import model_zoo
+    model = model_zoo.get_model(model_path, providers=list(providers))
+    if model is None or model.taskname != "recognition":
+        raise ValueError(f"{model_path} is not a recognition model")
+    if input_mean is not None:
+        model.input_mean, model.input_std = input_mean, input_std
+    model.prepare(ctx_id=-1)
+    return model
+
+
+def load_faces(faces_dir, limit=None):
+    """(reid numbers, 112x112 BGR faces) for saved_faces/reid_<n>.jpg."""
+    entries = []
+    for path in glob.glob(os.path.join(faces_dir, "reid_*.jpg")):
+        match = re.fullmatch(r"reid_(\d+)\.jpg", os.path.basename(path))
+        if match:
+            entries.append((int(match.group(1)), path))
+    entries.sort()
+    if limit is not None:
+        entries = entries[:limit]
+    reids, faces = [], []
+    for reid, path in entries:
+        image = cv2.imread(path)
+        if image is not None and image.size:
+            reids.append(reid)
+            faces.append(cv2.resize(image, (ARCFACE_INPUT_SIZE, ARCFACE_INPUT_SIZE)))
+    return reids, faces
+
+
+def embed(model, faces, batch_size=32):
+    if not faces:
+        return np.empty((0, 0), dtype=np.float32)
+    feats = np.concatenate([model.get_feat(faces[i:i + batch_size])
+                            for i in range(0, len(faces), batch_size)]).astype(np.float32)
+    return feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+
+
+def quantize(fp32_path, out, faces_dir="saved_faces", calibration_size=500):
+    """Statically quantize the recognizer to INT8 (QDQ, per-channel weights)."""
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                          QuantType, quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    reference = load_recognizer(fp32_path)
+    _, faces = load_faces(faces_dir, limit=calibration_size)
+    if not faces:
+        raise ValueError(f"No calibration faces found in {faces_dir}")
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+
+    class SavedFacesReader(CalibrationDataReader):
+        def __init__(self):
+            self.rewind()
+
+        def get_next(self):
+            face = next(self._faces, None)
+            if face is None:
+                return None
+            blob = cv2.dnn.blobFromImages([face], 1.0 / reference.input_std, reference.input_size,
+                                          (reference.input_mean,) * 3, swapRB=True)
+            return {input_name: blob}
+
+        def rewind(self):
+            self._faces = iter(faces)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    prepared = f"{os.path.splitext(out)[0]}.prep.onnx"
+    quant_pre_process(fp32_path, prepared)
+    quantize_static(prepared, out, SavedFacesReader(),
+                    quant_format=QuantFormat.QDQ, activation_type=QuantType.QInt8,
+                    weight_type=QuantType.QInt8, per_channel=True,
+                    op_types_to_quantize=["Conv", "MatMul", "Gemm"],
+                    calibrate_method=CalibrationMethod.Percentile,
+                    extra_options={"ActivationSymmetric": True, "CalibPercentile": 99.99})
+    os.remove(prepared)
+    return out
+
+
+def verify(fp32_path, int8_path, faces_dir="saved_faces", max_drift=MAX_DRIFT,
+           min_agreement=MIN_TOP1_AGREEMENT, limit=None):
+    """Re-embed saved faces with both models and decide whether INT8 may deploy.
+
+    drift is 1 - cos(fp32, int8) per face. top1_agreement is the share of
+    INT8 embeddings whose nearest FP32 embedding is their own face, i.e. the
+    INT8 model still matches against an FP32-built gallery. neighbour_agreement
+    is the share of faces whose nearest other face is the same under both.
+    """
+    fp32 = load_recognizer(fp32_path)
+    int8 = load_recognizer(int8_path, input_mean=fp32.input_mean, input_std=fp32.input_std)
+    reids, faces = load_faces(faces_dir, limit=limit)
+    if not faces:
+        raise ValueError(f"No faces to verify in {faces_dir}")
+
+    def timed_embed(model):
+        started = time.perf_counter()
+        feats = embed(model, faces)
+        return feats, (time.perf_counter() - started) * 1000 / len(faces)
+
+    fp32_feats, fp32_ms = timed_embed(fp32)
+    int8_feats, int8_ms = timed_embed(int8)
+
+    drift = 1.0 - (fp32_feats * int8_feats).sum(axis=1)
+    cross = int8_feats @ fp32_feats.T
+    top1 = float((cross.argmax(axis=1) == np.arange(len(faces))).mean())
+
+    neighbour = None
+    if len(faces) > 1:
+        fp32_self, int8_self = fp32_feats @ fp32_feats.T, int8_feats @ int8_feats.T
+        np.fill_diagonal(fp32_self, -np.inf)
+        np.fill_diagonal(int8_self, -np.inf)
+        neighbour = float((fp32_self.argmax(axis=1) == int8_self.argmax(axis=1)).mean())
+
+    p95_drift = float(np.percentile(drift, 95))
+    worst = np.argsort(drift)[::-1][:5]
+    report = {
+        "passed": bool(p95_drift <= max_drift and top1 >= min_agreement),
+        "faces": len(faces),
+        "top1_agreement": round(top1, 4),
+        "neighbour_agreement": None if neighbour is None else round(neighbour, 4),
+        "drift_mean": round(float(drift.mean()), 5),
+        "drift_p95": round(p95_drift, 5),
+        "drift_max": round(float(drift.max()), 5),
+        "worst_reids": [int(reids[i]) for i in worst],
+        "max_drift": max_drift,
+        "min_agreement": min_agreement,
+        "fp32_ms_per_face": round(fp32_ms, 3),
+        "int8_ms_per_face": round(int8_ms, 3),
+        "fp32_model": os.path.basename(fp32_path),
+        "fp32_sha256": file_sha256(fp32_path),
+        "int8_sha256": file_sha256(int8_path),
+        "fp32_stat": file_stat(fp32_path),
+        "int8_stat": file_stat(int8_path),
+        "input_mean": float(fp32.input_mean),
+        "input_std": float(fp32.input_std),
+        "verified_at": time.time(),
+    }
+    with open(report_path(int8_path), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def check_deployable(int8_path, fp32_path):
+    """(ok, reason, report): whether int8_path passed verification against fp32_path.
+
+    Each model is only re-hashed when its size or mtime differs from the one
+    recorded in the report; the report is then updated so the next startup
+    skips the hash again.
+    """
+    if not os.path.exists(int8_path):
+        return False, f"{int8_path} does not exist", None
+    try:
+        with open(report_path(int8_path)) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return False, f"no verification report for {int8_path}; run rec_quant.py verify", None
+    if not report.get("passed"):
+        return False, (f"verification failed (p95 drift {report.get('drift_p95')}, "
+                       f"top-1 agreement {report.get('top1_agreement')})"), report
+    restamped = False
+    for prefix, path, reason in (
+            ("int8", int8_path, "INT8 model changed since it was verified"),
+            ("fp32", fp32_path, f"verified against a different FP32 model ({report.get('fp32_model')})")):
+        stat = file_stat(path)
+        if report.get(f"{prefix}_stat") == stat:
+            continue
+        if report.get(f"{prefix}_sha256") != file_sha256(path):
+            return False, reason, report
+        report[f"{prefix}_stat"] = stat
+        restamped = True
+    if restamped:
+        try:
+            with open(report_path(int8_path), "w") as f:
+                json.dump(report, f, indent=2)
+        except OSError:
+            pass
+    return True, "verified", report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantize and verify the INT8 face recognizer")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    quantize_cmd = sub.add_parser("quantize", help="Produce an INT8 recognition model")
+    quantize_cmd.add_argument("--pack", default="buffalo_l")
+    quantize_cmd.add_argument("--fp32", help="FP32 model (default: the pack's recognizer)")
+    quantize_cmd.add_argument("--out", default="./models/rec_int8.onnx")
+    quantize_cmd.add_argument("--faces-dir", default="saved_faces")
+    quantize_cmd.add_argument("--calibration-size", type=int, default=500)
+    quantize_cmd.add_argument("--no-verify", action="store_true")
+
+    verify_cmd = sub.add_parser("verify", help="Gate an INT8 model against FP32 on saved faces")
+    verify_cmd.add_argument("--pack", default="buffalo_l")
+    verify_cmd.add_argument("--fp32", help="FP32 model (default: the pack's recognizer)")
+    verify_cmd.add_argument("--int8", default="./models/rec_int8.onnx")
+    verify_cmd.add_argument("--faces-dir", default="saved_faces")
+    verify_cmd.add_argument("--limit", type=int)
+
+    for command in (quantize_cmd, verify_cmd):
+        command.add_argument("--max-drift", type=float, default=MAX_DRIFT)
+        command.add_argument("--min-agreement", type=float, default=MIN_TOP1_AGREEMENT)
+
+    args = parser.parse_args(argv)
+    fp32_path = args.fp32 or find_recognition_model(args.pack)
+    if args.command == "quantize":
+        started = time.time()
+        int8_path = quantize(fp32_path, args.out, faces_dir=args.faces_dir,
+                             calibration_size=args.calibration_size)
+        print(f"Quantized {fp32_path} to {int8_path} in {time.time() - started:.1f}s "
+              f"({os.path.getsize(fp32_path) / 1e6:.1f} MB -> {os.path.getsize(int8_path) / 1e6:.1f} MB)")
+        if args.no_verify:
+            return
+    else:
+        int8_path = args.int8
+    report = verify(fp32_path, int8_path, faces_dir=args.faces_dir, max_drift=args.max_drift,
+                    min_agreement=args.min_agreement, limit=getattr(args, "limit", None))
+    print(json.dumps(report, indent=2))
+    if not report["passed"]:
+        print(f"INT8 model rejected; see {report_path(int8_path)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
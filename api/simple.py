@@ -18,6 +18,8 @@ import warnings
 import gradio as gr
 
 from db import DatabaseManager
+from quality import BestShotBuffer, score_faces
+from metrics import registry as metrics, start_http_server
 from face_encoding_worker import face_encoding_worker  # make sure this is a function
 
 # Configure logging
@@ -47,10 +49,11 @@ class FaceEmbedding:
 class FaceRecognitionSystem:
     """Optimized face recognition system with reduced lag"""
     
-    def __init__(self, model_path='model/yolov11l-face.pt', target_width=1280, target_height=720):
-        # Frame processing settings
-        self.target_width = target_width
-        self.target_height = target_height
+    def __init__(self, model_path='model/yolov11l-face.pt', detector_size=640,
+                 best_shot_quality=0.6, best_shot_budget=3.0):
+        # Frame processing settings: frames are resized once, straight to the
+        # detector input, and boxes are mapped back to the original frame
+        self.detector_size = detector_size
         self.frame_scale_factor = 1.0
         
         # Frame skipping for performance
@@ -60,12 +63,16 @@ class FaceRecognitionSystem:
         # Load model with optimizations
         try:
             self.model = YOLO(model_path)
-            self.model.fuse()
-            if torch.cuda.is_available():
+            if model_path.endswith(".onnx"):
+                # Exported with yolo_onnx.py; ultralytics runs it on ONNX Runtime
+                logger.info("Model loaded as ONNX")
+            elif torch.cuda.is_available():
+                self.model.fuse()
                 self.model.to('cuda:0')
                 self.model.half()
                 logger.info("Model loaded on CUDA with half precision")
             else:
+                self.model.fuse()
                 logger.info("Model loaded on CPU")
         except Exception as e:
             logger.error(f"Error loading YOLO model: {e}")
@@ -84,6 +91,10 @@ class FaceRecognitionSystem:
         self.processing_tracks = set()
         self.embedding_cache = {}
         
+        # Best shot seen per track; a track is only embedded once its shot is
+        # good enough or best_shot_budget seconds have passed
+        self.best_shots = BestShotBuffer(min_quality=best_shot_quality, time_budget=best_shot_budget)
+        
         # Track processing cooldowns to avoid reprocessing
         self.track_last_processed = {}
         self.track_cooldown_time = 5.0  # 5 seconds cooldown
@@ -108,9 +119,9 @@ class FaceRecognitionSystem:
         self.frame_count = 0
         self.fps = 0
         
-        # Performance monitoring
-        self.embedding_processing_time = []
-        self.detection_processing_time = []
+        # Performance monitoring: stage latencies, queue depths and drops go to
+        # the shared metrics registry (served on FACE_METRICS_PORT, if set)
+        self._register_gauges()
         
         # Cache for recent detections to reduce redundant processing
         self.detection_cache = {}
@@ -140,25 +151,20 @@ class FaceRecognitionSystem:
         logger.info("Optimized background threads started")
     
     def _preprocess_frame(self, frame):
-        """Optimized frame preprocessing"""
+        """Resize once to the detector input; returns (frame, scale_factor)"""
         if frame is None:
             return None, 1.0
         
         # Get original dimensions
         original_height, original_width = frame.shape[:2]
         
-        # Calculate scaling to fit target resolution
-        scale_width = self.target_width / original_width
-        scale_height = self.target_height / original_height
-        scale_factor = min(scale_width, scale_height)
+        # Fit the long side to the detector input so YOLO only letterboxes
+        scale_factor = min(1.0, self.detector_size / max(original_width, original_height))
         
-        # Only resize if necessary
-        if scale_factor < 0.9 or scale_factor > 1.1:
+        if scale_factor < 1.0:
             new_width = int(original_width * scale_factor)
             new_height = int(original_height * scale_factor)
-            frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
-        else:
-            scale_factor = 1.0
+            frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
         
         self.frame_scale_factor = scale_factor
         return frame, scale_factor
@@ -212,9 +218,7 @@ class FaceRecognitionSystem:
             
             # Track processing time
             processing_time = time.time() - start_time
-            self.embedding_processing_time.append(processing_time)
-            if len(self.embedding_processing_time) > 50:  # Reduced history
-                self.embedding_processing_time.pop(0)
+            metrics.observe("stage_seconds", processing_time, component="simple", stage="embed")
             
             return embedding, track_id
             
@@ -263,6 +267,7 @@ class FaceRecognitionSystem:
                         }, timeout=0.1)
                     except queue.Full:
                         logger.warning(f"Database queue full, skipping track {track_id}")
+                        metrics.inc("items_dropped_total", component="simple", queue="db_query")
                         with self.processing_lock:
                             self.processing_tracks.discard(track_id)
                 else:
@@ -292,7 +297,8 @@ class FaceRecognitionSystem:
                 detection = data['detection']
                 
                 # Query database for match
-                reid_num, name = self.db_manager.query_face(embedding)
+                with metrics.timer("stage_seconds", component="simple", stage="match"):
+                    reid_num, name = self.db_manager.query(embedding)
                 
                 if reid_num is not None:
                     # Found existing person
@@ -386,6 +392,7 @@ class FaceRecognitionSystem:
         processed_frame, scale_factor = self._preprocess_frame(frame)
         
         detections = []
+        candidates = []
         
         if should_detect:
             try:
@@ -399,18 +406,24 @@ class FaceRecognitionSystem:
                     conf=0.7,      # Increased confidence for better quality
                     iou=0.45,      # Slightly lower IoU for better detection
                     max_det=10,    # Reduced max detections
-                    imgsz=640      # Smaller input size for speed
+                    imgsz=self.detector_size  # Frame is already this size, no second resize
                 )
             except Exception as e:
                 logger.error(f"YOLO tracking error: {e}")
-                return processed_frame
+                return frame
             
             for result in results:
                 if result.boxes is None:
                     continue
+                
+                # 5-point landmarks (face-pose weights only) feed the pose score
+                keypoints = None
+                if result.keypoints is not None and result.keypoints.xy.shape[1] == 5:
+                    keypoints = result.keypoints.xy.cpu().numpy() / scale_factor
                     
-                for box in result.boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
+                for i, box in enumerate(result.boxes):
+                    # Map detector coordinates back to the original frame
+                    x1, y1, x2, y2 = (int(v / scale_factor) for v in box.xyxy[0])
                     conf = float(box.conf[0])
                     
                     # Handle tracking ID
@@ -430,13 +443,14 @@ class FaceRecognitionSystem:
                         if self._should_process_track(track_id):
                             # Extract face crop with minimal padding
                             padding = 10  # Reduced padding
-                            h, w = processed_frame.shape[:2]
+                            h, w = frame.shape[:2]
                             x1_pad = max(0, x1 - padding)
                             y1_pad = max(0, y1 - padding)
                             x2_pad = min(w, x2 + padding)
                             y2_pad = min(h, y2 + padding)
                             
-                            face_crop = processed_frame[y1_pad:y2_pad, x1_pad:x2_pad]
+                            # Crop from the original frame for full-resolution embeddings
+                            face_crop = frame[y1_pad:y2_pad, x1_pad:x2_pad]
                             
                             if (face_crop.size > 0 and 
                                 face_crop.shape[0] > 80 and 
@@ -448,13 +462,10 @@ class FaceRecognitionSystem:
                                     face_crop=face_crop.copy(),
                                     frame_timestamp=time.time()
                                 )
-                                
-                                # Add to embedding queue (non-blocking)
-                                try:
-                                    self.embedding_queue.put_nowait(face_detection)
-                                except queue.Full:
-                                    # Queue is full, skip this detection
-                                    logger.debug(f"Embedding queue full, skipping track {track_id}")
+                                candidates.append((face_detection,
+                                                   keypoints[i] if keypoints is not None else None))
+            
+            self._queue_best_shots(candidates)
         
         # Store detections
         with self.detection_lock:
@@ -467,12 +478,34 @@ class FaceRecognitionSystem:
         # Record detection processing time
         if should_detect:
             detection_time = time.time() - detection_start
-            self.detection_processing_time.append(detection_time)
-            if len(self.detection_processing_time) > 50:
-                self.detection_processing_time.pop(0)
+            metrics.observe("stage_seconds", detection_time, component="simple", stage="detect")
         
         # Render the frame
-        return self.render_frame(processed_frame, detections)
+        with metrics.timer("stage_seconds", component="simple", stage="render"):
+            return self.render_frame(frame, detections)
+    
+    def _queue_best_shots(self, candidates):
+        """Score this frame's candidate crops in one batch and queue tracks whose best shot is ready"""
+        # Tracks that vanished before their budget ran out
+        self.best_shots.expire(2 * self.best_shots.time_budget)
+        if not candidates:
+            return
+        
+        scores = score_faces([c.face_crop for c, _ in candidates], [kps for _, kps in candidates])
+        for (face_detection, _), score in zip(candidates, scores):
+            track_id = face_detection.track_id
+            self.best_shots.offer(track_id, float(score), face_detection)
+            if not self.best_shots.ready(track_id):
+                continue
+            
+            _, best_detection = self.best_shots.take(track_id)
+            # Add to embedding queue (non-blocking)
+            try:
+                self.embedding_queue.put_nowait(best_detection)
+            except queue.Full:
+                # Queue is full, skip this detection
+                logger.debug(f"Embedding queue full, skipping track {track_id}")
+                metrics.inc("items_dropped_total", component="simple", queue="embedding")
     
     def render_frame(self, frame, detections):
         """Optimized frame rendering"""
@@ -602,24 +635,35 @@ class FaceRecognitionSystem:
             logger.error(f"Error deleting face: {e}")
             return False, f"Error deleting face: {e}"
     
+    def _register_gauges(self):
+        """Expose queue depths and tracking state on /metrics, read at scrape time"""
+        metrics.describe("stage_seconds", "Pipeline stage latency in seconds")
+        metrics.describe("items_dropped_total", "Work items dropped because a queue was full")
+        metrics.gauge("queue_depth", self.embedding_queue.qsize, "Items waiting in a worker queue",
+                      component="simple", queue="embedding")
+        metrics.gauge("queue_depth", self.db_query_queue.qsize, component="simple", queue="db_query")
+        metrics.gauge("tracks_processing", lambda: len(self.processing_tracks),
+                      "Tracks currently being embedded or matched", component="simple")
+        metrics.gauge("tracks_awaiting_shot", lambda: len(self.best_shots),
+                      "Tracks still waiting for a good enough shot to identify", component="simple")
+        metrics.gauge("gallery_identities", lambda: len(self.db_manager.reid_name_map),
+                      "Identities in the gallery", component="simple")
+        metrics.gauge("fps", lambda: self.fps, "Frames per second processed", component="simple")
+    
     def get_performance_stats(self):
-        """Get performance statistics"""
-        stats = {
+        """Get performance statistics (stage times over the metrics window)"""
+        embedding = metrics.stats("stage_seconds", component="simple", stage="embed")
+        detection = metrics.stats("stage_seconds", component="simple", stage="detect")
+        return {
             'fps': self.fps,
             'processing_tracks': len(self.processing_tracks),
             'embedding_queue_size': self.embedding_queue.qsize(),
             'db_queue_size': self.db_query_queue.qsize(),
-            'avg_embedding_time': 0,
-            'avg_detection_time': 0
+            'avg_embedding_time': embedding['mean'] or 0,
+            'p95_embedding_time': embedding['p95'] or 0,
+            'avg_detection_time': detection['mean'] or 0,
+            'p95_detection_time': detection['p95'] or 0,
         }
-        
-        if self.embedding_processing_time:
-            stats['avg_embedding_time'] = sum(self.embedding_processing_time) / len(self.embedding_processing_time)
-        
-        if self.detection_processing_time:
-            stats['avg_detection_time'] = sum(self.detection_processing_time) / len(self.detection_processing_time)
-        
-        return stats
     
     def cleanup(self):
         """Clean up resources"""
@@ -824,4 +868,8 @@ with gr.Blocks(title="Face Recognition System") as demo:
         outputs=[status_display, gallery]
     )
 
+if os.getenv("FACE_METRICS_PORT"):
+    start_http_server(int(os.getenv("FACE_METRICS_PORT")))
+    logger.info(f"Serving Prometheus metrics on :{os.getenv('FACE_METRICS_PORT')}/metrics")
+
 demo.launch(share=False)
\ No newline at end of file
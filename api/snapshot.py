@@ -0,0 +1,209 @@
+import contextlib
+import json
+import os
+import uuid
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+HEADER = "header.json"
+NAMES = "names.jsonl"
+
+
+class GallerySnapshot:
+    """Memory-mapped gallery shared by every uvicorn worker.
+
+    Layout of the snapshot directory:
+      header.json            dim, max_templates, capacity, committed row
+                             count and the token naming the array files
+      templates.<token>.f32  (capacity, max_templates, dim) float32 templates
+      centroids.<token>.f32  (capacity, dim) float32 centroids
+      rows.<token>.i64       (capacity, 3) int64 (reid, label, template count)
+      names.jsonl            append-only {"reid": n, "name": ...} log
+
+    The arrays are opened with np.memmap, so every process maps the same
+    page-cache pages and opening costs the same at any gallery size. Writers
+    take an exclusive file lock, write rows in place, then publish the new
+    row count by atomically replacing header.json; readers only ever look at
+    committed rows. Growing or rebuilding writes a fresh set of files, so
+    processes still mapping the old ones are unaffected until they refresh.
+
+    Implements the storage interface of gallery.MemoryStorage.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dim = None
+        self.max_templates = None
+        self.capacity = 0
+        self.count = 0
+        self.templates = self.centroids = self.rows = None
+        self.names = {}
+        self._token = None
+        self._layout = None
+        self._names_offset = 0
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def exists(self):
+        return os.path.exists(self._file(HEADER))
+
+    def _read_header(self):
+        with open(self._file(HEADER)) as f:
+            return json.load(f)
+
+    def _write_header(self, **fields):
+        header = {"dim": self.dim, "max_templates": self.max_templates, "capacity": self.capacity,
+                  "files": self._token, "count": self.count, "layout": self._layout}
+        header.update(fields)
+        tmp = self._file(f"{HEADER}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(header, f)
+        os.replace(tmp, self._file(HEADER))
+        return header
+
+    def _array_files(self, token):
+        return (self._file(f"templates.{token}.f32"), self._file(f"centroids.{token}.f32"),
+                self._file(f"rows.{token}.i64"))
+
+    def _map(self, token, capacity, mode="r+"):
+        templates, centroids, rows = self._array_files(token)
+        self.templates = np.memmap(templates, dtype=np.float32, mode=mode,
+                                   shape=(capacity, self.max_templates, self.dim))
+        self.centroids = np.memmap(centroids, dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+        self.rows = np.memmap(rows, dtype=np.int64, mode=mode, shape=(capacity, 3))
+        self._token, self.capacity = token, capacity
+
+    def open(self):
+        """Map an existing snapshot; False if there is none."""
+        if not self.exists():
+            return False
+        header = self._read_header()
+        self.dim, self.max_templates = header["dim"], header["max_templates"]
+        self._map(header["files"], header["capacity"])
+        self.count, self._layout = header["count"], header["layout"]
+        self.names, self._names_offset = {}, 0
+        self.sync_names()
+        return True
+
+    def create(self, dim, max_templates, capacity=1024):
+        """Start an empty snapshot (used before a full reload from ChromaDB)."""
+        os.makedirs(self.path, exist_ok=True)
+        with self.locked():
+            old_token = self._read_header()["files"] if self.exists() else None
+            self.dim, self.max_templates = dim, max_templates
+            self._allocate(capacity)
+            self.count = 0
+            self._layout = (self._layout or 0) + 1
+            with open(self._file(NAMES), "w"):
+                pass
+            self.names, self._names_offset = {}, 0
+            self._write_header()
+            if old_token is not None:
+                self._remove_files(old_token)
+
+    def _allocate(self, capacity):
+        token = f"{capacity}-{uuid.uuid4().hex[:8]}"
+        for file, shape, dtype in zip(self._array_files(token),
+                                      ((capacity, self.max_templates, self.dim), (capacity, self.dim), (capacity, 3)),
+                                      (np.float32, np.float32, np.int64)):
+            np.memmap(file, dtype=dtype, mode="w+", shape=shape).flush()
+        self._map(token, capacity)
+
+    def _remove_files(self, token):
+        # Other processes keep their mappings of unlinked files until they refresh
+        for file in self._array_files(token):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Exclusive writer lock across processes."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._file(".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Re-read the header; remap if another process grew or rebuilt the snapshot."""
+        header = self._read_header()
+        relayout = header["layout"] != self._layout or header["files"] != self._token
+        if header["files"] != self._token:
+            self._map(header["files"], header["capacity"])
+        self.count, self._layout = header["count"], header["layout"]
+        return relayout
+
+    def grow(self, capacity):
+        old_token, old_capacity = self._token, self.capacity
+        old = (self.templates, self.centroids, self.rows)
+        self._allocate(capacity)
+        # Copy every allocated row: the caller may be filling one past count
+        for new_array, old_array in zip((self.templates, self.centroids, self.rows), old):
+            new_array[:old_capacity] = old_array
+        self._write_header()
+        self._remove_files(old_token)
+
+    def reset(self, capacity):
+        old_token = self._token
+        self._allocate(max(1, capacity))
+        self.count = 0
+        self._write_header()
+        self._remove_files(old_token)
+
+    def commit(self, count, relayout=False):
+        self.count = count
+        if relayout:
+            self._layout += 1
+        self._write_header()
+
+    def template_total(self):
+        return int(self.rows[:self.count, 2].sum()) if self.rows is not None else 0
+
+    def append_names(self, names):
+        """Append {reid: name} updates to the name log; sync_names() reads them back."""
+        with open(self._file(NAMES), "a", encoding="utf-8") as f:
+            for reid, name in names.items():
+                f.write(json.dumps({"reid": int(reid), "name": name}) + "\n")
+
+    def rewrite_names(self, names):
+        """Replace the name log with a compacted {reid: name} table."""
+        tmp = self._file(f"{NAMES}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for reid, name in names.items():
+                f.write(json.dumps({"reid": int(reid), "name": name}) + "\n")
+        os.replace(tmp, self._file(NAMES))
+        self.names, self._names_offset = {}, 0
+        self.sync_names()
+
+    def sync_names(self):
+        """Read name-log lines appended since the last call; returns {reid: name} updates."""
+        path = self._file(NAMES)
+        if not os.path.exists(path):
+            return {}
+        size = os.path.getsize(path)
+        if size < self._names_offset:
+            # Log was compacted by another process: start over
+            self.names, self._names_offset = {}, 0
+        if size == self._names_offset:
+            return {}
+        updates = {}
+        with open(path, "rb") as f:
+            f.seek(self._names_offset)
+            data = f.read()
+        complete = data.rfind(b"\n") + 1     # ignore a line still being written
+        for line in data[:complete].splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                updates[entry["reid"]] = entry["name"]
+        self._names_offset += complete
+        self.names.update(updates)
+        return updates
@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SubsystemNotReady(Exception):
+    """Raised by Subsystem.get() while the subsystem is loading or has failed."""
+
+    def __init__(self, name, status):
+        super().__init__(f"{name} subsystem is {status['state']}")
+        self.name = name
+        self.status = status
+
+
+class Subsystem:
+    """A heavy component (models, LLM agents) loaded in a background thread.
+
+    start() returns immediately; routes call get(), which returns the loaded
+    object or raises SubsystemNotReady, so the app answers requests before
+    every model is in memory and one subsystem failing does not take down
+    the others.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._state = "pending"
+        self._error = None
+        self._started_at = None
+        self._load_seconds = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._state = "loading"
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._load, daemon=True, name=f"load_{self.name}")
+            self._thread.start()
+
+    def _load(self):
+        started = time.monotonic()
+        try:
+            value = self._loader()
+        except Exception as e:
+            logger.error(f"Loading {self.name} subsystem failed: {e}")
+            with self._lock:
+                self._state, self._error = "failed", str(e)
+                self._load_seconds = time.monotonic() - started
+            return
+        with self._lock:
+            self._value, self._state = value, "ready"
+            self._load_seconds = time.monotonic() - started
+        logger.info(f"{self.name} subsystem ready in {self._load_seconds:.1f}s")
+
+    @property
+    def ready(self):
+        return self._state == "ready"
+
+    def get(self):
+        if self._state != "ready":
+            raise SubsystemNotReady(self.name, self.status())
+        return self._value
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "error": self._error,
+                "started_at": self._started_at,
+                "load_seconds": self._load_seconds,
+            }
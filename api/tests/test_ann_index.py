@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from ann_index import INDEX_KINDS, QuantizedIndex, evaluate_recall
+from gallery import GalleryMatcher
+
+
+def face_like(n, dim=128, rank=24, seed=0):
+    """Unit vectors concentrated near a low-rank subspace, like face embeddings."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, rank)) @ rng.standard_normal((rank, dim)) + 0.3 * rng.standard_normal((n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def build(kind, n=2000, **kwargs):
+    vectors = face_like(n)
+    keys = [f"reid_{i}" for i in range(n)]
+    return QuantizedIndex.build(keys, np.arange(n), vectors, kind=kind, pca_dim=32, **kwargs), keys, vectors
+
+
+@pytest.mark.parametrize("kind", INDEX_KINDS)
+def test_exact_top1_is_among_candidates(kind):
+    index, keys, vectors = build(kind)
+    recall = evaluate_recall(index, keys, vectors, k=10, candidates=40)
+    assert recall["top1_in_candidates"] == 1.0
+    if kind != "pca":
+        assert recall["recall_at_k"] > 0.9
+
+
+def test_pca_stores_only_reduced_codes():
+    pca, _, _ = build("pca")
+    half, _, _ = build("float16")
+    assert pca.codes.shape[1] == 32
+    assert pca.codes.nbytes * 2 == half.codes.nbytes
+    assert pca.nbytes() < half.nbytes()
+
+
+def test_int8_scores_match_widened_codes_for_any_batch_size():
+    index, _, vectors = build("int8")
+    for queries in (vectors[:2], vectors[:16]):
+        projected = queries * index.scale
+        expected = projected @ index.codes.astype(np.float32).T
+        assert np.allclose(index._score(projected, index.codes), expected, atol=1e-4)
+
+
+def test_added_vectors_shadow_built_rows(tmp_path):
+    index, _, vectors = build("int8", n=200)
+    index.save(str(tmp_path / "index"))
+    index = QuantizedIndex.open(str(tmp_path / "index"))
+    assert len(index) == 200
+
+    index.add("reid_5", 5, vectors[7])
+    index.add("reid_900", 900, vectors[9])
+    assert len(index) == 201 and "reid_900" in index
+    keys, reids, _ = index.search(vectors[[7, 9]], k=2)
+    assert set(keys[0]) == {"reid_5", "reid_7"}
+    assert set(reids[1].tolist()) == {9, 900}
+
+
+def test_delta_buffer_grows_geometrically():
+    index, _, _ = build("int8", n=50)
+    added = face_like(150, seed=3)
+    for i, vector in enumerate(added):
+        index.add(f"reid_{1000 + i}", 1000 + i, vector)
+    assert len(index) == 200 and len(index._delta) == 256
+    index.add("reid_1000", 1000, added[149])          # replaced in place
+    assert len(index) == 200
+    _, reids, _ = index.search(added[[70, 149]], k=2)
+    assert reids[0, 0] == 1070
+    assert set(reids[1].tolist()) == {1000, 1149}
+
+
+def test_gallery_shortlists_from_index_and_mirrors_new_templates():
+    vectors = face_like(300)
+    index = QuantizedIndex.build([f"reid_{i}" for i in range(1, 201)], np.arange(1, 201), vectors[:200])
+    gallery = GalleryMatcher(dim=128, shortlist=4, index=index)
+    gallery.load((reid, vectors[reid - 1], None) for reid in range(1, 201))
+    assert len(index) == 200
+
+    gallery.add(250, vectors[249])
+    assert gallery.add_template(250, vectors[260]) == 1
+    assert "reid_250" in index and "reid_250_t1" in index
+
+    reids, sims = gallery.match(vectors[[9, 249, 260]], threshold=0.5)
+    assert reids.tolist() == [10, 250, 250]
+    assert np.allclose(sims, 1.0, atol=1e-5)
@@ -0,0 +1,112 @@
+import glob
+import os
+
+import pytest
+
+pytest.importorskip("polars")
+
+from attendance import PresenceLog
+
+
+def faces(*reids, confidence=0.9):
+    return [{"reid_num": reid, "confidence": confidence} for reid in reids]
+
+
+@pytest.fixture
+def make_log(tmp_path):
+    logs = []
+
+    def make(**kwargs):
+        log = PresenceLog(str(tmp_path / "attendance"), flush_interval=3600, **kwargs)
+        logs.append(log)
+        return log
+
+    yield make
+    for log in logs:
+        log.close()
+
+
+def parquet_files(log):
+    return glob.glob(os.path.join(log.parquet_dir, "*.parquet"))
+
+
+def test_sightings_merge_into_intervals_split_by_gaps(make_log):
+    log = make_log(gap_seconds=30)
+    log.observe("room-1", faces(1, 2), timestamp=1000)
+    log.observe("room-1", faces(1, confidence=0.7), timestamp=1010)
+    log.observe("room-1", faces(1), timestamp=1100)          # after a 90 s gap
+    log.observe("room-2", faces(3), timestamp=1000)
+    log.observe("room-1", [{"reid_num": None, "confidence": 0.5}], timestamp=1000)
+
+    rows = {row["reid_num"]: row for row in log.query("room-1", start=0, end=2000)}
+    assert set(rows) == {1, 2}
+    assert (rows[1]["first_seen"], rows[1]["last_seen"]) == (1000, 1100)
+    assert (rows[1]["frames"], rows[1]["intervals"]) == (3, 2)
+    assert rows[1]["confidence"] == pytest.approx(0.8333, abs=1e-3)
+    assert log.query("room-1", start=1500, end=2000) == []
+
+
+def test_close_compacts_to_parquet_and_query_reads_it_back(make_log):
+    log = make_log()
+    log.observe("room-1", faces(1, 2), timestamp=1000)
+    log.observe("room-1", faces(1), timestamp=1005)
+    before = log.query("room-1", start=0, end=2000)
+    log.close()
+
+    assert glob.glob(os.path.join(log.segments_dir, "*", "*.jsonl")) == []
+    assert not os.path.exists(log.writer_dir)
+    (path,) = parquet_files(log)
+    assert os.path.basename(path).startswith("events_1000_1006_")
+
+    reader = make_log()
+    assert reader.query("room-1", start=0, end=2000) == before
+    assert reader.query("room-1", start=2000, end=3000) == []
+
+
+def test_writers_only_compact_their_own_segments(make_log):
+    first, second = make_log(), make_log()
+    first.observe("room-1", faces(1), timestamp=1000)
+    first.flush()               # closes the long-idle interval into first's active segment
+    assert len(glob.glob(os.path.join(first.writer_dir, "segment_*.jsonl"))) == 1
+
+    second.observe("room-1", faces(2), timestamp=1001)
+    second.flush(close_all=True)
+    assert len(glob.glob(os.path.join(first.writer_dir, "segment_*.jsonl"))) == 1
+    assert len(parquet_files(second)) == 1
+    assert {row["reid_num"] for row in second.query("room-1", start=0, end=2000)} == {1, 2}
+
+
+def test_segments_of_a_dead_writer_are_adopted_once(make_log):
+    dead, alive = make_log(), make_log()
+    dead.observe("room-1", faces(7), timestamp=1000)
+    dead.flush()
+    # The worker dies: its lock is released with nothing compacted
+    dead._stop.set()
+    dead._writer_lock.close()
+    dead._writer_lock = None
+    dead.close = lambda: None
+
+    alive.flush()
+    assert not os.path.exists(dead.writer_dir)
+    assert len(parquet_files(alive)) == 1
+    (row,) = alive.query("room-1", start=0, end=2000)
+    assert (row["reid_num"], row["frames"]) == (7, 1)
+
+
+def test_segment_and_its_parquet_file_are_counted_once(make_log):
+    log = make_log()
+    log.observe("room-1", faces(4), timestamp=1000)
+    log.flush()
+    (segment,) = glob.glob(os.path.join(log.writer_dir, "segment_*.jsonl"))
+    with open(segment) as f:
+        content = f.read()
+    log.flush(close_all=True)
+
+    # As after a crash between writing the Parquet file and removing the segment
+    with open(segment, "w") as f:
+        f.write(content)
+    (row,) = log.query("room-1", start=0, end=2000)
+    assert row["frames"] == 1
+
+    log.compact()
+    assert len(parquet_files(log)) == 1
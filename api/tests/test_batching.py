@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+from batching import FrameBatcher, LatestOnlySlot
+
+
+class RecordingBatchFn:
+    """batch_fn that records every batch and how long each item was in flight."""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.batches = []
+        self.spans = []   # (lane, seq, started, finished)
+        self._lock = threading.Lock()
+
+    def __call__(self, items):
+        started = time.monotonic()
+        time.sleep(self.delay)
+        finished = time.monotonic()
+        with self._lock:
+            self.batches.append(list(items))
+            self.spans.extend((lane, seq, started, finished) for lane, seq in items)
+        return [f"{lane}-{seq}" for lane, seq in items]
+
+
+def run_batcher(batcher, items):
+    async def submit_all():
+        return await asyncio.gather(*(batcher.submit(item) for item in items))
+    return asyncio.run(submit_all())
+
+
+def test_results_come_back_per_item_in_order():
+    batch_fn = RecordingBatchFn(delay=0)
+    batcher = FrameBatcher(batch_fn, max_batch_size=4, max_wait_ms=20)
+    items = [(None, seq) for seq in range(10)]
+    assert run_batcher(batcher, items) == [f"None-{seq}" for seq in range(10)]
+    assert all(len(batch) <= 4 for batch in batch_fn.batches)
+    assert batcher.items_run == 10
+
+
+def test_failed_batch_raises_in_every_waiter():
+    def failing(items):
+        raise RuntimeError("model crashed")
+
+    batcher = FrameBatcher(failing, max_batch_size=4, max_wait_ms=5)
+
+    async def submit():
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    results = asyncio.run(submit())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_items_of_one_lane_never_overlap_and_keep_submission_order():
+    batch_fn = RecordingBatchFn(delay=0.02)
+    batcher = FrameBatcher(batch_fn, max_batch_size=8, max_wait_ms=5, max_concurrent_batches=2,
+                           lane_key=lambda item: item[0])
+    items = [(lane, seq) for seq in range(6) for lane in ("room-a", "room-b")]
+    results = run_batcher(batcher, items)
+
+    assert results == [f"{lane}-{seq}" for lane, seq in items]
+    for batch in batch_fn.batches:
+        lanes = [lane for lane, _ in batch]
+        assert len(lanes) == len(set(lanes))
+    for lane in ("room-a", "room-b"):
+        spans = sorted((s for s in batch_fn.spans if s[0] == lane), key=lambda s: s[2])
+        assert [seq for _, seq, _, _ in spans] == list(range(6))
+        for earlier, later in zip(spans, spans[1:]):
+            assert earlier[3] <= later[2]
+
+
+def test_items_without_a_lane_are_not_held_back():
+    batch_fn = RecordingBatchFn(delay=0.01)
+    batcher = FrameBatcher(batch_fn, max_batch_size=8, max_wait_ms=20,
+                           lane_key=lambda item: item[0])
+    run_batcher(batcher, [(None, seq) for seq in range(5)])
+    assert len(batch_fn.batches) == 1
+
+
+def test_latest_only_slot_keeps_newest_item_and_counts_dropped():
+    async def scenario():
+        slot = LatestOnlySlot()
+        for frame in ("f1", "f2", "f3"):
+            slot.put(frame)
+        item, waited = await slot.get()
+        consumer = asyncio.ensure_future(slot.get())
+        await asyncio.sleep(0.01)
+        assert not consumer.done()
+        slot.put("f4")
+        return item, waited, (await consumer)[0], slot.dropped
+
+    item, waited, next_item, dropped = asyncio.run(scenario())
+    assert (item, next_item, dropped) == ("f3", "f4", 2)
+    assert waited >= 0
+
+
+def test_latest_only_slot_close_wakes_consumer():
+    async def scenario():
+        slot = LatestOnlySlot()
+        consumer = asyncio.ensure_future(slot.get())
+        await asyncio.sleep(0)
+        slot.close(ConnectionError("client left"))
+        try:
+            await consumer
+        except ConnectionError as e:
+            return str(e)
+
+    assert asyncio.run(scenario()) == "client left"
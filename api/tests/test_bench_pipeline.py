@@ -0,0 +1,102 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import bench_pipeline
+from bench_pipeline import StageRecorder, compare, frames_from_directory, synthetic_frames
+
+
+def test_synthetic_frames_are_jpeg_classrooms(tmp_path):
+    frames = list(synthetic_frames(6, faces_dir=str(tmp_path), size=(640, 360), faces=6))
+    assert len(frames) == 6
+    decoded = [cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) for data in frames]
+    assert all(frame.shape == (360, 640, 3) for frame in decoded)
+    assert not np.array_equal(decoded[0], decoded[1])         # faces jitter between frames
+    assert frames == list(synthetic_frames(6, faces_dir=str(tmp_path), size=(640, 360), faces=6))
+
+
+def test_frames_from_directory_reads_images_in_order(tmp_path):
+    for name in ("b.jpg", "a.png", "notes.txt"):
+        (tmp_path / name).write_bytes(name.encode())
+    assert list(frames_from_directory(str(tmp_path))) == [b"a.png", b"b.jpg"]
+    assert list(frames_from_directory(str(tmp_path), limit=1)) == [b"a.png"]
+
+
+def test_stage_recorder_skips_warmup_and_orders_stages():
+    recorder = StageRecorder()
+    recorder("detect", 1.0)                 # warm-up
+    recorder.enabled = True
+    recorder("total", 0.004)
+    recorder("detect", 0.001)
+    recorder("detect", 0.003)
+    summary = recorder.summary()
+    assert list(summary) == ["detect", "total"]
+    assert summary["detect"]["count"] == 2
+    assert summary["detect"]["mean_ms"] == pytest.approx(2.0)
+    assert summary["detect"]["max_ms"] == pytest.approx(3.0)
+
+
+def test_replay_measures_frames_after_warmup():
+    class FakeGallery:
+        def __len__(self):
+            return 3
+
+    class FakeAPI:
+        detector_input_size = 640
+        gallery = FakeGallery()
+        stage_observer = None
+
+        def process_frame_with_info(self, frame, use_tracking, session_id, render):
+            self.stage_observer("detect", 0.002)
+            display_frame = frame.full if render else None
+            return display_frame, {"head_count": 2, "reused_previous_result": False}
+
+    frames = list(synthetic_frames(4, size=(320, 240), faces=2))
+    report = bench_pipeline._replay(FakeAPI(), frames, warmup=1, render=True, use_tracking=True,
+                                    startup_seconds=0.5)
+    assert (report["frames"], report["faces"], report["reused_frames"]) == (3, 6, 0)
+    assert report["gallery_identities"] == 3
+    assert list(report["stages"]) == ["decode", "detect", "jpeg_encode", "total"]
+    assert report["stages"]["detect"]["count"] == 3
+
+
+def test_compare_reports_relative_change():
+    old = {"fps": 10.0, "stages": {"detect": {"p50_ms": 20.0, "p95_ms": 0}}}
+    new = {"fps": 12.0, "stages": {"detect": {"p50_ms": 10.0, "p95_ms": 5.0}, "embed": {}}}
+    lines = compare(old, new).splitlines()
+    assert lines[0].strip() == "fps:       10.0 ->       12.0 (+20.0%)"
+    assert lines[1].endswith("(-50.0%)") and lines[2].endswith("(n/a)")
+    assert len(lines) == 3
+
+
+def test_run_passes_scratch_paths_without_touching_the_environment(monkeypatch):
+    api = pytest.importorskip("api")
+    created = {}
+
+    class ScratchAPI:
+        detector_input_size = 640
+        stage_observer = None
+        gallery = ()
+
+        def __init__(self, **kwargs):
+            created.update(kwargs)
+            self.attendance = self
+
+        def close(self):
+            created["attendance_closed"] = True
+
+    monkeypatch.setattr(api, "FaceRecognitionAPI", ScratchAPI)
+    monkeypatch.setenv("FACE_INDEX_PATH", "/srv/face_index")
+    monkeypatch.delenv("FACE_GALLERY_SNAPSHOT", raising=False)
+    report = bench_pipeline.run([], {"pipeline_mode": "scrfd"}, warmup=0)
+
+    assert report["frames"] == 0
+    assert created["pipeline_mode"] == "scrfd" and created["attendance_closed"]
+    workdir = os.path.dirname(created["db_path"])
+    assert all(os.path.dirname(created[key]) == workdir
+               for key in ("face_img_path", "index_path", "snapshot_path", "attendance_dir"))
+    assert not os.path.exists(workdir)
+    assert os.environ["FACE_INDEX_PATH"] == "/srv/face_index"
+    assert "FACE_GALLERY_SNAPSHOT" not in os.environ
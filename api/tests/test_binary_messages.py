@@ -0,0 +1,25 @@
+import pytest
+
+api = pytest.importorskip("api")
+
+
+def test_pack_and_unpack_round_trip():
+    header = {"session_id": "room-1", "use_tracking": True}
+    message = api.pack_binary_message(header, b"\xff\xd8jpeg")
+    assert message[:4] == len(b'{"session_id":"room-1","use_tracking":true}').to_bytes(4, "big")
+    decoded, payload = api.unpack_binary_message(message)
+    assert decoded == header
+    assert bytes(payload) == b"\xff\xd8jpeg"
+
+
+def test_empty_header_and_payload():
+    header, payload = api.unpack_binary_message(b"\x00\x00\x00\x00jpeg")
+    assert header == {} and bytes(payload) == b"jpeg"
+    header, payload = api.unpack_binary_message(api.pack_binary_message({"a": 1}))
+    assert header == {"a": 1} and len(payload) == 0
+
+
+@pytest.mark.parametrize("message", [b"\x00\x00", b"\x00\x00\x00\x10{}"])
+def test_truncated_messages_are_rejected(message):
+    with pytest.raises(ValueError):
+        api.unpack_binary_message(message)
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+api = pytest.importorskip("api")
+
+from ingest import IngestedFrame
+
+FRAME = (640, 480)
+TRACKS = [(100, 100, 150, 160), (600, 400, 640, 480)]
+
+
+def plan(scheduler, tracks=TRACKS):
+    return scheduler.plan(tracks, FRAME, roi_size=160, full_size=640)
+
+
+def test_sweeps_first_then_padded_rois_until_the_interval():
+    scheduler = api.DetectionScheduler(full_sweep_interval=3, padding=0.5)
+    assert plan(scheduler) is None
+    scheduler.record(None, faces_found=2)
+
+    rois = plan(scheduler)
+    np.testing.assert_allclose(rois, [[75, 70, 175, 190], [580, 360, 640, 480]])   # clipped to the frame
+    scheduler.record(rois, faces_found=2)
+    scheduler.record(plan(scheduler), faces_found=2)
+    assert plan(scheduler) is None      # third frame since the sweep
+    assert scheduler.summary() == {"full_sweeps": 1, "roi_frames": 2}
+
+
+def test_face_count_change_forces_a_sweep():
+    scheduler = api.DetectionScheduler(full_sweep_interval=10)
+    scheduler.record(None, faces_found=2)
+    scheduler.record(plan(scheduler), faces_found=1)
+    assert plan(scheduler) is None
+
+
+def test_sweeps_without_tracks_or_when_rois_cost_as_much_as_the_frame():
+    scheduler = api.DetectionScheduler(full_sweep_interval=10)
+    scheduler.record(None, faces_found=0)
+    assert plan(scheduler, tracks=[]) is None
+    assert plan(scheduler, tracks=TRACKS * 8) is None       # 16 * 160^2 >= 640^2
+    assert plan(scheduler) is not None
+    scheduler.reset()
+    assert plan(scheduler) is None
+    assert plan(api.DetectionScheduler(full_sweep_interval=1)) is None
+
+
+@pytest.mark.parametrize("dynamic_size, expect_rois", [(True, True), (False, False)])
+def test_static_onnx_export_never_plans_rois(dynamic_size, expect_rois):
+    face_api = api.FaceRecognitionAPI.__new__(api.FaceRecognitionAPI)
+    face_api.pipeline_mode, face_api.yolo_backend, face_api.roi_size = "yolo", "onnx", 160
+    face_api.yolo_model = SimpleNamespace(dynamic_size=dynamic_size, imgsz=640)
+    face_api.sessions = api.SessionRegistry(full_sweep_interval=10, motion_gating=False)
+    session = face_api.sessions.get("room")
+    session.tracker.update([{"bbox": box, "confidence": 0.9} for box in TRACKS])
+    session.detection.record(None, faces_found=2)
+
+    frame = IngestedFrame.from_array(np.zeros((480, 640, 3), dtype=np.uint8))
+    requests = [(frame, True, "room", False)]
+    (rois,) = face_api._plan_detection(requests, [0], [frame])
+    assert (rois is not None) == expect_rois
+    assert face_api.roi_input_size == (160 if dynamic_size else 640)
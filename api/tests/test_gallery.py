@@ -0,0 +1,95 @@
+import numpy as np
+
+from gallery import GalleryMatcher, find_duplicate_pairs
+
+
+def unit_vectors(n, dim=64, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_match_returns_enrolled_reid_and_rejects_below_threshold():
+    gallery = GalleryMatcher(dim=64)
+    vectors = unit_vectors(20)
+    for reid, vector in enumerate(vectors, start=1):
+        gallery.add(reid, vector)
+
+    reids, sims = gallery.match(vectors[[3, 7]], threshold=0.5)
+    assert reids.tolist() == [4, 8]
+    assert np.allclose(sims, 1.0, atol=1e-5)
+
+    stranger = unit_vectors(1, seed=99)
+    reids, _ = gallery.match(stranger, threshold=0.5)
+    assert reids.tolist() == [-1]
+
+
+def test_empty_gallery_matches_nothing():
+    reids, sims = GalleryMatcher(dim=64).match(unit_vectors(3), threshold=0.1)
+    assert reids.tolist() == [-1, -1, -1]
+    assert sims.tolist() == [-1.0, -1.0, -1.0]
+
+
+def test_gallery_grows_past_initial_capacity():
+    gallery = GalleryMatcher(dim=64, initial_capacity=2)
+    vectors = unit_vectors(10)
+    for reid, vector in enumerate(vectors):
+        gallery.add(reid, vector)
+    assert len(gallery) == 10
+    assert gallery.match(vectors[9:], threshold=0.5)[0].tolist() == [9]
+
+
+def test_relabel_resolves_merged_identity_to_target():
+    gallery = GalleryMatcher(dim=64)
+    vectors = unit_vectors(2)
+    gallery.add(1, vectors[0])
+    gallery.add(2, vectors[1])
+
+    assert gallery.relabel(1, 2) == 1
+    assert gallery.match(vectors[:1], threshold=0.5)[0].tolist() == [2]
+    reids, _ = gallery.centroids(active_only=True)
+    assert reids == [2]
+
+
+def test_load_replaces_contents():
+    gallery = GalleryMatcher(dim=64)
+    vectors = unit_vectors(3)
+    gallery.add(1, vectors[0])
+    gallery.load([(5, vectors[1], None), (6, vectors[2], 5)])
+    assert len(gallery) == 2
+    assert gallery.match(vectors, threshold=0.5)[0].tolist() == [-1, 5, 5]
+
+
+def test_templates_extend_match_and_evict_most_redundant():
+    gallery = GalleryMatcher(dim=64, max_templates=3)
+    vectors = unit_vectors(6)
+    gallery.add(1, vectors[0])
+    assert gallery.add_template(1, vectors[0], novelty=0.95) is None     # not novel
+    assert gallery.add_template(1, vectors[1]) == 1
+    assert gallery.add_template(1, vectors[2]) == 2
+    assert gallery.add_template(99, vectors[3]) is None                  # not enrolled
+    assert gallery.template_count() == 3
+
+    # The other sightings of the identity now match through their own template
+    reids, sims = gallery.match(vectors[1:3], threshold=0.5)
+    assert reids.tolist() == [1, 1] and np.allclose(sims, 1.0, atol=1e-5)
+
+    # Full: a near-copy of template 1 is the most redundant and gets evicted
+    near_copy = vectors[1] + 0.01 * vectors[4]
+    assert gallery.add_template(1, near_copy) == 1
+    templates = gallery.templates(1)
+    assert len(templates) == 3
+    assert np.allclose(templates[1], near_copy / np.linalg.norm(near_copy), atol=1e-6)
+
+
+def test_find_duplicate_pairs_across_blocks():
+    vectors = unit_vectors(40)
+    embeddings = np.vstack([vectors, vectors[[3, 17]] + 0.01 * vectors[[5, 6]]])
+    reids = list(range(40)) + [100, 117]
+    progress = []
+    pairs = find_duplicate_pairs(reids, embeddings, threshold=0.9, top_k=3, block_size=16,
+                                 on_block=lambda done, total, found: progress.append((done, total)))
+
+    assert [(a, b) for a, b, _ in pairs] in ([(3, 100), (17, 117)], [(17, 117), (3, 100)])
+    assert all(sim > 0.99 for _, _, sim in pairs)
+    assert progress[-1] == (42, 42) and len(progress) == 3
+    assert find_duplicate_pairs([1], vectors[:1], threshold=0.5) == []
@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+
+from ingest import IngestedFrame, jpeg_dimensions
+
+
+def encoded_jpeg(width, height, seed=0):
+    image = np.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    ok, data = cv2.imencode(".jpg", cv2.GaussianBlur(image, (9, 9), 0))
+    assert ok
+    return data.tobytes()
+
+
+def test_jpeg_dimensions_reads_header():
+    assert jpeg_dimensions(encoded_jpeg(1920, 1080)) == (1920, 1080)
+    assert jpeg_dimensions(b"not a jpeg") is None
+
+
+def test_reduced_decode_maps_back_to_original_coordinates():
+    frame = IngestedFrame.from_bytes(encoded_jpeg(1920, 1080), detector_size=640)
+    assert max(frame.detector_frame.shape[:2]) == 640
+    assert frame.original_size == (1920, 1080)
+    assert frame.shape == (1080, 1920, 3)
+    assert frame._full is None
+    x1, y1, x2, y2 = frame.to_original((10, 20, 320, 180))
+    assert x1 == pytest.approx(30, abs=0.5) and y2 == pytest.approx(540, abs=0.5)
+    assert frame.full.shape == (1080, 1920, 3)
+
+
+def test_need_full_decodes_once_at_full_size(monkeypatch):
+    data = encoded_jpeg(1920, 1080)
+    decodes = []
+    real_imdecode = cv2.imdecode
+
+    def counting_imdecode(buffer, flags):
+        decodes.append(flags)
+        return real_imdecode(buffer, flags)
+
+    monkeypatch.setattr(cv2, "imdecode", counting_imdecode)
+    frame = IngestedFrame.from_bytes(data, detector_size=640, need_full=True)
+    assert frame.full.shape == (1080, 1920, 3)
+    assert max(frame.detector_frame.shape[:2]) == 640
+    assert decodes == [cv2.IMREAD_COLOR]
+
+
+def test_small_image_is_its_own_full_frame():
+    frame = IngestedFrame.from_bytes(encoded_jpeg(320, 240), detector_size=640)
+    assert frame.scale == (1.0, 1.0)
+    assert frame.full is frame.detector_frame
+
+
+def test_invalid_image_raises_value_error():
+    with pytest.raises(ValueError):
+        IngestedFrame.from_bytes(b"\xff\xd8garbage", detector_size=640)
+
+
+def test_region_points_map_to_original_coordinates():
+    frame = IngestedFrame.from_array(np.zeros((1080, 1920, 3), np.uint8), detector_size=640)
+    region = frame.region((960, 540, 1280, 720), size=160)
+    assert region.original_size == frame.original_size
+    assert max(region.detector_frame.shape[:2]) == 160
+    x1, y1, x2, y2 = region.to_original((0, 0, region.detector_frame.shape[1], region.detector_frame.shape[0]))
+    assert (x1, y1) == pytest.approx((960, 540), abs=3)
+    assert (x2, y2) == pytest.approx((1280, 720), abs=3)
+    points = region.points_to_original([[0, 0]])
+    assert points[0].tolist() == pytest.approx([960, 540], abs=3)
@@ -0,0 +1,69 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import CONTENT_TYPE, MetricsRegistry, RingHistogram, start_http_server
+
+
+def test_ring_histogram_keeps_the_last_window_and_all_time_totals():
+    histogram = RingHistogram(window=4)
+    assert histogram.quantiles() == {0.5: None, 0.95: None, 0.99: None}
+    for value in range(1, 11):
+        histogram.observe(value)
+    values, count, total = histogram.snapshot()
+    assert sorted(values.tolist()) == [7, 8, 9, 10]
+    assert (count, total) == (10, 55)
+    assert histogram.quantiles()[0.5] == pytest.approx(8.5)
+
+
+def test_stats_and_timer():
+    registry = MetricsRegistry(window=8)
+    assert registry.stats("stage_seconds", stage="detect")["count"] == 0
+    for value in (0.1, 0.2, 0.3):
+        registry.observe("stage_seconds", value, stage="detect")
+    with registry.timer("stage_seconds", stage="embed"):
+        pass
+
+    stats = registry.stats("stage_seconds", stage="detect")
+    assert stats["count"] == 3
+    assert stats["mean"] == pytest.approx(0.2)
+    assert stats["p50"] == pytest.approx(0.2)
+    assert registry.stats("stage_seconds", stage="embed")["count"] == 1
+
+
+def test_render_exposition_format():
+    registry = MetricsRegistry(namespace="test", window=8)
+    registry.describe("stage_seconds", "Stage latency")
+    registry.observe("stage_seconds", 0.5, stage="detect")
+    registry.inc("frames_total", source="ws")
+    registry.inc("frames_total", 2, source="ws")
+    registry.gauge("queue_depth", lambda: 3, "Queued frames", lane='a"b\\c')
+    registry.gauge("broken", lambda: 1 / 0)
+
+    lines = registry.render().splitlines()
+    assert "# HELP test_stage_seconds Stage latency (last 8 observations)" in lines
+    assert "# TYPE test_stage_seconds summary" in lines
+    assert 'test_stage_seconds{stage="detect",quantile="0.5"} 0.5' in lines
+    assert 'test_stage_seconds_sum{stage="detect"} 0.5' in lines
+    assert 'test_stage_seconds_count{stage="detect"} 1' in lines
+    assert "# TYPE test_frames_total counter" in lines
+    assert 'test_frames_total{source="ws"} 3.0' in lines
+    assert 'test_queue_depth{lane="a\\"b\\\\c"} 3.0' in lines
+    assert "test_broken NaN" in lines
+
+
+def test_http_server_serves_metrics():
+    registry = MetricsRegistry(namespace="test")
+    registry.inc("frames_total")
+    server = start_http_server(0, registry, host="127.0.0.1")
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(base + "/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert "test_frames_total 1.0" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(base + "/other", timeout=5)
+    finally:
+        server.shutdown()
+        server.server_close()
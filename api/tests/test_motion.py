@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+from motion import ChangeDetector
+
+
+def scene(width=640, height=360):
+    """A classroom-like still: a gradient wall with a few desks."""
+    ramp = np.linspace(60, 190, width, dtype=np.float32)
+    image = np.repeat(np.tile(ramp, (height, 1))[..., None], 3, axis=2).astype(np.uint8)
+    for x in range(40, width - 80, 140):
+        cv2.rectangle(image, (x, 220), (x + 90, 300), (40, 70, 120), -1)
+    cv2.circle(image, (320, 90), 40, (230, 230, 230), -1)
+    return image
+
+
+def difference_hash(gray, hash_size=16):
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1]).tobytes()
+
+
+def test_reencoded_frames_are_static():
+    detector = ChangeDetector(max_static_seconds=60)
+    frame = scene()
+    _, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    assert detector.should_analyse(frame)
+    assert not detector.should_analyse(cv2.imdecode(jpeg, cv2.IMREAD_COLOR))
+
+
+def test_small_change_is_analysed_even_when_a_coarse_hash_collides():
+    detector = ChangeDetector(max_static_seconds=60)
+    frame = scene()
+    assert detector.should_analyse(frame)
+
+    turned = frame.copy()
+    region = turned[110:160, 100:140].astype(np.int16)
+    stripes = np.where((np.arange(40) // 8) % 2 == 0, -60, 60)[None, :, None]
+    turned[110:160, 100:140] = np.clip(region + stripes, 0, 255).astype(np.uint8)
+    before, after = detector._thumb(frame), detector._thumb(turned)
+    assert difference_hash(before) == difference_hash(after)
+    assert detector.changed_fraction(after) > detector.min_changed_fraction
+    assert detector.should_analyse(turned)
+
+
+def test_static_frames_are_skipped_and_changes_analysed():
+    detector = ChangeDetector(max_static_seconds=60)
+    frame = scene()
+    assert detector.should_analyse(frame)
+    assert not detector.should_analyse(frame.copy())
+
+    brighter = cv2.add(frame, np.full_like(frame, 15))      # auto-exposure shift only
+    assert not detector.should_analyse(brighter)
+
+    moved = frame.copy()
+    cv2.rectangle(moved, (200, 100), (260, 300), (20, 20, 20), -1)   # someone walks in
+    assert detector.should_analyse(moved)
+    assert detector.summary() == {"analysed_frames": 2, "static_frames_skipped": 2}
+
+
+def test_forced_and_overdue_frames_are_analysed():
+    detector = ChangeDetector(max_static_seconds=0)
+    frame = scene()
+    assert detector.should_analyse(frame)
+    assert detector.should_analyse(frame)
+
+    detector = ChangeDetector(max_static_seconds=60)
+    detector.should_analyse(frame)
+    assert detector.should_analyse(frame, force=True)
+    detector.reset()
+    assert detector.should_analyse(frame)
@@ -0,0 +1,228 @@
+import queue
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+api = pytest.importorskip("api")
+
+from gallery import GalleryMatcher
+from ingest import IngestedFrame
+from profiling import FrameProfiler
+
+FACES = [(100, 100, 180, 200), (400, 120, 470, 210)]
+
+
+def noise_frame(width=640, height=480, seed=0):
+    return np.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+
+
+class FakeDetector:
+    """Stands in for OnnxFaceDetector: the same boxes on every image."""
+
+    dynamic_size = True
+    imgsz = 640
+
+    def __init__(self, boxes, keypoints=True):
+        self.boxes = np.asarray(boxes, dtype=np.float32)
+        self.keypoints = keypoints
+
+    def detect(self, images, imgsz=None):
+        kps = None
+        if self.keypoints:
+            x1, y1, x2, y2 = self.boxes.T
+            kps = np.stack([np.stack([x1 + (x2 - x1) * fx, y1 + (y2 - y1) * fy], axis=1)
+                            for fx, fy in [(0.3, 0.4), (0.7, 0.4), (0.5, 0.6), (0.35, 0.8), (0.65, 0.8)]], axis=1)
+        return [(self.boxes, np.full(len(self.boxes), 0.9, dtype=np.float32), kps) for _ in images]
+
+
+class FakeRecognizer:
+    """Stands in for ArcFace: the centred pixels of each aligned face, recording batch sizes."""
+
+    def __init__(self):
+        self.batches = []
+
+    def get_feat(self, faces):
+        self.batches.append(len(faces))
+        return np.stack([face.astype(np.float32).ravel()[:api.EMBEDDING_DIM] - 127.5 for face in faces])
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.reid_name_map = {}
+        self.rows = []
+
+    def sync_snapshot(self):
+        pass
+
+    def next_reid_num(self):
+        return len(self.rows) + 1
+
+    def add(self, embedding, reid_num, name):
+        self.rows.append(reid_num)
+        self.reid_name_map[f"reid_{reid_num}"] = name
+
+    def put_template(self, embedding, reid_num, slot):
+        pass
+
+
+class AttendanceRecorder:
+    def __init__(self):
+        self.observed = []
+
+    def observe(self, session_id, face_info, timestamp=None):
+        self.observed.append((session_id, len(face_info)))
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    """A FaceRecognitionAPI wired to stand-in models, as __init__ would wire real ones."""
+    face_api = api.FaceRecognitionAPI.__new__(api.FaceRecognitionAPI)
+    face_api.face_img_path = str(tmp_path)
+    face_api.similarity_threshold = 0.4
+    face_api.use_gpu = False
+    face_api.recognition_batch_size = 32
+    face_api.detector_input_size = 640
+    face_api.reverify_interval = 10.0
+    face_api.template_min_similarity = 0.5
+    face_api.template_novelty = 0.9
+    face_api.roi_size = 192
+    face_api.stage_observer = None
+    face_api.profiler = FrameProfiler(output_dir=str(tmp_path / "profiles"))
+    face_api.attendance = AttendanceRecorder()
+    face_api._enroll_lock = threading.Lock()
+    face_api.pipeline_mode = "yolo"
+    face_api.yolo_backend = "onnx"
+    face_api.yolo_model = FakeDetector(FACES)
+    face_api._yolo_pool = queue.Queue()
+    face_api._yolo_pool.put(face_api.yolo_model)
+    face_api.det_model = None
+    face_api.rec_model = FakeRecognizer()
+    face_api.db_manager = FakeDatabase()
+    face_api.gallery = GalleryMatcher(dim=api.EMBEDDING_DIM, max_templates=1)
+    face_api.sessions = api.SessionRegistry(best_shot_quality=0.0, best_shot_budget=0,
+                                            full_sweep_interval=1, motion_gating=False)
+    # Box crops instead of insightface's norm_crop, which these tests do not exercise
+    face_api._align_faces = lambda frame, detections: [
+        cv2.resize(face_api._square_crop(frame, det["bbox"]), (api.ARCFACE_INPUT_SIZE, api.ARCFACE_INPUT_SIZE))
+        for det in detections
+    ]
+    return face_api
+
+
+def test_embed_aligned_runs_normalized_batches(pipeline):
+    pipeline.recognition_batch_size = 2
+    faces = [noise_frame(112, 112, seed) for seed in range(5)]
+    embeddings = pipeline.embed_aligned(faces)
+    assert pipeline.rec_model.batches == [2, 2, 1]
+    assert embeddings.shape == (5, api.EMBEDDING_DIM) and embeddings.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+    assert pipeline.embed_aligned([]).shape == (0, api.EMBEDDING_DIM)
+
+
+def test_faces_of_several_frames_share_one_recognition_batch(pipeline):
+    frames = [noise_frame(seed=1), noise_frame(seed=2)]
+    detections = [[{"bbox": FACES[0]}, {"bbox": FACES[1]}], [{"bbox": FACES[0]}]]
+    pipeline.extract_embeddings_batch(frames, detections)
+    assert pipeline.rec_model.batches == [3]
+    encodings = [det["encoding"] for dets in detections for det in dets]
+    assert all(encoding.shape == (api.EMBEDDING_DIM,) for encoding in encodings)
+    assert float(encodings[0] @ encodings[2]) < 0.5       # same box, different frames
+
+
+def test_tracks_locked_to_a_reid_skip_embedding(pipeline):
+    frame = noise_frame(seed=3)
+    _, info = pipeline.process_frame_with_info(frame, session_id="room")
+    assert pipeline.rec_model.batches == [2]
+    assert [entry["reid_num"] for entry in info["face_info"]] == [1, 2]
+
+    _, info = pipeline.process_frame_with_info(frame, session_id="room")
+    assert pipeline.rec_model.batches == [2]          # both tracks locked: no recognition
+    assert [(entry["reid_num"], entry["status"]) for entry in info["face_info"]] == [(1, "unknown"), (2, "unknown")]
+
+    pipeline.reverify_interval = 0
+    _, info = pipeline.process_frame_with_info(frame, session_id="room")
+    assert pipeline.rec_model.batches == [2, 2]       # due for re-verification
+    assert [entry["reid_num"] for entry in info["face_info"]] == [1, 2]
+    assert len(pipeline.db_manager.rows) == 2
+
+
+def test_untracked_frames_are_always_embedded(pipeline):
+    frame = noise_frame(seed=3)
+    pipeline.process_frame_with_info(frame, use_tracking=False)
+    _, info = pipeline.process_frame_with_info(frame, use_tracking=False)
+    assert pipeline.rec_model.batches == [2, 2]
+    assert [entry["reid_num"] for entry in info["face_info"]] == [1, 2]
+
+
+def test_annotations_only_skips_rendering(pipeline):
+    frame = noise_frame(seed=4)
+    display_frame, info = pipeline.process_frame_with_info(frame, session_id="room", render=False)
+    assert display_frame is None
+    assert info["head_count"] == 2 and len(info["face_info"]) == 2
+
+    display_frame, rendered = pipeline.process_frame_with_info(frame, session_id="room")
+    assert display_frame.shape == frame.shape
+    assert not np.array_equal(display_frame, frame)
+    assert np.array_equal(frame, noise_frame(seed=4))      # drawn on a copy
+    assert rendered["face_info"] == info["face_info"]
+
+
+def test_annotations_only_frames_of_locked_tracks_are_never_fully_decoded(pipeline):
+    ok, data = cv2.imencode(".jpg", cv2.resize(noise_frame(seed=5), (1280, 960)))
+    pipeline.process_frame_with_info(IngestedFrame.from_bytes(data.tobytes(), 640),
+                                     session_id="room", render=False)
+
+    frame = IngestedFrame.from_bytes(data.tobytes(), 640)
+    _, info = pipeline.process_frame_with_info(frame, session_id="room", render=False)
+    assert frame._full is None
+    assert info["face_info"][0]["bbox"] == [200, 200, 360, 400]       # original coordinates
+
+
+def test_yolo_keypoints_reach_alignment_in_original_coordinates(pipeline):
+    frame = IngestedFrame.from_array(cv2.resize(noise_frame(seed=6), (1280, 960)), detector_size=640)
+    (detections,) = pipeline.detect_faces_only([frame])
+    assert detections[0]["bbox"] == (200, 200, 360, 400)
+    np.testing.assert_allclose(detections[0]["kps"][0], [248, 280])
+    assert pipeline.detector_name == "YOLO11 (ONNX Runtime)"
+
+
+def test_landmarks_come_from_the_most_overlapping_full_frame_face():
+    frame_faces = [(np.array([0, 0, 50, 50]), "left"), (np.array([90, 90, 200, 220]), "right")]
+    match = api.FaceRecognitionAPI._match_landmarks
+    assert match((100, 100, 180, 200), frame_faces) == "right"
+    assert match((300, 300, 320, 320), frame_faces) is None
+
+
+def test_detections_with_keypoints_align_without_scrfd(pipeline):
+    pytest.importorskip("insightface")
+    del pipeline._align_faces
+    frame = noise_frame(seed=7)
+    (detections,) = pipeline.detect_faces_only([IngestedFrame.from_array(frame)])
+    aligned = pipeline._align_faces(frame, detections)
+    assert [face.shape for face in aligned] == [(112, 112, 3)] * 2
+
+
+def test_yolo_mode_refuses_weights_without_keypoints(tmp_path, monkeypatch):
+    import yolo_onnx
+
+    class BoxOnlyDetector:
+        num_keypoints = 0
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+    monkeypatch.setattr(yolo_onnx, "OnnxFaceDetector", BoxOnlyDetector)
+    threads = set(threading.enumerate())
+    with pytest.raises(ValueError, match="5 keypoints"):
+        api.FaceRecognitionAPI(face_img_path=str(tmp_path / "faces"), pipeline_mode="yolo",
+                               yolo_backend="onnx", profile_dir=str(tmp_path / "profiles"),
+                               attendance_dir=str(tmp_path / "attendance"))
+    with pytest.raises(ValueError, match="pipeline_mode"):
+        api.FaceRecognitionAPI(face_img_path=str(tmp_path / "faces"), pipeline_mode="retina",
+                               profile_dir=str(tmp_path / "profiles"),
+                               attendance_dir=str(tmp_path / "attendance"))
+    # Failed constructions leave no presence log behind
+    assert not (tmp_path / "attendance").exists()
+    assert set(threading.enumerate()) <= threads
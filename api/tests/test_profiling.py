@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+import pytest
+
+from profiling import FrameProfiler
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(200))
+    return total
+
+
+def run_concurrently(profiler, calls=5, frames=1):
+    errors = []
+    barrier = threading.Barrier(2)
+
+    def worker():
+        try:
+            barrier.wait()
+            for _ in range(calls):
+                with profiler.capture(frames=frames):
+                    busy(0.01)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_cprofile_capture_survives_concurrent_threads(tmp_path):
+    profiler = FrameProfiler(output_dir=str(tmp_path))
+    capture = profiler.start("cprofile", seconds=5)
+    assert run_concurrently(profiler) == []
+    profiler.stop()
+    assert capture.wait(5)
+
+    status = capture.status()
+    assert status["state"] == "completed"
+    assert 5 <= status["frames_seen"] <= 10
+    assert status["artifact"].endswith(".pstats") and os.path.exists(status["artifact"])
+    assert any("busy" in row["function"] for row in status["functions"])
+
+
+def test_sample_capture_stops_after_frame_limit(tmp_path):
+    profiler = FrameProfiler(output_dir=str(tmp_path))
+    capture = profiler.start("sample", frames=6, interval_ms=1)
+    assert run_concurrently(profiler, calls=5) == []
+    assert capture.wait(5)
+
+    status = capture.status()
+    assert (status["state"], status["reason"]) == ("completed", "frames")
+    assert status["samples"] > 0
+    with open(status["artifact"]) as f:
+        assert "busy" in f.read()
+
+
+def test_capture_is_a_no_op_when_idle_and_options_are_validated(tmp_path):
+    profiler = FrameProfiler(output_dir=str(tmp_path))
+    with profiler.capture(frames=1):
+        pass
+    assert profiler.current is None
+    with pytest.raises(ValueError):
+        profiler.start("perf")
+    profiler.start("sample", seconds=5)
+    with pytest.raises(RuntimeError):
+        profiler.start("sample", seconds=5)
+    profiler.stop().wait(5)
@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+from quality import BestShotBuffer, pose_scores, score_faces
+
+
+def textured_face(size=112, brightness=128, seed=0):
+    noise = np.random.default_rng(seed).normal(0, 40, (size, size))
+    return np.clip(brightness + noise, 0, 255).astype(np.uint8)[..., None].repeat(3, axis=2)
+
+
+FRONTAL = np.array([[38, 52], [74, 52], [56, 74], [42, 92], [70, 92]], dtype=np.float32)
+
+
+def test_sharp_well_lit_large_frontal_face_scores_highest():
+    sharp = textured_face()
+    blurred = cv2.GaussianBlur(sharp, (15, 15), 0)
+    dark = textured_face(brightness=20)
+    small = cv2.resize(sharp, (40, 40))
+    scores = score_faces([sharp, blurred, dark, small])
+    assert scores[0] > 0.9
+    assert (scores[1:] < scores[0]).all()
+    assert score_faces([]).shape == (0,)
+
+
+def test_pose_penalizes_turned_faces_and_ignores_missing_landmarks():
+    turned = FRONTAL.copy()
+    turned[2, 0] += 6           # nose pushed towards one eye: yaw
+    scores = pose_scores([FRONTAL, turned, None], 3)
+    assert scores[0] == 1.0
+    assert 0 < scores[1] < 0.9
+    assert scores[2] == 1.0
+    assert pose_scores(None, 2).tolist() == [1.0, 1.0]
+
+
+def test_best_shot_buffer_keeps_best_until_ready():
+    buffer = BestShotBuffer(min_quality=0.8, time_budget=60)
+    buffer.offer(1, 0.5, "blurry")
+    assert buffer.improves(1, 0.7) and not buffer.improves(1, 0.4)
+    buffer.offer(1, 0.7, "better")
+    buffer.offer(1, 0.6, "worse")
+    assert not buffer.ready(1)
+    buffer.offer(1, 0.85, "good")
+    assert buffer.ready(1)
+    assert buffer.take(1) == (0.85, "good")
+    assert 1 not in buffer and buffer.take(1) is None
+
+
+def test_best_shot_buffer_time_budget_and_cleanup():
+    buffer = BestShotBuffer(min_quality=0.99, time_budget=0)
+    buffer.offer(1, 0.2, "a")
+    buffer.offer(2, 0.2, "b")
+    assert buffer.ready(1)
+    buffer.retain([2])
+    assert 1 not in buffer and 2 in buffer
+    buffer.expire(max_age=0)
+    assert len(buffer) == 0
@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+import rec_quant
+from rec_quant import check_deployable, file_sha256, file_stat, report_path
+
+
+@pytest.fixture
+def models(tmp_path):
+    int8, fp32 = tmp_path / "rec_int8.onnx", tmp_path / "w600k_r50.onnx"
+    int8.write_bytes(b"int8 weights")
+    fp32.write_bytes(b"fp32 weights")
+    report = {"passed": True, "drift_p95": 0.01, "top1_agreement": 1.0, "fp32_model": fp32.name,
+              "int8_sha256": file_sha256(int8), "fp32_sha256": file_sha256(fp32)}
+    with open(report_path(str(int8)), "w") as f:
+        json.dump(report, f)
+    return str(int8), str(fp32)
+
+
+def count_hashes(monkeypatch):
+    calls = []
+    real = rec_quant.file_sha256
+
+    def counting(path):
+        calls.append(os.path.basename(path))
+        return real(path)
+
+    monkeypatch.setattr(rec_quant, "file_sha256", counting)
+    return calls
+
+
+def test_hashes_once_then_trusts_recorded_stat(models, monkeypatch):
+    int8, fp32 = models
+    calls = count_hashes(monkeypatch)
+    assert check_deployable(int8, fp32)[:2] == (True, "verified")
+    assert len(calls) == 2
+    with open(report_path(int8)) as f:
+        assert json.load(f)["int8_stat"] == file_stat(int8)
+
+    assert check_deployable(int8, fp32)[0]
+    assert len(calls) == 2
+
+
+def test_changed_model_is_rehashed_and_rejected(models, monkeypatch):
+    int8, fp32 = models
+    check_deployable(int8, fp32)
+    with open(int8, "wb") as f:
+        f.write(b"other weights")
+    calls = count_hashes(monkeypatch)
+    ok, reason, _ = check_deployable(int8, fp32)
+    assert not ok and "INT8 model changed" in reason
+    assert calls == ["rec_int8.onnx"]
+
+
+def test_failed_or_missing_report_is_not_deployable(models, tmp_path):
+    int8, fp32 = models
+    with open(report_path(int8), "w") as f:
+        json.dump({"passed": False}, f)
+    assert not check_deployable(int8, fp32)[0]
+    os.remove(report_path(int8))
+    assert "no verification report" in check_deployable(int8, fp32)[1]
+    assert not check_deployable(str(tmp_path / "missing.onnx"), fp32)[0]
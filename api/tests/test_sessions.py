@@ -0,0 +1,50 @@
+import pytest
+
+api = pytest.importorskip("api")
+
+
+def test_registry_creates_sessions_on_first_use_and_removes_them():
+    registry = api.SessionRegistry()
+    room = registry.get("room-101")
+    assert registry.get("room-101") is room
+    assert len(registry) == 1
+    assert registry.remove("room-101")
+    assert not registry.remove("room-101")
+    assert len(registry) == 0
+
+
+def test_registry_evicts_idle_sessions():
+    registry = api.SessionRegistry(idle_timeout=60)
+    stale = registry.get("stale")
+    stale.last_active -= 120
+    registry.get("fresh")
+    assert [session.session_id for session in registry.all()] == ["fresh"]
+
+
+def test_session_options_are_passed_to_new_sessions():
+    registry = api.SessionRegistry(full_sweep_interval=4, motion_gating=False)
+    session = registry.get("room")
+    assert session.detection.full_sweep_interval == 4
+    assert session.motion is None
+
+
+def test_reset_forgets_tracks_and_cached_result():
+    session = api.PipelineSession("room")
+    session.tracker.update([{"bbox": (0, 0, 10, 10), "confidence": 0.9}])
+    session.last_info = {"face_info": []}
+    session.frame_count = 3
+    session.reset()
+    assert len(session.tracker) == 0
+    assert session.last_info is None
+    assert session.frame_count == 0
+
+
+def test_relabel_updates_tracks_locked_to_a_renamed_identity():
+    tracker = api.IoUTracker()
+    detections = tracker.update([{"bbox": (0, 0, 10, 10)}, {"bbox": (50, 50, 60, 60)}])
+    tracker.assign_identity(detections[0]["track_id"], 7, "Unknown_7")
+    tracker.assign_identity(detections[1]["track_id"], 8, "Bob")
+
+    assert tracker.relabel(7, 8, "Bob") == 1
+    assert tracker.get_identity(detections[0]["track_id"]) == (8, "Bob")
+    assert tracker.locked_count() == 2
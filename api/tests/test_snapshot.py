@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from gallery import GalleryMatcher
+from snapshot import GallerySnapshot
+
+
+def unit_vectors(n, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def shared_gallery(path, create=False):
+    snapshot = GallerySnapshot(str(path))
+    if create:
+        snapshot.create(dim=32, max_templates=3, capacity=2)
+    else:
+        assert snapshot.open()
+    return GalleryMatcher(dim=32, max_templates=3, storage=snapshot)
+
+
+def test_reopened_snapshot_serves_the_same_gallery(tmp_path):
+    vectors = unit_vectors(5)
+    writer = shared_gallery(tmp_path, create=True)
+    writer.load((reid, vectors[reid], None) for reid in range(5))    # grows past capacity 2
+    writer.add_template(2, unit_vectors(1, seed=9)[0])
+
+    reader = shared_gallery(tmp_path)
+    assert len(reader) == 5 and reader.template_count() == 6
+    assert reader.match(vectors, threshold=0.5)[0].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_workers_see_each_others_writes(tmp_path):
+    vectors = unit_vectors(4)
+    first = shared_gallery(tmp_path, create=True)
+    second = shared_gallery(tmp_path)
+
+    first.add(1, vectors[0])
+    second.add(2, vectors[1])
+    first.add(3, vectors[2])            # grows the shared files while second maps the old ones
+    assert second.match(vectors[:3], threshold=0.5)[0].tolist() == [1, 2, 3]
+    assert first.match(vectors[:3], threshold=0.5)[0].tolist() == [1, 2, 3]
+
+    second.relabel(1, 2)
+    assert first.match(vectors[:1], threshold=0.5)[0].tolist() == [2]
+
+
+def test_name_log_appends_and_compaction(tmp_path):
+    snapshot = GallerySnapshot(str(tmp_path))
+    snapshot.create(dim=32, max_templates=1)
+    other = GallerySnapshot(str(tmp_path))
+    assert other.open()
+
+    snapshot.append_names({1: "Asha", 2: None})
+    assert other.sync_names() == {1: "Asha", 2: None}
+    snapshot.append_names({2: "Ravi"})
+    with open(tmp_path / "names.jsonl", "a") as f:
+        f.write('{"reid": 3, "na')           # a line still being written
+    assert other.sync_names() == {2: "Ravi"}
+
+    snapshot.rewrite_names({1: "Asha", 2: "Ravi"})
+    assert other.sync_names() == {1: "Asha", 2: "Ravi"}
+    assert other.names == {1: "Asha", 2: "Ravi"}
+
+
+def test_storage_shape_must_match_gallery(tmp_path):
+    snapshot = GallerySnapshot(str(tmp_path))
+    snapshot.create(dim=32, max_templates=3)
+    with pytest.raises(ValueError):
+        GalleryMatcher(dim=64, max_templates=3, storage=snapshot)
+    assert not GallerySnapshot(str(tmp_path / "missing")).open()
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from subsystems import Subsystem, SubsystemNotReady
+
+
+def test_get_raises_until_loaded_then_returns_value():
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        return "models"
+
+    subsystem = Subsystem("vision", loader)
+    with pytest.raises(SubsystemNotReady) as info:
+        subsystem.get()
+    assert info.value.status["state"] == "pending"
+
+    subsystem.start()
+    subsystem.start()           # idempotent
+    with pytest.raises(SubsystemNotReady) as info:
+        subsystem.get()
+    assert info.value.status["state"] == "loading"
+
+    release.set()
+    subsystem._thread.join(5)
+    assert subsystem.ready and subsystem.get() == "models"
+    assert subsystem.status()["load_seconds"] is not None
+
+
+def test_failed_loader_reports_error():
+    def loader():
+        raise RuntimeError("no weights")
+
+    subsystem = Subsystem("tutor", loader)
+    subsystem.start()
+    subsystem._thread.join(5)
+    with pytest.raises(SubsystemNotReady) as info:
+        subsystem.get()
+    assert info.value.status == {**info.value.status, "state": "failed", "error": "no weights"}
+    assert str(info.value) == "tutor subsystem is failed"
@@ -0,0 +1,48 @@
+import numpy as np
+
+from tracking import IoUTracker
+
+
+def dets(*boxes):
+    return [{"bbox": list(box)} for box in boxes]
+
+
+def test_iou_matrix():
+    iou = IoUTracker.iou_matrix([[0, 0, 10, 10], [20, 20, 30, 30]], [[0, 0, 10, 10], [5, 0, 15, 10]])
+    assert iou.shape == (2, 2)
+    assert np.allclose(iou, [[1.0, 50 / 150], [0.0, 0.0]], atol=1e-6)
+
+
+def test_lap_assignment_is_globally_optimal():
+    tracker = IoUTracker(iou_threshold=0.3)
+    ids = [det["track_id"] for det in tracker.update(dets((0, 0, 10, 10), (3, 0, 13, 10)))]
+
+    # Greedy matching gives the first box to track 0 (IoU 0.82) and the second
+    # to track 1 (0.33); the joint assignment swaps them (0.67 + 0.67).
+    second = tracker.update(dets((1, 0, 11, 10), (-2, 0, 8, 10)))
+    assert [det["track_id"] for det in second] == ids[::-1]
+    assert len(tracker) == 2
+
+
+def test_new_detections_get_new_ids_and_stale_tracks_expire():
+    tracker = IoUTracker(iou_threshold=0.3, max_age=2)
+    tracker.update(dets((0, 0, 10, 10)))
+    moved = tracker.update(dets((50, 50, 60, 60)))
+    assert moved[0]["track_id"] == 1
+    assert len(tracker) == 2
+    tracker.update([])
+    assert tracker.track_ids().tolist() == [1]
+
+
+def test_identity_follows_track_until_relabelled():
+    tracker = IoUTracker()
+    track_id = tracker.update(dets((0, 0, 10, 10)))[0]["track_id"]
+    assert tracker.needs_embedding(track_id, reverify_interval=60)
+    tracker.assign_identity(track_id, 7, "Asha")
+    assert not tracker.needs_embedding(track_id, reverify_interval=60)
+
+    det = tracker.update(dets((1, 0, 11, 10)))[0]
+    assert (det["reid_num"], det["name"]) == (7, "Asha")
+    assert tracker.relabel(7, 3, "Ravi") == 1
+    assert tracker.get_identity(track_id) == (3, "Ravi")
+    assert tracker.locked_count() == 1
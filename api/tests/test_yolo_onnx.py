@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from yolo_onnx import OnnxFaceDetector, letterbox, to_blob
+
+
+def test_letterbox_pads_to_square_and_maps_back():
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    padded, ratio, (pad_x, pad_y) = letterbox(image, 320)
+    assert padded.shape == (320, 320, 3)
+    assert ratio == 0.5 and (pad_x, pad_y) == (0, 40)
+    assert padded[0, 0].tolist() == [114, 114, 114]
+
+    blob = to_blob([padded, padded])
+    assert blob.shape == (2, 3, 320, 320) and blob.dtype == np.float32
+
+
+def detector(num_keypoints=5):
+    # _postprocess only needs the thresholds and output layout, not a session
+    model = OnnxFaceDetector.__new__(OnnxFaceDetector)
+    model.conf, model.iou, model.max_det = 0.4, 0.5, 300
+    model.num_keypoints, model._keypoint_dims = num_keypoints, 3
+    return model
+
+
+def test_postprocess_suppresses_overlaps_and_undoes_letterbox():
+    # Channels: cx, cy, w, h, score, 5 x (x, y, visibility); three anchors
+    anchors = np.zeros((3, 20), dtype=np.float32)
+    anchors[0, :5] = (100, 140, 40, 40, 0.9)
+    anchors[1, :5] = (102, 140, 40, 40, 0.8)    # overlaps anchor 0, suppressed
+    anchors[2, :5] = (200, 200, 20, 20, 0.1)    # below conf
+    anchors[0, 5:] = np.tile([100, 140, 1.0], 5)
+
+    boxes, scores, keypoints = detector()._postprocess(anchors.T, ratio=0.5, pad=(0, 40))
+    assert scores.tolist() == pytest.approx([0.9])
+    assert boxes[0].tolist() == pytest.approx([160, 160, 240, 240])
+    assert keypoints.shape == (1, 5, 2)
+    assert keypoints[0, 0].tolist() == pytest.approx([200, 200])
+
+
+def test_postprocess_without_detections():
+    boxes, scores, keypoints = detector(num_keypoints=0)._postprocess(np.zeros((5, 4), np.float32),
+                                                                     ratio=1.0, pad=(0, 0))
+    assert boxes.shape == (0, 4) and len(scores) == 0 and keypoints is None
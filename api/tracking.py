@@ -0,0 +1,122 @@
+import time
+import numpy as np
+import lap
+
+
+class IoUTracker:
+    """Ultra-simple IoU tracker with optimal (LAP) assignment.
+
+    Track state is kept in parallel NumPy arrays ordered by track id rather
+    than a dict of dicts; use get_identity()/assign_identity() to read and
+    lock the ReID attached to a track.
+    """
+    def __init__(self, iou_threshold=0.3, max_age=5):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self._ids = np.empty(0, dtype=np.int64)
+        self._bboxes = np.empty((0, 4), dtype=np.float32)
+        self._ages = np.empty(0, dtype=np.int32)
+        self._reids = np.empty(0, dtype=np.int64)      # -1 while unassigned
+        self._names = np.empty(0, dtype=object)
+        self._verified_at = np.empty(0, dtype=np.float64)  # monotonic time of last embedding check
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    @staticmethod
+    def iou_matrix(a, b):
+        """Pairwise IoU between (N, 4) and (M, 4) xyxy box arrays."""
+        a = np.asarray(a, dtype=np.float32)[:, None, :]
+        b = np.asarray(b, dtype=np.float32)[None, :, :]
+        iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+        ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+        inter = iw * ih
+        area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+        area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+        return inter / (area_a + area_b - inter + 1e-9)
+
+    def _row(self, track_id):
+        row = int(np.searchsorted(self._ids, track_id))
+        if row < len(self._ids) and self._ids[row] == track_id:
+            return row
+        return None
+
+    def get_identity(self, track_id):
+        """Return (reid, name) locked to track_id, or (None, None)."""
+        row = self._row(track_id)
+        if row is None or self._reids[row] < 0:
+            return None, None
+        return int(self._reids[row]), self._names[row]
+
+    def assign_identity(self, track_id, reid, name):
+        """Lock (or re-confirm) a ReID on a track and stamp it as verified now."""
+        row = self._row(track_id)
+        if row is not None:
+            self._reids[row] = reid
+            self._names[row] = name
+            self._verified_at[row] = time.monotonic()
+
+    def relabel(self, reid, new_reid, name):
+        """Point tracks locked to reid at (new_reid, name), after a rename or merge."""
+        rows = self._reids == reid
+        self._reids[rows] = new_reid
+        self._names[rows] = name
+        return int(rows.sum())
+
+    def locked_count(self):
+        return int((self._reids >= 0).sum())
+
+    def track_ids(self):
+        return self._ids
+
+    def boxes(self):
+        """(N, 4) xyxy boxes of live tracks, in original image coordinates."""
+        return self._bboxes
+
+    def needs_embedding(self, track_id, reverify_interval):
+        """True for unknown/unlocked tracks, or locked ones due for re-verification."""
+        row = self._row(track_id)
+        if row is None or self._reids[row] < 0:
+            return True
+        return time.monotonic() - self._verified_at[row] >= reverify_interval
+
+    def update(self, detections):
+        self._ages += 1
+
+        matched_det = np.zeros(len(detections), dtype=bool)
+        if detections and len(self._ids):
+            det_boxes = np.array([det["bbox"] for det in detections], dtype=np.float32)
+            iou = self.iou_matrix(det_boxes, self._bboxes)
+            _, det_to_trk, _ = lap.lapjv(1.0 - iou, extend_cost=True,
+                                         cost_limit=1.0 - self.iou_threshold)
+            for did, row in enumerate(det_to_trk):
+                if row < 0 or iou[did, row] <= self.iou_threshold:
+                    continue
+                matched_det[did] = True
+                self._bboxes[row] = det_boxes[did]; self._ages[row] = 0
+                det = detections[did]
+                det["track_id"] = int(self._ids[row])
+                det["reid_num"] = int(self._reids[row]) if self._reids[row] >= 0 else None
+                det["name"] = self._names[row]
+
+        new_dets = [det for did, det in enumerate(detections) if not matched_det[did]]
+        if new_dets:
+            new_ids = np.arange(self._next_id, self._next_id + len(new_dets), dtype=np.int64)
+            self._next_id += len(new_dets)
+            for det, tid in zip(new_dets, new_ids):
+                det["track_id"] = int(tid)
+            self._ids = np.concatenate([self._ids, new_ids])
+            self._bboxes = np.concatenate([self._bboxes,
+                                           np.array([det["bbox"] for det in new_dets], dtype=np.float32)])
+            self._ages = np.concatenate([self._ages, np.zeros(len(new_dets), dtype=np.int32)])
+            self._reids = np.concatenate([self._reids, np.full(len(new_dets), -1, dtype=np.int64)])
+            self._names = np.concatenate([self._names, np.full(len(new_dets), None, dtype=object)])
+            self._verified_at = np.concatenate([self._verified_at, np.zeros(len(new_dets))])
+
+        alive = self._ages < self.max_age
+        if not alive.all():
+            self._ids, self._bboxes, self._ages = self._ids[alive], self._bboxes[alive], self._ages[alive]
+            self._reids, self._names = self._reids[alive], self._names[alive]
+            self._verified_at = self._verified_at[alive]
+        return detections
@@ -0,0 +1,304 @@
+"""ONNX Runtime face detector, the CPU backend for FaceRecognitionAPI.
+
+Export the YOLO face weights to ONNX, optionally INT8 statically quantized
+with activation ranges calibrated on the enrolled faces in saved_faces:
+
+    python yolo_onnx.py export --weights yolov12l-face.pt --out yolo-face.onnx
+    python yolo_onnx.py export --weights yolov12l-face.pt --out yolo-face-int8.onnx --int8
+    python yolo_onnx.py bench --weights yolov12l-face.pt --onnx yolo-face-int8.onnx --images ./frames
+
+and select it per deployment with FACE_YOLO_BACKEND=onnx (FACE_YOLO_ONNX
+points at the model, default ./yolo-face.onnx).
+"""
+import argparse
+import ast
+import glob
+import json
+import os
+import shutil
+import time
+import cv2
+import numpy as np
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def list_images(directory, limit=None, seed=0):
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(directory, pattern)))
+    if limit is not None and len(paths) > limit:
+        rng = np.random.default_rng(seed)
+        paths = [paths[i] for i in sorted(rng.choice(len(paths), limit, replace=False))]
+    return paths
+
+
+def letterbox(image, size):
+    """Resize to fit a size x size square, padding with grey like ultralytics.
+
+    Returns (padded, ratio, (pad_x, pad_y)); detector-space points map back
+    with (point - pad) / ratio.
+    """
+    h, w = image.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    if (new_w, new_h) != (w, h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    padded = np.full((size, size, 3), 114, dtype=np.uint8)
+    padded[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = image
+    return padded, ratio, (pad_x, pad_y)
+
+
+def to_blob(images):
+    """Stack letterboxed BGR uint8 images into an RGB NCHW float32 batch in [0, 1]."""
+    batch = np.stack(images)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+class OnnxFaceDetector:
+    """YOLO face model exported to ONNX, run on the ONNX Runtime CPU provider.
+
+    Expects the ultralytics export layout: one (batch, 4 + classes + keypoints,
+    anchors) output of xywh boxes, class scores and, for face-pose weights,
+    5 (x, y, visibility) landmarks. NMS runs on the host. intra_op_threads
+    should be split between instances when several run concurrently.
+    """
+
+    def __init__(self, model_path, conf=0.4, iou=0.5, max_det=300, intra_op_threads=None, imgsz=640):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or 0   # 0: one per physical core
+        options.inter_op_num_threads = 1
+        if intra_op_threads:
+            # Sibling instances share the cores; don't busy-wait between runs
+            options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.model_path = model_path
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        self.dynamic_size = not isinstance(model_input.shape[2], int)
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if isinstance(model_input.shape[2], int):
+            self.imgsz = model_input.shape[2]
+        elif "imgsz" in metadata:
+            self.imgsz = ast.literal_eval(metadata["imgsz"])[0]
+        else:
+            self.imgsz = imgsz
+        kpt_shape = ast.literal_eval(metadata["kpt_shape"]) if "kpt_shape" in metadata else None
+        self.num_keypoints = kpt_shape[0] if kpt_shape else 0
+        self._keypoint_dims = kpt_shape[1] if kpt_shape else 0
+
+    def detect(self, images, imgsz=None):
+        """Detect faces in BGR images.
+
+        Returns one (boxes, scores, keypoints) per image: (N, 4) xyxy boxes
+        and (N, 5, 2) landmarks (or None) in that image's pixel coordinates.
+        imgsz overrides the input size when the model was exported with
+        dynamic height/width.
+        """
+        if not images:
+            return []
+        size = imgsz if imgsz and self.dynamic_size else self.imgsz
+        prepared = [letterbox(image, size) for image in images]
+        blob = to_blob([padded for padded, _, _ in prepared])
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input_name: blob[i:i + 1]})[0]
+                                      for i in range(len(blob))])
+        return [self._postprocess(output, ratio, pad) for output, (_, ratio, pad) in zip(outputs, prepared)]
+
+    def _postprocess(self, output, ratio, pad):
+        pred = output.T                                      # (anchors, channels)
+        keypoint_width = self.num_keypoints * self._keypoint_dims
+        class_scores = pred[:, 4:pred.shape[1] - keypoint_width]
+        scores = class_scores.max(axis=1)
+        keep = scores >= self.conf
+        pred, scores = pred[keep], scores[keep]
+        if not len(pred):
+            return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32), None
+
+        xywh = pred[:, :4]
+        top_left = xywh[:, :2] - xywh[:, 2:] / 2
+        selected = cv2.dnn.NMSBoxes(np.concatenate([top_left, xywh[:, 2:]], axis=1).tolist(),
+                                    scores.tolist(), self.conf, self.iou)
+        selected = np.asarray(selected, dtype=np.int64).reshape(-1)[:self.max_det]
+
+        offset = np.asarray(pad, dtype=np.float32)
+        boxes = np.concatenate([top_left, top_left + xywh[:, 2:]], axis=1)[selected]
+        boxes = (boxes - np.tile(offset, 2)) / ratio
+        keypoints = None
+        if self.num_keypoints == 5:
+            keypoints = pred[selected, -keypoint_width:].reshape(-1, 5, self._keypoint_dims)[..., :2]
+            keypoints = (keypoints - offset) / ratio
+        return boxes.astype(np.float32), scores[selected].astype(np.float32), keypoints
+
+
+def calibration_batches(directory, imgsz=640, size=200, faces_per_image=9, seed=0):
+    """Yield (1, 3, imgsz, imgsz) calibration inputs built from saved face crops.
+
+    saved_faces holds tight single-face crops, so they are tiled into a grid
+    per image: activation ranges then come from several faces at classroom
+    scale rather than from one face filling the frame.
+    """
+    paths = list_images(directory, limit=size * faces_per_image, seed=seed)
+    if not paths:
+        raise ValueError(f"No calibration images found in {directory}")
+    grid = int(np.ceil(np.sqrt(faces_per_image)))
+    cell = imgsz // grid
+    for start in range(0, len(paths), faces_per_image):
+        canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+        for i, path in enumerate(paths[start:start + faces_per_image]):
+            face = cv2.imread(path)
+            if face is None:
+                continue
+            tile, _, _ = letterbox(face, cell)
+            row, col = divmod(i, grid)
+            canvas[row * cell:(row + 1) * cell, col * cell:(col + 1) * cell] = tile
+        yield to_blob([canvas])
+
+
+def export(weights, out, imgsz=640, int8=False, calibration_dir="saved_faces", calibration_size=200,
+           opset=17, dynamic_batch=True):
+    """Export YOLO weights to an optimized ONNX model at out; INT8 if requested."""
+    from ultralytics import YOLO
+    exported = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=dynamic_batch, simplify=True,
+                                    opset=opset)
+    if not int8:
+        shutil.move(exported, out)
+        return out
+
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                          QuantType, quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class SavedFacesReader(CalibrationDataReader):
+        def __init__(self, input_name):
+            self.input_name = input_name
+            self.rewind()
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {self.input_name: batch}
+
+        def rewind(self):
+            self._batches = calibration_batches(calibration_dir, imgsz=imgsz, size=calibration_size)
+
+    import onnx
+    input_name = onnx.load(exported, load_external_data=False).graph.input[0].name
+    prepared = f"{os.path.splitext(out)[0]}.prep.onnx"
+    quant_pre_process(exported, prepared)
+    # Only convolutions/matmuls run in INT8: the head's sigmoid/concat stay
+    # float, so 0-1 scores are not quantized on the scale of pixel boxes
+    quantize_static(prepared, out, SavedFacesReader(input_name),
+                    quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8, per_channel=True,
+                    op_types_to_quantize=["Conv", "MatMul"],
+                    calibrate_method=CalibrationMethod.MinMax)
+    os.remove(prepared)
+    shutil.move(exported, f"{os.path.splitext(out)[0]}.fp32.onnx")
+    return out
+
+
+def _latency_stats(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {"mean_ms": round(float(ms.mean()), 2), "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(ms, 95)), 2)}
+
+
+def benchmark(weights, onnx_path, images_dir, imgsz=640, conf=0.4, iou_match=0.5, limit=200, warmup=3):
+    """Compare CPU latency and detections of the PyTorch and ONNX detectors.
+
+    The PyTorch detections are the reference: recall is the share of them an
+    ONNX box overlaps with IoU >= iou_match, precision the share of ONNX boxes
+    that overlap a reference box.
+    """
+    from ultralytics import YOLO
+    from tracking import IoUTracker
+    paths = list_images(images_dir, limit=limit)
+    if not paths:
+        raise ValueError(f"No images found in {images_dir}")
+    images = [image for image in (cv2.imread(path) for path in paths) if image is not None]
+
+    torch_model = YOLO(weights)
+    onnx_model = OnnxFaceDetector(onnx_path, conf=conf, imgsz=imgsz)
+    for image in images[:warmup]:
+        torch_model(image, device="cpu", conf=conf, imgsz=imgsz, verbose=False)
+        onnx_model.detect([image])
+
+    torch_times, onnx_times = [], []
+    matched, reference, predicted, matched_predictions = 0, 0, 0, 0
+    for image in images:
+        started = time.perf_counter()
+        result = torch_model(image, device="cpu", conf=conf, imgsz=imgsz, verbose=False)[0]
+        torch_times.append(time.perf_counter() - started)
+        torch_boxes = result.boxes.xyxy.cpu().numpy() if result.boxes is not None else np.empty((0, 4))
+
+        started = time.perf_counter()
+        onnx_boxes, _, _ = onnx_model.detect([image])[0]
+        onnx_times.append(time.perf_counter() - started)
+
+        reference += len(torch_boxes)
+        predicted += len(onnx_boxes)
+        if len(torch_boxes) and len(onnx_boxes):
+            overlaps = IoUTracker.iou_matrix(torch_boxes, onnx_boxes) >= iou_match
+            matched += int(overlaps.any(axis=1).sum())
+            matched_predictions += int(overlaps.any(axis=0).sum())
+
+    torch_stats, onnx_stats = _latency_stats(torch_times), _latency_stats(onnx_times)
+    return {
+        "images": len(images),
+        "reference_faces": reference,
+        "torch_cpu": torch_stats,
+        "onnx_cpu": onnx_stats,
+        "speedup": round(torch_stats["mean_ms"] / max(onnx_stats["mean_ms"], 1e-9), 2),
+        "recall": round(matched / reference, 4) if reference else None,
+        "precision": round(matched_predictions / predicted, 4) if predicted else None,
+        "onnx_model": onnx_path,
+        "onnx_mb": round(os.path.getsize(onnx_path) / 1e6, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or benchmark the ONNX Runtime face detector")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = sub.add_parser("export", help="Export YOLO face weights to ONNX (optionally INT8)")
+    export_cmd.add_argument("--weights", default="yolov12l-face.pt")
+    export_cmd.add_argument("--out", default="./yolo-face.onnx")
+    export_cmd.add_argument("--imgsz", type=int, default=640)
+    export_cmd.add_argument("--int8", action="store_true")
+    export_cmd.add_argument("--calibration-dir", default="saved_faces")
+    export_cmd.add_argument("--calibration-size", type=int, default=200)
+    export_cmd.add_argument("--opset", type=int, default=17)
+    export_cmd.add_argument("--static-batch", action="store_true")
+
+    bench = sub.add_parser("bench", help="Compare latency and recall against the PyTorch detector")
+    bench.add_argument("--weights", default="yolov12l-face.pt")
+    bench.add_argument("--onnx", default="./yolo-face.onnx")
+    bench.add_argument("--images", required=True)
+    bench.add_argument("--imgsz", type=int, default=640)
+    bench.add_argument("--conf", type=float, default=0.4)
+    bench.add_argument("--limit", type=int, default=200)
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        started = time.time()
+        out = export(args.weights, args.out, imgsz=args.imgsz, int8=args.int8,
+                     calibration_dir=args.calibration_dir, calibration_size=args.calibration_size,
+                     opset=args.opset, dynamic_batch=not args.static_batch)
+        print(f"Exported {'INT8' if args.int8 else 'FP32'} detector to {out} "
+              f"in {time.time() - started:.1f}s ({os.path.getsize(out) / 1e6:.1f} MB)")
+    else:
+        print(json.dumps(benchmark(args.weights, args.onnx, args.images, imgsz=args.imgsz,
+                                   conf=args.conf, limit=args.limit), indent=2))
+
+
+if __name__ == "__main__":
+    main()